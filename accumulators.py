@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+#
+# accumulators.py
+#
+# Streaming summaries of waveforms, so long runs need not keep every waveform. Each accumulator is updated
+# with single waveforms or batches (events x samples), can be merged with another of the same kind (e.g. from
+# another worker) and converted to a dict of arrays, to be added as file meta data (File.add_meta_dict) or
+# saved with save.
+#
+####################################################################################################
+import threading
+import numpy
+import measurements
+
+class MeanWaveform(object):
+    """ The running mean and variance of each sample, updated a batch at a time (Welford/Chan)."""
+    def __init__(self):
+        """ Initialise with no waveforms."""
+        self.count = 0
+        self.mean = None
+        self._m2 = None # Sum of squared differences from the mean
+    def add(self, waveforms):
+        """ Add a waveform or batch of waveforms."""
+        waveforms = numpy.atleast_2d(waveforms)
+        mean = waveforms.mean(axis=0)
+        self._combine(len(waveforms), mean, ((waveforms - mean) ** 2).sum(axis=0))
+    def merge(self, other):
+        """ Merge the waveforms accumulated by other."""
+        if other.count > 0:
+            self._combine(other.count, other.mean, other._m2)
+    def variance(self):
+        """ Return the (sample) variance of each sample."""
+        return self._m2 / max(1, self.count - 1)
+    def std(self):
+        """ Return the standard deviation of each sample."""
+        return numpy.sqrt(self.variance())
+    def to_dict(self):
+        """ Return the state as a dict."""
+        return { "count" : self.count, "mean" : self.mean, "m2" : self._m2 }
+    @classmethod
+    def from_dict(cls, values):
+        """ Create from the state dict."""
+        accumulator = cls()
+        accumulator.count = int(values["count"])
+        if accumulator.count > 0:
+            accumulator.mean = numpy.array(values["mean"], numpy.float64)
+            accumulator._m2 = numpy.array(values["m2"], numpy.float64)
+        return accumulator
+    def _combine(self, count, mean, m2):
+        """ Combine with the count, mean and m2 of other waveforms."""
+        if self.count == 0:
+            self.count = count
+            self.mean = numpy.array(mean, numpy.float64)
+            self._m2 = numpy.array(m2, numpy.float64)
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * (count / float(total))
+        self._m2 += m2 + delta ** 2 * (self.count * count / float(total))
+        self.count = total
+
+class Histogram(object):
+    """ A fixed bin histogram, with underflow (first) and overflow (last) bins."""
+    def __init__(self, low, high, bins):
+        """ Initialise bins equal width bins from low to high."""
+        self.low = low
+        self.high = high
+        self.bins = bins
+        self.counts = numpy.zeros(bins + 2, numpy.int64)
+    def add(self, values):
+        """ Add a value or array of values."""
+        values = numpy.asarray(values, numpy.float64).ravel()
+        index = numpy.floor((values - self.low) * (self.bins / float(self.high - self.low))).astype(numpy.int64) + 1
+        numpy.clip(index, 0, self.bins + 1, out=index)
+        self.counts += numpy.bincount(index, minlength=self.bins + 2)
+    def merge(self, other):
+        """ Merge the counts of other, which must have the same bins."""
+        if (other.low, other.high, other.bins) != (self.low, self.high, self.bins):
+            raise Exception("Cannot merge histograms with different bins.")
+        self.counts += other.counts
+    def get_edges(self):
+        """ Return the bin edges (excluding the underflow and overflow bins)."""
+        return numpy.linspace(self.low, self.high, self.bins + 1)
+    def to_dict(self):
+        """ Return the state as a dict."""
+        return { "low" : self.low, "high" : self.high, "bins" : self.bins, "counts" : self.counts }
+    @classmethod
+    def from_dict(cls, values):
+        """ Create from the state dict."""
+        accumulator = cls(float(values["low"]), float(values["high"]), int(values["bins"]))
+        accumulator.counts = numpy.array(values["counts"], numpy.int64)
+        return accumulator
+
+class Envelope(object):
+    """ The minimum and maximum of each sample."""
+    def __init__(self):
+        """ Initialise with no waveforms."""
+        self.count = 0
+        self.minimum = None
+        self.maximum = None
+    def add(self, waveforms):
+        """ Add a waveform or batch of waveforms."""
+        waveforms = numpy.atleast_2d(waveforms)
+        self._combine(len(waveforms), waveforms.min(axis=0), waveforms.max(axis=0))
+    def merge(self, other):
+        """ Merge the envelope of other."""
+        if other.count > 0:
+            self._combine(other.count, other.minimum, other.maximum)
+    def to_dict(self):
+        """ Return the state as a dict."""
+        return { "count" : self.count, "minimum" : self.minimum, "maximum" : self.maximum }
+    @classmethod
+    def from_dict(cls, values):
+        """ Create from the state dict."""
+        accumulator = cls()
+        accumulator.count = int(values["count"])
+        if accumulator.count > 0:
+            accumulator.minimum = numpy.array(values["minimum"])
+            accumulator.maximum = numpy.array(values["maximum"])
+        return accumulator
+    def _combine(self, count, minimum, maximum):
+        """ Combine with the count, minimum and maximum of other waveforms."""
+        if self.count == 0:
+            self.minimum = numpy.array(minimum)
+            self.maximum = numpy.array(maximum)
+        else:
+            numpy.minimum(self.minimum, minimum, out=self.minimum)
+            numpy.maximum(self.maximum, maximum, out=self.maximum)
+        self.count += count
+
+class ChannelAccumulators(object):
+    """ The mean waveform, envelope and optionally the amplitude and area histograms of a channel's waveforms
+    (in volts). Amplitudes and areas are measured with the measurements module in the gate."""
+    def __init__(self, timebase, gate=None, baseline_gate=None, negative=True, amplitude_bins=None,
+                 area_bins=None):
+        """ Initialise for waveforms with the timebase, amplitude_bins and area_bins are (low, high, bins) to
+        histogram the amplitudes and areas."""
+        self._timebase = timebase
+        self._gate = gate
+        self._baseline_gate = baseline_gate
+        self._negative = negative
+        self.mean = MeanWaveform()
+        self.envelope = Envelope()
+        self.amplitude = Histogram(*amplitude_bins) if amplitude_bins is not None else None
+        self.area = Histogram(*area_bins) if area_bins is not None else None
+    def add(self, waveforms):
+        """ Add a waveform or batch of waveforms."""
+        waveforms = numpy.atleast_2d(waveforms)
+        self.mean.add(waveforms)
+        self.envelope.add(waveforms)
+        if self.amplitude is not None:
+            self.amplitude.add(measurements.peak(waveforms, self._timebase, self._gate, self._baseline_gate,
+                                                 self._negative)[0])
+        if self.area is not None:
+            self.area.add(measurements.area(waveforms, self._timebase, self._gate, self._baseline_gate))
+    def merge(self, other):
+        """ Merge the accumulators of other."""
+        for name in ["mean", "envelope", "amplitude", "area"]:
+            if getattr(self, name) is not None:
+                getattr(self, name).merge(getattr(other, name))
+    def to_dict(self):
+        """ Return the state as a dict, keys are prefixed by the accumulator name."""
+        values = {}
+        for name in ["mean", "envelope", "amplitude", "area"]:
+            if getattr(self, name) is not None:
+                for key, value in getattr(self, name).to_dict().items():
+                    values["%s_%s" % (name, key)] = value
+        return values
+    def load_dict(self, values):
+        """ Restore the state from a dict, as to_dict."""
+        for name, accumulator_class in [("mean", MeanWaveform), ("envelope", Envelope), ("amplitude", Histogram),
+                                        ("area", Histogram)]:
+            prefix = name + "_"
+            state = dict([(key[len(prefix):], value) for key, value in values.items() if key.startswith(prefix)])
+            if len(state) > 0:
+                setattr(self, name, accumulator_class.from_dict(state))
+
+def accumulate(accumulators, store=False):
+    """ Return an AcquisitionPipeline process that adds each event's waveforms (in volts) to the accumulators,
+    one per channel in the pipeline's channel order. Waveforms are only stored if store is True."""
+    lock = threading.Lock() # Decoders run concurrently
+    def process(waveform):
+        volts = waveform.volts()
+        with lock:
+            for accumulator, data in zip(accumulators, volts):
+                accumulator.add(data)
+        if store:
+            return volts
+        return None
+    return process
+
+def save(file_path, accumulators):
+    """ Save a dict of accumulators (anything with to_dict) by name to a numpy .npz file."""
+    values = {}
+    for name, accumulator in accumulators.items():
+        for key, value in accumulator.to_dict().items():
+            if value is not None:
+                values["%s/%s" % (name, key)] = value
+    numpy.savez(file_path, **values)
+
+def load(file_path):
+    """ Load the saved accumulators, as a dict by name of dicts of their state (for from_dict or load_dict)."""
+    values = {}
+    with numpy.load(file_path) as data:
+        for key in data.files:
+            name, field = key.split("/", 1)
+            values.setdefault(name, {})[field] = data[key]
+    return values
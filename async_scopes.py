@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+#
+# async_scopes.py
+#
+# Asynchronous (trollius, the asyncio backport) connections and scope, so that waiting for triggers on several
+# scopes, saving and monitoring can share one event loop. Coroutines are written in the trollius style, i.e.
+# yield From(coroutine) and raise Return(value). The scope is configured with the (blocking) Tektronix as
+# usual, and AsyncTektronix then acquires and reads its waveforms over an asynchronous connection.
+#
+####################################################################################################
+import logging
+logger = logging.getLogger(__name__)
+
+import socket
+import time
+import trollius as asyncio
+from trollius import From, Return
+import scope_connections
+import scopes
+
+class AsyncTekConnection(object):
+    """ Base class for asynchronous Tektronix scope connections, send and ask are coroutines."""
+    def __init__(self, timeout=10.0, loop=None):
+        """ timeout (in seconds) is the longest wait for any reply, None waits forever."""
+        self._timeout = timeout
+        self._loop = loop if loop is not None else asyncio.get_event_loop()
+        self._lock = asyncio.Lock(loop=self._loop) # Exchanges must not interleave
+    @asyncio.coroutine
+    def send(self, command):
+        """ Send a command, doesn't expect a returned result."""
+        with (yield From(self._lock)):
+            logger.debug("send: %s", command)
+            yield From(self._send(command))
+    @asyncio.coroutine
+    def ask(self, command):
+        """ Send a command and return the answer, None if there is none in time."""
+        with (yield From(self._lock)):
+            logger.debug("ask: %s", command)
+            response = yield From(self._ask(command))
+            logger.debug("response: %s", response)
+            raise Return(response)
+    def set_timeout(self, timeout):
+        """ Set the longest wait (in seconds) for any reply."""
+        self._timeout = timeout
+    def get_timeout(self):
+        """ Return the reply timeout in seconds."""
+        return self._timeout
+    @asyncio.coroutine
+    def clear(self):
+        """ Clear the connection, discarding any replies still to be read."""
+        with (yield From(self._lock)):
+            yield From(self._clear())
+    def close(self):
+        """ Close the connection."""
+        pass
+#### Internal ######################################################################################
+    @asyncio.coroutine
+    def _send(self, command):
+        pass
+    @asyncio.coroutine
+    def _ask(self, command):
+        pass
+    @asyncio.coroutine
+    def _clear(self):
+        pass
+
+class AsyncTCPIP(AsyncTekConnection):
+    """ Connect via TCP/IP on trollius streams."""
+    def __init__(self, reader, writer, timeout=10.0, loop=None):
+        """ Use an open stream reader and writer, see open and from_connection."""
+        super(AsyncTCPIP, self).__init__(timeout, loop)
+        self._reader = reader
+        self._writer = writer
+        self._parser = scope_connections.ReplyParser()
+        self._needs_clear = False # A query timed out, its late reply must be discarded before the next
+    @classmethod
+    @asyncio.coroutine
+    def open(cls, ip, port, timeout=10.0, loop=None):
+        """ Connect with the ip and port address."""
+        reader, writer = yield From(asyncio.open_connection(ip, port, loop=loop))
+        writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        raise Return(cls(reader, writer, timeout, loop))
+    @classmethod
+    @asyncio.coroutine
+    def from_connection(cls, connection, loop=None):
+        """ Take over the socket of a scope_connections.TCPIP (e.g. once the scope is configured), the TCPIP
+        must not be used afterwards."""
+        connection.clear()
+        sock = socket.fromfd(connection._connection.fileno(), socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        reader, writer = yield From(asyncio.open_connection(sock=sock, loop=loop))
+        raise Return(cls(reader, writer, connection.get_timeout(), loop))
+    def close(self):
+        """ Close the connection."""
+        self._writer.close()
+#### Internal ######################################################################################
+    @asyncio.coroutine
+    def _send(self, command):
+        """ Send a command, doesn't expect a returned result."""
+        if not command.endswith("\n"):
+            command += "\n" # Scope expects a line feed terminator
+        self._writer.write(command)
+        yield From(self._writer.drain())
+    @asyncio.coroutine
+    def _ask(self, command):
+        """ Send a command and expect an answer, replies containing binary blocks are returned as a bytearray.
+        After a timeout the connection is cleared before the next query, so the late reply is not taken for its
+        reply."""
+        if self._needs_clear:
+            yield From(self._clear())
+        yield From(self._send(command))
+        try:
+            reply = yield From(asyncio.wait_for(self._read_reply(), self._timeout, loop=self._loop))
+        except asyncio.TimeoutError:
+            logger.exception("ask")
+            print "AsyncTCPIP::ask: Timed out."
+            self._needs_clear = True
+            reply = None
+        raise Return(reply)
+    @asyncio.coroutine
+    def _clear(self):
+        """ Discard anything received, including replies that arrive within a short grace period."""
+        try:
+            while True:
+                yield From(asyncio.wait_for(self._receive(), 0.1, loop=self._loop))
+        except (asyncio.TimeoutError, socket.error):
+            pass
+        self._parser.clear()
+        self._needs_clear = False
+    @asyncio.coroutine
+    def _receive(self):
+        """ Receive whatever is available (at least a byte) for the parser."""
+        data = yield From(self._reader.read(65536))
+        if len(data) == 0:
+            raise socket.error("Connection closed by the scope.")
+        self._parser.feed(data)
+    @asyncio.coroutine
+    def _read_reply(self):
+        """ Read a reply (see scope_connections.ReplyParser), the rest of a block is read in one go."""
+        while True:
+            reply = self._parser.parse()
+            if reply is not None:
+                raise Return(reply)
+            remaining = self._parser.block_remaining()
+            if remaining > 0:
+                data = yield From(self._reader.readexactly(remaining))
+                view = self._parser.block_view()
+                view[:] = data
+                del view
+                self._parser.block_received(remaining)
+            else:
+                yield From(self._receive())
+
+class AsyncVisaUSB(AsyncTekConnection):
+    """ Asynchronous adapter for a (blocking) scope_connections.VisaUSB, or any other TekConnection. Each
+    exchange runs in the loop's executor, so only that thread waits on the instrument."""
+    def __init__(self, connection, executor=None, loop=None):
+        """ Adapt the connection, exchanges run in the executor (None for the loop's default)."""
+        super(AsyncVisaUSB, self).__init__(connection.get_timeout(), loop)
+        self._connection = connection
+        self._executor = executor
+    def set_timeout(self, timeout):
+        """ Set the longest wait (in seconds) for any reply."""
+        super(AsyncVisaUSB, self).set_timeout(timeout)
+        self._connection.set_timeout(timeout)
+#### Internal ######################################################################################
+    @asyncio.coroutine
+    def _send(self, command):
+        """ Send the command in the executor."""
+        yield From(self._loop.run_in_executor(self._executor, self._connection.send, command))
+    @asyncio.coroutine
+    def _ask(self, command):
+        """ Ask in the executor."""
+        response = yield From(self._loop.run_in_executor(self._executor, self._connection.ask, command))
+        raise Return(response)
+    @asyncio.coroutine
+    def _clear(self):
+        """ Clear the connection in the executor."""
+        yield From(self._loop.run_in_executor(self._executor, self._connection.clear))
+
+class AsyncTektronix(object):
+    """ Asynchronous acquisition and readout for a Tektronix scope that has been configured, locked and begun.
+    Waveforms are decoded by the scope's decode_curves. Service request waits are not asynchronous, so the srq
+    wait strategy waits as opc."""
+    def __init__(self, scope, connection):
+        """ Initialise with the configured scopes.Tektronix and an AsyncTekConnection to the same scope."""
+        self._scope = scope
+        self._connection = connection
+    @asyncio.coroutine
+    def acquire(self):
+        """ Wait until scope has an acquisition, raises AcquisitionTimeout if there isn't one in time."""
+        strategy, wait_timeout, min_interval, max_interval = self._scope.get_wait_strategy()
+        if strategy == "poll":
+            yield From(self._connection.send("acquire:state run"))
+            yield From(self._poll_acquisition())
+        else:
+            timeout = self._connection.get_timeout()
+            self._connection.set_timeout(wait_timeout)
+            try:
+                reply = yield From(self._connection.ask("acquire:state run;*opc?")) # Reply only when acquired
+            finally:
+                self._connection.set_timeout(timeout)
+            if reply is None:
+                yield From(self._abort_acquisition())
+    @asyncio.coroutine
+    def read_curves(self, channels):
+        """ Read the curve data for all the channels in a single exchange, returns the undecoded reply."""
+        data = yield From(self._connection.ask(self._scope.curves_query(channels)))
+        if data is None:
+            yield From(self._connection.ask("*opc?")) # Wait until scope is ready
+            raise Exception("Scope has errored.")
+        raise Return(data)
+    @asyncio.coroutine
+    def get_waveform(self, channel):
+        """ Acquire a waveform from channel=channel, in volts."""
+        data = yield From(self.read_curves([channel]))
+        raise Return(self._scope.decode_curves([channel], data).volts()[0])
+    @asyncio.coroutine
+    def get_waveforms(self, channels):
+        """ Acquire waveforms from all the channels in a single exchange, in volts as a channels x samples array."""
+        data = yield From(self.read_curves(channels))
+        raise Return(self._scope.decode_curves(channels, data).volts())
+    @asyncio.coroutine
+    def get_measurement(self, channel):
+        """ Return the measurement value."""
+        value = yield From(self._connection.ask("measurement:immed:source1 ch%i;:measurement:immed:value?" % \
+                                                    channel))
+        if value == "2.8740E-06" or value is None:
+            raise Return(None)
+        raise Return(float(value))
+#### Internal ######################################################################################
+    @asyncio.coroutine
+    def _poll_acquisition(self):
+        """ Poll until acquiring and there is a trigger, the interval between polls doubles up to the maximum.
+        The loop is free between polls."""
+        strategy, wait_timeout, interval, max_interval = self._scope.get_wait_strategy()
+        start = time.time()
+        while True:
+            reply = yield From(self._connection.ask(self._scope.poll_query()))
+            if self._scope.is_acquired(reply):
+                return
+            if wait_timeout is not None and time.time() - start > wait_timeout:
+                yield From(self._abort_acquisition())
+            yield From(asyncio.sleep(interval))
+            interval = min(interval * 2, max_interval)
+    @asyncio.coroutine
+    def _abort_acquisition(self):
+        """ Stop the pending acquisition and raise AcquisitionTimeout."""
+        yield From(self._connection.send("acquire:state stop"))
+        yield From(self._connection.clear()) # Drop the late reply to any pending query
+        raise scopes.AcquisitionTimeout.after(self._scope.get_wait_strategy()[1])
@@ -11,19 +11,20 @@ import optparse
 import scopes
 import scope_connections
 import utils
+import pipeline
 import datetime
 import time
-from pyvisa.vpp43 import visa_exceptions
 
-def averaged_acquisition_example(name, n_events, averages):
-    """ Acquire a set of triggerred single acquisitions for two channels."""
+def averaged_acquisition_example(name, n_events, averages, window, raw=False):
+    """ Acquire a set of triggerred single acquisitions for two channels, reading the (low, high) seconds
+    window around the trigger."""
     tek_scope = scopes.Tektronix2000(scope_connections.VisaUSB())
     # First setup the scope, lock the front panel
     tek_scope.lock()
     tek_scope.set_active_channel(1)
     tek_scope.set_active_channel(2)
     tek_scope.set_average_acquisition(averages)
-    tek_scope.set_data_mode(49500, 50500)
+    tek_scope.set_data_mode(window=window, width="auto") # Averages need 2 bytes per point
     tek_scope.begin()
     # Now create a HDF5 file and save the meta information
     file_name = name + "_" + str(datetime.date.today())
@@ -33,31 +34,26 @@ def averaged_acquisition_example(name, n_events, averages):
     results.add_meta_dict(tek_scope.get_preamble(1), "ch1")
     results.add_meta_dict(tek_scope.get_preamble(2), "ch2")
 
-    last_save_time = datetime.datetime.now()
-    print "Starting data taking at time", last_save_time.strftime("%Y-%m-%d %H:%M:%S")
-    for event in range(0, n_events):
-        tek_scope.acquire()
-        try:
-            results.add_data(tek_scope.get_waveform(1), 1)
-            results.add_data(tek_scope.get_waveform(2), 2)
-        except visa_exceptions.VisaIOError, e:
-            print "Serious death", e
-            time.sleep(10)
-        except Exception, e:
-            print "Scope died, acquisition lost.", e
-            time.sleep(10)
-        if datetime.datetime.now() - last_save_time > datetime.timedelta(seconds=60):
-            results.autosave()
-            last_save_time = time.time()
+    if raw: # Raw samples, convert to volts using the chN YZERO, YOFF and YMULT meta data
+        acquisition = pipeline.AcquisitionPipeline(tek_scope, [1, 2], results, pipeline.raw_samples)
+    else:
+        acquisition = pipeline.AcquisitionPipeline(tek_scope, [1, 2], results)
+    print "Starting data taking at time", datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    acquisition.run(n_events)
+    print "Acquisition statistics", acquisition.get_stats()
     results.save()
     print "Finished at", time.strftime("%Y-%m-%d %H:%M:%S")
 
 if __name__ == "__main__":
     parser = optparse.OptionParser(usage = "usage: %prog name n_events", version="%prog 1.0")
     parser.add_option("-a", type="int", dest="averages", help="Averages", default=2)
+    parser.add_option("-l", type="float", dest="window_low", help="Window start (s from trigger)", default=-100e-9)
+    parser.add_option("-u", type="float", dest="window_high", help="Window end (s from trigger)", default=100e-9)
+    parser.add_option("-r", action="store_true", dest="raw", help="Save raw samples not volts", default=False)
     (options, args) = parser.parse_args()
     if len(args) != 2:
         print "Incorrect number of arguments"
         parser.print_help()
         exit(0)
-    averaged_acquisition_example(args[0], int(args[1]), options.averages)
+    averaged_acquisition_example(args[0], int(args[1]), options.averages, (options.window_low, options.window_high),
+                                 options.raw)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+#
+# backends.py
+#
+# Registry of the connection transports and file formats by name. Their (heavy) libraries, VISA, h5py and
+# ROOT, are only imported when first used, via LazyModule, so importing the other modules stays fast and works
+# without them. Using a backend whose library is missing raises BackendUnavailable.
+#
+####################################################################################################
+import importlib
+import imp
+import os
+import sys
+import threading
+
+class BackendUnavailable(ImportError):
+    """ The library a backend needs is not installed or cannot be loaded."""
+    pass
+
+_transports = {} # (module, class name, libraries) by transport name
+_file_formats = {} # (module, class name, libraries) by file format name
+_libraries = {} # Loaded library modules by name
+_loaders = {} # Functions to load a library, by name, if not simply importing it
+_packages = {} # Top level package to look for to see if a library is installed, by library name
+_lock = threading.RLock()
+
+def register_transport(name, module, class_name, libraries=()):
+    """ Register the connection class_name in module as the transport name, needing the libraries."""
+    _transports[name] = (module, class_name, tuple(libraries))
+
+def register_file_format(name, module, class_name, libraries=()):
+    """ Register the file class_name in module as the file format name, needing the libraries."""
+    _file_formats[name] = (module, class_name, tuple(libraries))
+
+def register_library(name, loader=None, package=None):
+    """ Register how to load the library name, loader returns the module (default importing name) and package
+    is the top level package that shows it is installed (default name)."""
+    if loader is not None:
+        _loaders[name] = loader
+    _packages[name] = package if package is not None else name.split(".")[0]
+
+def get_transports():
+    """ Return the registered transport names."""
+    return sorted(_transports.keys())
+
+def get_file_formats():
+    """ Return the registered file format names."""
+    return sorted(_file_formats.keys())
+
+def get_transport(name):
+    """ Return the connection class for the transport, raises BackendUnavailable if its libraries are not
+    installed."""
+    return _get_class(_transports, "transport", name)
+
+def get_file_format(name):
+    """ Return the file class for the file format, raises BackendUnavailable if its libraries are not
+    installed."""
+    return _get_class(_file_formats, "file format", name)
+
+def open_transport(name, *args, **kwargs):
+    """ Return a connection of the transport, created with the arguments."""
+    return get_transport(name)(*args, **kwargs)
+
+def is_available(name):
+    """ Return True if the transport or file format's libraries are installed, without loading them."""
+    registry = _transports if name in _transports else _file_formats
+    if not name in registry:
+        raise KeyError("No backend called %s." % name)
+    return all([_is_installed(library) for library in registry[name][2]])
+
+def load_library(name):
+    """ Return the library module, loading it if this is the first use. Raises BackendUnavailable if it
+    cannot be loaded."""
+    with _lock:
+        if not name in _libraries:
+            try:
+                _libraries[name] = _loaders.get(name, lambda: importlib.import_module(name))()
+            except BackendUnavailable: # Of a library this one needs
+                raise
+            except ImportError, e:
+                raise BackendUnavailable("The %s library is not available (%s)." % (name, e))
+        return _libraries[name]
+
+class LazyModule(object):
+    """ Stands in for a library module, which is only loaded when an attribute is first used."""
+    def __init__(self, name):
+        """ Stand in for the library name."""
+        self.__dict__["_name"] = name
+    def __getattr__(self, attribute):
+        return getattr(load_library(self._name), attribute)
+    def __setattr__(self, attribute, value):
+        setattr(load_library(self._name), attribute, value)
+#### Internal ######################################################################################
+def _get_class(registry, kind, name):
+    """ Return the registered class, checking its libraries load."""
+    if not name in registry:
+        raise KeyError("No %s called %s, choose from %s." % (kind, name, ", ".join(sorted(registry.keys()))))
+    module, class_name, libraries = registry[name]
+    for library in libraries:
+        load_library(library)
+    return getattr(importlib.import_module(module), class_name)
+
+def _is_installed(library):
+    """ Return True if the library is loaded or can be found."""
+    if library in _libraries:
+        return True
+    try:
+        imp.find_module(_packages.get(library, library.split(".")[0]))
+        return True
+    except ImportError:
+        return False
+
+def _load_visa():
+    """ Load pyvisa, with the VISA library from $VISA_LIBRARY or on Mac the NI framework, if set or found."""
+    from pyvisa.vpp43 import visa_library
+    library_path = os.environ.get("VISA_LIBRARY")
+    if library_path is None and sys.platform == "darwin" and os.path.exists("/Library/Frameworks/Visa.framework"):
+        library_path = "/Library/Frameworks/Visa.framework/VISA"
+    if library_path is not None:
+        visa_library.load_library(library_path)
+    import visa
+    return visa
+
+def _load_visa_exceptions():
+    """ Load the pyvisa exceptions, after the library."""
+    load_library("visa")
+    from pyvisa.vpp43 import visa_exceptions
+    return visa_exceptions
+
+register_library("visa", _load_visa, "pyvisa")
+register_library("visa_exceptions", _load_visa_exceptions, "pyvisa")
+register_library("h5py")
+register_library("ROOT")
+
+register_transport("usb", "scope_connections", "VisaUSB", ["visa"])
+register_transport("tcpip", "scope_connections", "TCPIP")
+register_transport("simulated", "scope_simulator", "SimulatedConnection")
+
+register_file_format("pickle", "utils", "PickleFile")
+register_file_format("record", "utils", "RecordFile")
+register_file_format("hdf5", "utils", "HDF5File", ["h5py"])
+register_file_format("hdf5stream", "utils", "HDF5StreamFile", ["h5py"])
+register_file_format("root", "utils", "RootFile", ["ROOT"])
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+#
+# benchmark.py
+#
+# Benchmark the acquisition, decoding and saving of waveforms against a simulated scope served over TCP/IP.
+# Results are printed (or written) as a JSON object per line, one per configuration.
+#
+####################################################################################################
+import optparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import backends
+import scopes
+import scope_connections
+import scope_simulator
+
+def _file_formats():
+    """ Return the names of the file formats to benchmark, skipping those without their libraries."""
+    return [name for name in backends.get_file_formats() if backends.is_available(name)]
+
+def benchmark_acquisition(record_length, channels, width, n_events, latency=0.0, bandwidth=None):
+    """ Time acquiring, reading and decoding n_events from the channels. Returns the results dict and the last
+    event's raw samples."""
+    server = scope_simulator.SimulatedServer(scope_simulator.SimulatedScope(record_length, trigger_rate=1e6,
+                                                                            latency=latency, bandwidth=bandwidth))
+    server.start()
+    try:
+        connection = scope_connections.TCPIP(*server.address)
+        tek_scope = scopes.Tektronix(connection)
+        tek_scope.lock()
+        for channel in channels:
+            tek_scope.set_active_channel(channel)
+        tek_scope.set_single_acquisition()
+        tek_scope.set_edge_trigger(-0.004, channels[0], True)
+        tek_scope.set_data_mode(1, record_length, width)
+        tek_scope.begin()
+        acquire_time = read_time = decode_time = 0.0
+        bytes_read = 0
+        for event in range(n_events):
+            start = time.time()
+            tek_scope.acquire()
+            acquired = time.time()
+            data = tek_scope.read_curves(channels)
+            read = time.time()
+            waveform = tek_scope.decode_curves(channels, data)
+            waveform.volts()
+            decoded = time.time()
+            acquire_time += acquired - start
+            read_time += read - acquired
+            decode_time += decoded - read
+            bytes_read += len(data)
+        tek_scope.unlock()
+    finally:
+        server.stop()
+    total_time = acquire_time + read_time + decode_time
+    return { "events_per_second" : n_events / total_time,
+             "curve_mb_per_second" : bytes_read / read_time / 1e6,
+             "acquire_ms_per_event" : 1e3 * acquire_time / n_events,
+             "read_ms_per_event" : 1e3 * read_time / n_events,
+             "decode_us_per_waveform" : 1e6 * decode_time / (n_events * len(channels)) }, waveform.samples
+
+def benchmark_writer(file_class, samples, channels, n_events, directory):
+    """ Time adding n_events of the samples to a file_class file and saving it."""
+    results = file_class(os.path.join(directory, "benchmark"), max(channels))
+    start = time.time()
+    for event in range(n_events):
+        for index, channel in enumerate(channels):
+            results.add_data(samples[index], channel)
+    results.save()
+    elapsed = time.time() - start
+    return { "events_per_second" : n_events / elapsed,
+             "mb_per_second" : n_events * samples.nbytes / elapsed / 1e6 }
+
+def benchmark(record_lengths, channel_counts, widths, n_events, formats, latency, bandwidth):
+    """ Benchmark all the configurations, yields a results dict for each. Each configuration runs in a fresh
+    process so its peak memory is its own, not that of the largest configuration so far."""
+    configurations = []
+    for record_length in record_lengths:
+        for channel_count in channel_counts:
+            for width in widths:
+                configurations.append((record_length, channel_count, width, n_events, formats, latency, bandwidth))
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        for result in pool.imap(benchmark_configuration, configurations):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def benchmark_configuration(configuration):
+    """ Benchmark the (record_length, channel_count, width, n_events, formats, latency, bandwidth) configuration,
+    returns the results dict including the peak memory of this process."""
+    record_length, channel_count, width, n_events, formats, latency, bandwidth = configuration
+    channels = range(1, channel_count + 1)
+    result = { "record_length" : record_length, "channels" : channel_count, "width" : width, "events" : n_events }
+    result["acquisition"], samples = benchmark_acquisition(record_length, channels, width, n_events, latency,
+                                                           bandwidth)
+    directory = tempfile.mkdtemp()
+    try:
+        result["writers"] = {}
+        for name in formats:
+            result["writers"][name] = benchmark_writer(backends.get_file_format(name), samples, channels, n_events,
+                                                       directory)
+    finally:
+        shutil.rmtree(directory)
+    result["peak_memory_mb"] = _peak_memory() / 1e6
+    return result
+
+def _peak_memory():
+    """ Return the peak resident memory of this process in bytes (ru_maxrss is in kilobytes, bytes on Mac)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage = "usage: %prog [options]", version="%prog 1.0")
+    parser.add_option("-l", type="string", dest="record_lengths", help="Record lengths",
+                      default="1000,10000,100000,1000000")
+    parser.add_option("-c", type="string", dest="channels", help="Channel counts", default="1,2")
+    parser.add_option("-w", type="string", dest="widths", help="Data widths (bytes)", default="1,2")
+    parser.add_option("-n", type="int", dest="events", help="Events per configuration", default=100)
+    parser.add_option("-f", type="string", dest="formats", help="File formats",
+                      default=",".join(_file_formats()))
+    parser.add_option("-d", type="float", dest="latency", help="Simulated reply latency (s)", default=0.0)
+    parser.add_option("-b", type="float", dest="bandwidth", help="Simulated bandwidth (bytes/s)", default=None)
+    parser.add_option("-o", type="string", dest="output", help="Output file (default stdout)", default=None)
+    (options, args) = parser.parse_args()
+    output = open(options.output, "w") if options.output is not None else None
+    for result in benchmark([int(length) for length in options.record_lengths.split(",")],
+                            [int(count) for count in options.channels.split(",")],
+                            [int(width) for width in options.widths.split(",")],
+                            options.events, options.formats.split(","), options.latency, options.bandwidth):
+        if output is not None:
+            output.write(json.dumps(result, sort_keys=True) + "\n")
+            output.flush()
+        else:
+            print json.dumps(result, sort_keys=True)
@@ -9,5 +9,5 @@
 import scopes
 import scope_connections
 
-tek_scope = scopes.Tektronix2000(scope_connections.VisaUSB())
+tek_scope = scopes.Tektronix2000(scope_connections.VisaUSB(), reset=False) # Keep the current settings
 tek_scope.interactive()
@@ -11,12 +11,13 @@ import optparse
 import scopes
 import scope_connections
 import utils
+import measurements
 import datetime
 import time
-from pyvisa.vpp43 import visa_exceptions
 
-def measurement_example(name, n_events, trigger, trigger_channel, y_scale, cursor_low, cursor_high):
-    """ Acquire a set of measurements for a triggerred single acquisition on one channel."""
+def measurement_example(name, n_events, trigger, trigger_channel, y_scale, cursor_low, cursor_high, host=False):
+    """ Acquire a set of measurements for a triggerred single acquisition on one channel.
+    If host is True the area is measured here from the waveform, rather than asked of the scope."""
     tek_scope = scopes.Tektronix2000(scope_connections.VisaUSB())
     # First setup the scope, lock the front panel
     tek_scope.lock()
@@ -36,23 +37,32 @@ def measurement_example(name, n_events, trigger, trigger_channel, y_scale, curso
     results.add_meta_data("cursor_low", cursor_low)
     results.add_meta_data("cursor_high", cursor_high)
     results.add_meta_data("y_scale", y_scale)
+    timebase = tek_scope.get_timeform(1)
 
     last_save_time = datetime.datetime.now()
     print "Starting data taking at time", last_save_time.strftime("%Y-%m-%d %H:%M:%S")
     for event in range(0, n_events):
-        tek_scope.acquire()
         try:
-            print tek_scope.get_measurement(1)
-            results.add_data(tek_scope.get_measurement(1), 1)
-        except visa_exceptions.VisaIOError, e:
-            print "Serious death", e
-            time.sleep(10)
+            tek_scope.acquire()
+            if host:
+                value = measurements.area(tek_scope.get_waveform(1), timebase, (cursor_low, cursor_high))[0]
+            else:
+                value = tek_scope.get_measurement(1)
+            print value
+            results.add_data(value, 1)
         except Exception, e:
             print "Scope died, acquisition lost.", e
-            time.sleep(10)
+            try:
+                tek_scope.wait_ready()
+            except Exception, e:
+                print "Scope not ready, reconnecting.", e
+                try:
+                    tek_scope.recover() # Reconnect and re-apply the settings
+                except Exception, e:
+                    print "Scope recovery failed.", e
         if datetime.datetime.now() - last_save_time > datetime.timedelta(seconds=60):
             results.autosave()
-            last_save_time = time.time()
+            last_save_time = datetime.datetime.now()
     results.save()
     print "Finished at", time.strftime("%Y-%m-%d %H:%M:%S")
 
@@ -63,9 +73,10 @@ if __name__ == "__main__":
     parser.add_option("-y", type="float", dest="y_scale", help="Y Scaling", default=100e-3)
     parser.add_option("-a", type="float", dest="cursor_low", help="Cursor low (integral low bound)", default=-10e-9)
     parser.add_option("-b", type="float", dest="cursor_high", help="Cursor high (integral high bound)", default=10e-9)
+    parser.add_option("-s", action="store_true", dest="host", help="Measure on the host not the scope", default=False)
     (options, args) = parser.parse_args()
     if len(args) != 2:
         print "Incorrect number of arguments"
         parser.print_help()
         exit(0)
-    measurement_example(args[0], int(args[1]), options.trigger, options.channel, options.y_scale, options.cursor_low, options.cursor_high)
+    measurement_example(args[0], int(args[1]), options.trigger, options.channel, options.y_scale, options.cursor_low, options.cursor_high, options.host)
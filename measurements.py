@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+#
+# measurements.py
+#
+# Pulse measurements made on the host, on batches of waveforms (events x samples, in volts) at once. Gates are
+# (low, high) times in seconds, as for Tektronix.set_cursors, and timings use the waveforms.Timebase of the
+# waveforms. Pulses are measured relative to the baseline, negative pulses (the default) are flipped so that
+# amplitudes are positive.
+#
+####################################################################################################
+import numpy
+
+def gate_slice(timebase, gate=None):
+    """ Return the slice of samples within the gate, None for all the samples."""
+    if gate is None:
+        return slice(0, len(timebase))
+    low, high = timebase.index(gate[0]), timebase.index(gate[1])
+    return slice(max(0, int(low)), min(len(timebase), int(high) + 1))
+
+def baseline(waveforms, timebase, gate=None):
+    """ Return the mean of each waveform within the baseline gate, the default is the first tenth of the
+    samples."""
+    waveforms = numpy.atleast_2d(waveforms)
+    if gate is None:
+        samples = slice(0, max(1, len(timebase) // 10))
+    else:
+        samples = gate_slice(timebase, gate)
+    return waveforms[:, samples].mean(axis=1)
+
+def area(waveforms, timebase, gate=None, baseline_gate=None):
+    """ Return the area (volt seconds) of each waveform within the gate, relative to the baseline if a
+    baseline gate is given (as the scope's area measurement, no baseline is subtracted by default)."""
+    waveforms = numpy.atleast_2d(waveforms)
+    samples = waveforms[:, gate_slice(timebase, gate)]
+    result = samples.sum(axis=1) * timebase.x_incr
+    if baseline_gate is not None:
+        result -= baseline(waveforms, timebase, baseline_gate) * samples.shape[1] * timebase.x_incr
+    return result
+
+def peak(waveforms, timebase, gate=None, baseline_gate=None, negative=True):
+    """ Return the amplitude (relative to the baseline) and time of the peak of each waveform within the
+    gate."""
+    signal, offset = _signal(waveforms, timebase, gate, baseline_gate, negative)
+    index = signal.argmax(axis=1)
+    return signal[numpy.arange(len(signal)), index], timebase.time(index + offset)
+
+def rise_time(waveforms, timebase, gate=None, baseline_gate=None, negative=True, low=0.1, high=0.9):
+    """ Return the time each pulse takes to rise from the low to the high fraction of its amplitude."""
+    signal, offset = _signal(waveforms, timebase, gate, baseline_gate, negative)
+    index = signal.argmax(axis=1)
+    amplitude = signal[numpy.arange(len(signal)), index]
+    return (_crossing(signal, index, high * amplitude, -1) - _crossing(signal, index, low * amplitude, -1)) * \
+        timebase.x_incr
+
+def fall_time(waveforms, timebase, gate=None, baseline_gate=None, negative=True, low=0.1, high=0.9):
+    """ Return the time each pulse takes to fall from the high to the low fraction of its amplitude."""
+    signal, offset = _signal(waveforms, timebase, gate, baseline_gate, negative)
+    index = signal.argmax(axis=1)
+    amplitude = signal[numpy.arange(len(signal)), index]
+    return (_crossing(signal, index, low * amplitude, 1) - _crossing(signal, index, high * amplitude, 1)) * \
+        timebase.x_incr
+
+def time_over_threshold(waveforms, timebase, threshold, gate=None, baseline_gate=None, negative=True):
+    """ Return the time each waveform spends beyond the threshold (volts from the baseline, positive for
+    either polarity) within the gate."""
+    signal, offset = _signal(waveforms, timebase, gate, baseline_gate, negative)
+    return (signal > threshold).sum(axis=1) * timebase.x_incr
+
+def measure(waveforms, timebase, gate=None, baseline_gate=None, negative=True, threshold=None):
+    """ Return a dict of all the measurements of each waveform, computed in one pass over the gated
+    samples. Each is as the function of the same name with the same arguments."""
+    waveforms = numpy.atleast_2d(waveforms)
+    signal, offset = _signal(waveforms, timebase, gate, baseline_gate, negative)
+    rows = numpy.arange(len(signal))
+    index = signal.argmax(axis=1)
+    amplitude = signal[rows, index]
+    sign = -1.0 if negative else 1.0
+    base = baseline(waveforms, timebase, baseline_gate)
+    area_ = sign * signal.sum(axis=1) * timebase.x_incr # Baseline subtracted
+    if baseline_gate is None: # As area, without a baseline gate no baseline is subtracted
+        area_ += base * signal.shape[1] * timebase.x_incr
+    results = { "baseline" : base,
+                "area" : area_,
+                "amplitude" : amplitude,
+                "peak_time" : timebase.time(index + offset),
+                "rise_time" : (_crossing(signal, index, 0.9 * amplitude, -1) - \
+                                   _crossing(signal, index, 0.1 * amplitude, -1)) * timebase.x_incr,
+                "fall_time" : (_crossing(signal, index, 0.1 * amplitude, 1) - \
+                                   _crossing(signal, index, 0.9 * amplitude, 1)) * timebase.x_incr }
+    if threshold is not None:
+        results["time_over_threshold"] = (signal > threshold).sum(axis=1) * timebase.x_incr
+    return results
+#### Internal ######################################################################################
+def _signal(waveforms, timebase, gate, baseline_gate, negative):
+    """ Return the gated waveforms relative to the baseline with the pulses positive, and the index of the
+    first gated sample."""
+    waveforms = numpy.atleast_2d(waveforms)
+    samples = gate_slice(timebase, gate)
+    signal = waveforms[:, samples] - baseline(waveforms, timebase, baseline_gate)[:, numpy.newaxis]
+    if negative:
+        signal *= -1.0
+    return signal, samples.start
+
+def _crossing(signal, peak, level, direction):
+    """ Return the (interpolated) index where each signal crosses its level, searching from its peak index
+    backwards (direction -1) or forwards (1). Signals that never cross give the first or last index."""
+    n_samples = signal.shape[1]
+    positions = numpy.arange(n_samples)
+    below = signal < level[:, numpy.newaxis]
+    if direction < 0:
+        below &= positions < peak[:, numpy.newaxis]
+        index = n_samples - 1 - below[:, ::-1].argmax(axis=1) # Last below before the peak
+        index = numpy.where(below.any(axis=1), index, 0)
+        after = numpy.minimum(index + 1, n_samples - 1)
+    else:
+        below &= positions > peak[:, numpy.newaxis]
+        after = below.argmax(axis=1) # First below after the peak
+        after = numpy.where(below.any(axis=1), after, n_samples - 1)
+        index = numpy.maximum(after - 1, 0)
+    rows = numpy.arange(len(signal))
+    step = signal[rows, after] - signal[rows, index]
+    fraction = numpy.where(step != 0.0, (level - signal[rows, index]) / numpy.where(step != 0.0, step, 1.0), 0.0)
+    return index + fraction
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#
+# metrics.py
+#
+# Metrics for the exchanges with a scope: counts, latency histograms, bytes sent and received, errors and
+# timeouts, per command. Attach a ConnectionMetrics to a connection with TekConnection.set_metrics, then read a
+# snapshot or have a PrometheusWriter write them to a Prometheus (node exporter) text file periodically.
+#
+####################################################################################################
+import logging
+logger = logging.getLogger(__name__)
+
+import bisect
+import os
+import threading
+
+class ConnectionMetrics(object):
+    """ Thread safe metrics of the exchanges over a connection. Commands are identified by their headers (so
+    e.g. all channels' curve queries are counted together)."""
+    _latency_bounds = (1e-4, 3e-4, 1e-3, 3e-3, 1e-2, 3e-2, 1e-1, 3e-1, 1.0, 3.0, 10.0) # Seconds
+    def __init__(self, latency_bounds=None):
+        """ Initialise, latency_bounds are the upper bounds (in seconds) of the latency histogram bins."""
+        self._bounds = tuple(latency_bounds) if latency_bounds is not None else ConnectionMetrics._latency_bounds
+        self._lock = threading.Lock()
+        self._keys = {} # Command key by command string, as commands are repeated
+        self.reset()
+    def reset(self):
+        """ Zero all the metrics."""
+        with self._lock:
+            self._commands = {}
+            self._bytes_sent = 0
+            self._bytes_received = 0
+    def record(self, command, seconds, bytes_sent, bytes_received=0, error=False, timeout=False):
+        """ Record an exchange of command that took seconds."""
+        key = self._keys.get(command)
+        if key is None:
+            key = self._command_key(command)
+            if len(self._keys) < 1024: # Commands with varying values are keyed each time
+                self._keys[command] = key
+        with self._lock:
+            metrics = self._commands.get(key)
+            if metrics is None:
+                metrics = self._commands[key] = { "count" : 0, "seconds" : 0.0, "errors" : 0, "timeouts" : 0,
+                                                  "latency" : [0] * (len(self._bounds) + 1) }
+            metrics["count"] += 1
+            metrics["seconds"] += seconds
+            metrics["latency"][bisect.bisect_left(self._bounds, seconds)] += 1
+            if error:
+                metrics["errors"] += 1
+            if timeout:
+                metrics["timeouts"] += 1
+            self._bytes_sent += bytes_sent
+            self._bytes_received += bytes_received
+    def snapshot(self):
+        """ Return a copy of the metrics as a dict. Per command metrics (by command key) are the count, total
+        seconds, errors, timeouts and the latency histogram counts (the last bin is above all the bounds)."""
+        with self._lock:
+            commands = {}
+            for key, metrics in self._commands.items():
+                commands[key] = dict(metrics)
+                commands[key]["latency"] = list(metrics["latency"])
+            snapshot = { "commands" : commands,
+                         "latency_bounds" : list(self._bounds),
+                         "bytes_sent" : self._bytes_sent,
+                         "bytes_received" : self._bytes_received }
+        for total in ["count", "seconds", "errors", "timeouts"]:
+            snapshot[total] = sum([metrics[total] for metrics in commands.values()])
+        return snapshot
+    def to_prometheus(self, prefix="tek", labels=None):
+        """ Return the metrics in the Prometheus text format, labels is a dict added to every sample."""
+        snapshot = self.snapshot()
+        common = "".join(['%s="%s",' % item for item in sorted((labels or {}).items())])
+        lines = []
+        for name, kind, help in [("bytes_sent_total", "counter", "Bytes sent to the scope."),
+                                 ("bytes_received_total", "counter", "Bytes received from the scope.")]:
+            lines.append("# HELP %s_%s %s" % (prefix, name, help))
+            lines.append("# TYPE %s_%s %s" % (prefix, name, kind))
+            lines.append("%s_%s{%s} %i" % (prefix, name, common.rstrip(","), snapshot[name[:-len("_total")]]))
+        for name, field, help in [("commands_total", "count", "Commands sent."),
+                                  ("errors_total", "errors", "Commands that raised an error."),
+                                  ("timeouts_total", "timeouts", "Queries without a reply in time.")]:
+            lines.append("# HELP %s_%s %s" % (prefix, name, help))
+            lines.append("# TYPE %s_%s counter" % (prefix, name))
+            for key in sorted(snapshot["commands"].keys()):
+                lines.append('%s_%s{%scommand="%s"} %i' % (prefix, name, common, key,
+                                                           snapshot["commands"][key][field]))
+        lines.append("# HELP %s_command_seconds Command latency." % prefix)
+        lines.append("# TYPE %s_command_seconds histogram" % prefix)
+        for key in sorted(snapshot["commands"].keys()):
+            metrics = snapshot["commands"][key]
+            cumulative = 0
+            for bound, count in zip(list(self._bounds) + ["+Inf"], metrics["latency"]):
+                cumulative += count
+                lines.append('%s_command_seconds_bucket{%scommand="%s",le="%s"} %i' % (prefix, common, key, bound,
+                                                                                      cumulative))
+            lines.append('%s_command_seconds_sum{%scommand="%s"} %r' % (prefix, common, key, metrics["seconds"]))
+            lines.append('%s_command_seconds_count{%scommand="%s"} %i' % (prefix, common, key, metrics["count"]))
+        return "\n".join(lines) + "\n"
+    def write_prometheus(self, file_path, prefix="tek", labels=None):
+        """ Write the metrics to a Prometheus text file, atomically so it is never read half written."""
+        temporary_path = file_path + ".tmp"
+        with open(temporary_path, "w") as metrics_file:
+            metrics_file.write(self.to_prometheus(prefix, labels))
+        os.rename(temporary_path, file_path)
+#### Internal ######################################################################################
+    def _command_key(self, command):
+        """ Return the key for command, its (lower case) headers without repeats."""
+        headers = []
+        for part in command.split(";"):
+            parts = part.strip().lstrip(":").split(None, 1)
+            if len(parts) > 0 and not parts[0].lower() in headers:
+                headers.append(parts[0].lower())
+        return ";".join(headers)
+
+class PrometheusWriter(object):
+    """ Write metrics to a Prometheus text file every interval seconds, in a background thread."""
+    def __init__(self, metrics, file_path, interval=10.0, prefix="tek", labels=None):
+        """ Write the ConnectionMetrics metrics to file_path."""
+        self._metrics = metrics
+        self._file_path = file_path
+        self._interval = interval
+        self._prefix = prefix
+        self._labels = labels
+        self._stop = threading.Event()
+        self._thread = None
+    def start(self):
+        """ Start writing periodically."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="prometheus_writer")
+        self._thread.daemon = True
+        self._thread.start()
+    def stop(self):
+        """ Stop writing, after writing the final metrics."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+#### Internal ######################################################################################
+    def _run(self):
+        """ Write until stopped."""
+        while True:
+            stopping = self._stop.wait(self._interval)
+            try:
+                self._metrics.write_prometheus(self._file_path, self._prefix, self._labels)
+            except Exception:
+                logger.exception("Cannot write the metrics.")
+            if stopping:
+                return
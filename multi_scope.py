@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+#
+# multi_scope.py
+#
+# Concurrent acquisition from several scopes, each over its own connection, into a single file. Each scope is
+# armed, read and decoded by its own thread, events are tagged with the scope id and the host time they were
+# acquired and then aligned across the scopes (within a tolerance) by a single writer thread.
+#
+####################################################################################################
+import logging
+logger = logging.getLogger(__name__)
+
+import collections
+import threading
+import Queue
+import time
+import numpy
+import pipeline
+
+def channel_map(channels):
+    """ Return the file channels for the dict of scope channels by scope id, numbered consecutively from 1 in
+    scope id order, e.g. { "a" : [1, 2], "b" : [1] } gives { "a" : [1, 2], "b" : [3] }."""
+    file_channels = {}
+    next_channel = 1
+    for scope_id in sorted(channels.keys()):
+        file_channels[scope_id] = range(next_channel, next_channel + len(channels[scope_id]))
+        next_channel += len(channels[scope_id])
+    return file_channels
+
+class MultiScopeAcquisition(pipeline.ThreadedAcquisition):
+    """ Acquire events from several scopes at once. Events from different scopes whose host times are within
+    the tolerance are written as a single event, events without a partner on every scope are discarded (and
+    counted as unmatched). The scopes should share a trigger."""
+    def __init__(self, scopes, channels, results, file_channels=None, tolerance=0.05, process=pipeline.volts,
+                 queue_size=16, max_pending=1024, timestamp_channel=None, autosave_interval=60.0,
+                 ready_timeout=10.0):
+        """ scopes is a dict of locked and begun Tektronix by scope id, channels a dict of the channels to read
+        by scope id and results a utils.File. file_channels are the results channels for each scope's channels,
+        by default as channel_map. process is as for pipeline.AcquisitionPipeline. At most max_pending events
+        are held per scope whilst waiting for the other scopes. If timestamp_channel is set the host times of
+        each event (one per scope, in scope id order) are added to that results channel."""
+        super(MultiScopeAcquisition, self).__init__(results, autosave_interval, ready_timeout)
+        self._scopes = scopes
+        self._channels = channels
+        self._file_channels = file_channels if file_channels is not None else channel_map(channels)
+        self._tolerance = tolerance
+        self._process = process
+        self._max_pending = max_pending
+        self._timestamp_channel = timestamp_channel
+        self._scope_ids = sorted(scopes.keys())
+        self._queue = Queue.Queue(queue_size * len(scopes))
+        self._stats.update({ "acquired" : dict([(scope_id, 0) for scope_id in self._scope_ids]), # By scope
+                             "unmatched" : 0 }) # Scope events without a partner on every scope
+        results.add_meta_data("scope_ids", self._scope_ids)
+#### Internal ######################################################################################
+    def _create_threads(self, n_events):
+        """ Return a thread per scope and the writer thread."""
+        threads = []
+        for scope_id in self._scope_ids:
+            threads.append(threading.Thread(target=self._acquire, args=(scope_id, n_events),
+                                            name="scope_%s" % scope_id))
+        threads.append(threading.Thread(target=self._write, name="writer"))
+        return threads
+    def _acquire(self, scope_id, n_events):
+        """ Arm, read and decode the scope until n_events are acquired or stopped."""
+        scope = self._scopes[scope_id]
+        channels = self._channels[scope_id]
+        acquired = 0
+        while not self._stop.is_set() and (n_events is None or acquired < n_events):
+            try:
+                scope.acquire()
+                timestamp = time.time()
+                data = scope.read_curves(channels)
+            except Exception:
+                logger.exception("Scope %s died, acquisition lost." % scope_id)
+                self._count("errors")
+                self._wait_ready(scope, "Scope %s" % scope_id)
+                continue
+            acquired += 1
+            self._count("acquired", scope_id)
+            try:
+                result = self._process(scope.decode_curves(channels, data))
+            except Exception:
+                logger.exception("Decoding failed, scope %s event lost." % scope_id)
+                self._count("errors")
+                continue
+            self._queue.put((scope_id, timestamp, result))
+        self._queue.put(None) # Tell the writer this scope has finished
+    def _write(self):
+        """ Align the scope events and add them to the results until all scopes have finished, autosaving
+        periodically."""
+        finished = 0
+        pending = dict([(scope_id, collections.deque()) for scope_id in self._scope_ids])
+        while finished < len(self._scope_ids):
+            item = self._queue.get()
+            if item is None:
+                finished += 1
+                continue
+            pending[item[0]].append(item[1:])
+            self._align(pending)
+            self._autosave()
+        for events in pending.values():
+            for event in events:
+                self._count("unmatched")
+    def _align(self, pending):
+        """ Write the aligned events at the head of the pending events, discarding the earliest head if they
+        are not aligned. A scope with too many pending events has its earliest discarded, as its partners are
+        missing."""
+        for events in pending.values():
+            while len(events) > self._max_pending:
+                events.popleft()
+                self._count("unmatched")
+        while all(len(events) > 0 for events in pending.values()):
+            timestamps = [pending[scope_id][0][0] for scope_id in self._scope_ids]
+            if max(timestamps) - min(timestamps) > self._tolerance:
+                pending[self._scope_ids[timestamps.index(min(timestamps))]].popleft()
+                self._count("unmatched")
+                continue
+            data = []
+            for scope_id in self._scope_ids:
+                timestamp, result = pending[scope_id].popleft()
+                if result is not None:
+                    data.extend(zip(self._file_channels[scope_id], result))
+            if self._timestamp_channel is not None:
+                data.append((self._timestamp_channel, numpy.array(timestamps, numpy.float64)))
+            self._add_event(data)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+#
+# pipeline.py
+#
+# Threaded acquisition, the scope is re-armed whilst previous events are decoded and saved.
+#
+####################################################################################################
+import logging
+logger = logging.getLogger(__name__)
+
+import threading
+import Queue
+import time
+
+def volts(waveform):
+    """ Default processing, the waveforms in volts (one row per channel)."""
+    return waveform.volts()
+
+def raw_samples(waveform):
+    """ Processing to save the raw samples (one row per channel)."""
+    return waveform.samples
+
+class ThreadedAcquisition(object):
+    """ Base class for acquisitions run by background threads that add the events to a results file, with
+    counts of the events. Subclasses create the threads in _create_threads."""
+    def __init__(self, results, autosave_interval=60.0, ready_timeout=10.0):
+        """ results is a utils.File, autosaved every autosave_interval seconds. After an error the scope has
+        ready_timeout seconds to be ready before it is recovered."""
+        self._results = results
+        self._autosave_interval = autosave_interval
+        self._ready_timeout = ready_timeout
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats = { "written" : 0, # Events added to the results
+                        "errors" : 0 } # Events lost to scope, processing or writing errors
+        self._last_save_time = time.time()
+    def run(self, n_events):
+        """ Acquire n_events and wait until they are all written."""
+        self.start(n_events)
+        self.join()
+    def start(self, n_events=None):
+        """ Start acquiring n_events (None for until stopped) in the background."""
+        self._stop.clear()
+        self._last_save_time = time.time()
+        self._threads = self._create_threads(n_events)
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+    def stop(self):
+        """ Stop acquiring, events already acquired are still written."""
+        self._stop.set()
+    def join(self):
+        """ Wait until all acquired events are written."""
+        while any(thread.is_alive() for thread in self._threads):
+            for thread in self._threads:
+                thread.join(0.1) # Timeout allows KeyboardInterrupt to be caught
+    def get_stats(self):
+        """ Return a copy of the event counts."""
+        with self._lock:
+            return dict([(key, dict(value) if isinstance(value, dict) else value) \
+                             for key, value in self._stats.items()])
+#### Internal ######################################################################################
+    def _create_threads(self, n_events):
+        """ Return the (not yet started) threads that acquire n_events and write them."""
+        return []
+    def _count(self, key, sub_key=None):
+        """ Increment the key count, or its sub_key count if the key is a dict of counts."""
+        with self._lock:
+            if sub_key is None:
+                self._stats[key] += 1
+            else:
+                self._stats[key][sub_key] += 1
+    def _wait_ready(self, scope, name="Scope"):
+        """ Wait for the scope to be ready after an error, recovering the connection if it isn't. name is
+        used in the log messages."""
+        try:
+            scope.wait_ready(self._ready_timeout)
+        except Exception:
+            logger.exception("%s not ready, reconnecting." % name)
+            try:
+                scope.recover(self._ready_timeout)
+            except Exception:
+                logger.exception("%s recovery failed." % name)
+    def _add_event(self, data):
+        """ Add the (channel, data) pairs of an event to the results. Errors are logged and counted and the
+        writer carries on, otherwise the other threads would block on the full queues."""
+        try:
+            for channel, channel_data in data:
+                self._results.add_data(channel_data, channel)
+        except Exception:
+            logger.exception("Cannot add to the results, event lost.")
+            self._count("errors")
+            return
+        self._count("written")
+    def _autosave(self):
+        """ Autosave the results if autosave_interval seconds have passed since the last autosave. An error is
+        logged and the next autosave tried as usual."""
+        if time.time() - self._last_save_time <= self._autosave_interval:
+            return
+        try:
+            self._results.autosave()
+        except Exception:
+            logger.exception("Autosave failed.")
+        self._last_save_time = time.time()
+
+class AcquisitionPipeline(ThreadedAcquisition):
+    """ Acquire events with a producer thread that arms the scope and reads the raw curve data, decode worker
+    threads that decode and process the data and a single writer thread that adds the results to a file.
+    Bounded queues between the stages apply backpressure, or drop events if dropping is enabled."""
+    def __init__(self, scope, channels, results, process=volts, decoders=1, queue_size=16, drop=False,
+                 autosave_interval=60.0, ready_timeout=10.0):
+        """ scope is a locked and begun Tektronix, results a utils.File. process is called with the decoded
+        waveforms.RawWaveform and returns the data to add for each channel in order, or None to add nothing
+        (e.g. accumulators.accumulate). If drop is True events are dropped when the decoders fall behind,
+        rather than delaying the next acquisition."""
+        super(AcquisitionPipeline, self).__init__(results, autosave_interval, ready_timeout)
+        self._stats.update({ "acquired" : 0, # Events read from the scope
+                             "dropped" : 0, # Events dropped as the raw queue was full
+                             "decoded" : 0, # Events decoded and processed
+                             "raw_queue_depth" : 0,
+                             "raw_queue_max_depth" : 0,
+                             "result_queue_depth" : 0,
+                             "result_queue_max_depth" : 0 })
+        self._scope = scope
+        self._channels = channels
+        self._process = process
+        self._decoders = decoders
+        self._drop = drop
+        self._raw_queue = Queue.Queue(queue_size)
+        self._result_queue = Queue.Queue(queue_size)
+    def get_stats(self):
+        """ Return a copy of the event counts and queue depths."""
+        with self._lock:
+            self._stats["raw_queue_depth"] = self._raw_queue.qsize()
+            self._stats["result_queue_depth"] = self._result_queue.qsize()
+        return super(AcquisitionPipeline, self).get_stats()
+#### Internal ######################################################################################
+    def _create_threads(self, n_events):
+        """ Return the producer, decoder and writer threads."""
+        threads = [threading.Thread(target=self._produce, args=(n_events,), name="producer")]
+        for index in range(self._decoders):
+            threads.append(threading.Thread(target=self._decode, name="decoder%i" % index))
+        threads.append(threading.Thread(target=self._write, name="writer"))
+        return threads
+    def _record_depth(self, queue, key):
+        """ Record the maximum depth of the queue."""
+        with self._lock:
+            self._stats[key] = max(self._stats[key], queue.qsize())
+    def _produce(self, n_events):
+        """ Arm the scope and read the raw data, until n_events are acquired or stopped."""
+        index = 0 # Events are indexed so the writer can restore their order
+        while not self._stop.is_set() and (n_events is None or self._stats["acquired"] < n_events):
+            try:
+                self._scope.acquire()
+                data = self._scope.read_curves(self._channels)
+            except Exception:
+                logger.exception("Scope died, acquisition lost.")
+                self._count("errors")
+                self._wait_ready(self._scope)
+                continue
+            self._count("acquired")
+            if self._drop:
+                try:
+                    self._raw_queue.put_nowait((index, data))
+                except Queue.Full:
+                    self._count("dropped")
+                    continue
+            else:
+                self._raw_queue.put((index, data))
+            self._record_depth(self._raw_queue, "raw_queue_max_depth")
+            index += 1
+        for decoder in range(self._decoders):
+            self._raw_queue.put(None) # Tell each decoder to finish
+    def _decode(self):
+        """ Decode and process raw data until told to finish."""
+        while True:
+            item = self._raw_queue.get()
+            if item is None:
+                self._result_queue.put(None)
+                return
+            index, data = item
+            try:
+                result = self._process(self._scope.decode_curves(self._channels, data))
+                self._count("decoded")
+            except Exception:
+                logger.exception("Decoding failed, event lost.")
+                self._count("errors")
+                result = None
+            self._result_queue.put((index, result))
+            self._record_depth(self._result_queue, "result_queue_max_depth")
+    def _write(self):
+        """ Add the results in event order until all decoders have finished, autosaving periodically."""
+        finished = 0
+        pending = {} # Results that arrived ahead of their turn, by index
+        next_index = 0
+        while finished < self._decoders:
+            item = self._result_queue.get()
+            if item is None:
+                finished += 1
+                continue
+            pending[item[0]] = item[1]
+            while next_index in pending:
+                result = pending.pop(next_index)
+                next_index += 1
+                if result is None: # Lost in decoding
+                    continue
+                self._add_event(zip(self._channels, result))
+            self._autosave()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+#
+# reprocess.py
+#
+# Reprocess saved runs in parallel. Each file is split into shards of events which a pool of worker processes
+# read (a batch at a time, so memory per worker is bounded), optionally scale to volts and then measure,
+# histogram or convert. Shard results are merged in shard order, so the output does not depend on the number
+# of workers.
+#
+####################################################################################################
+import optparse
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import numpy
+import accumulators
+import measurements
+import utils
+import waveforms
+
+def open_reader(file_path):
+    """ Return a reader (as utils.RecordReader) for the saved file, rebuilding zero suppressed data."""
+    if file_path.endswith(".rec"):
+        reader = utils.RecordReader(file_path)
+    elif file_path.endswith(".hdf5"):
+        reader = utils.HDF5Reader(file_path)
+    elif file_path.endswith(".pkl"):
+        reader = _PickleReader(file_path)
+    else:
+        raise Exception("Unknown file type %s." % file_path)
+    if "zero_suppression_threshold" in reader.get_meta_data():
+        return utils.ZeroSuppressedReader(reader)
+    return reader
+
+def shard(file_paths, channels, events_per_shard):
+    """ Return the (file index, file path, start, stop) event ranges to process, in order. Pickle files can
+    only be read whole so are a single shard."""
+    shards = []
+    for index, file_path in enumerate(file_paths):
+        reader = open_reader(file_path)
+        n_events = min([reader.get_n_events(channel) for channel in channels])
+        reader.close()
+        if file_path.endswith(".pkl"):
+            shards.append((index, file_path, 0, n_events))
+            continue
+        for start in range(0, n_events, events_per_shard):
+            shards.append((index, file_path, start, min(start + events_per_shard, n_events)))
+    return shards
+
+def process_shard(task):
+    """ Process a shard, task is the operation, the shard (as from shard) and the options dict. Returns the
+    shard's result to merge."""
+    operation, (file_index, file_path, start, stop), options = task
+    reader = open_reader(file_path)
+    try:
+        meta_data = reader.get_meta_data()
+        if operation == "convert":
+            return _convert(reader, meta_data, file_index, start, stop, options)
+        if operation == "histogram":
+            results = {}
+        else:
+            results = dict([(channel, {}) for channel in options["channels"]])
+        for batch_start, batch in reader.iterate(options["batch_size"], options["channels"], start, stop):
+            for channel in options["channels"]:
+                data = batch[channel]
+                if options["scale"]:
+                    data = _scale(data, meta_data, channel)
+                timebase = _timebase(meta_data, channel, options, data.shape[-1])
+                if operation == "measure":
+                    for key, value in measurements.measure(data, timebase, options["gate"], options["baseline_gate"],
+                                                           options["negative"]).items():
+                        results[channel].setdefault(key, []).append(value)
+                elif operation == "histogram":
+                    if not channel in results:
+                        results[channel] = accumulators.ChannelAccumulators(timebase, options["gate"],
+                                                                            options["baseline_gate"],
+                                                                            options["negative"],
+                                                                            options["amplitude_bins"],
+                                                                            options["area_bins"])
+                    results[channel].add(data)
+        if operation == "measure":
+            for channel in results.keys():
+                for key in results[channel].keys():
+                    results[channel][key] = numpy.concatenate(results[channel][key])
+                results[channel]["file"] = numpy.repeat(file_index, stop - start)
+                results[channel]["event"] = numpy.arange(start, stop)
+        return results
+    finally:
+        reader.close()
+
+def reprocess(operation, file_paths, output, options, processes=None, events_per_shard=10000):
+    """ Apply the operation (measure, histogram or convert) to the files using processes worker processes
+    (default the number of cores) and save the merged result to output: measurements (with the file and event
+    index of each) and accumulators to numpy .npz files, conversions to a record or (by extension) hdf5 file."""
+    shards = shard(file_paths, options["channels"], events_per_shard)
+    if operation == "convert":
+        options = dict(options, part_directory=tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output))))
+    pool = multiprocessing.Pool(processes)
+    try:
+        merged = None
+        # imap returns the results in shard order, whichever worker finishes first
+        for result in pool.imap(process_shard, [(operation, shard_, options) for shard_ in shards]):
+            merged = _merge(operation, merged, result)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    if operation == "measure":
+        values = {}
+        for channel in (merged or {}).keys():
+            for key, value in merged[channel].items():
+                values["ch%i/%s" % (channel, key)] = numpy.concatenate(value)
+        numpy.savez(output, **values)
+    elif operation == "histogram":
+        accumulators.save(output, dict([("ch%i" % channel, accumulator) \
+                                            for channel, accumulator in (merged or {}).items()]))
+    elif operation == "convert":
+        try:
+            _join_parts(merged or [], output, options)
+        finally:
+            shutil.rmtree(options["part_directory"])
+    return len(shards)
+#### Internal ######################################################################################
+class _PickleReader(utils.Reader):
+    """ Reader for pickle files, the whole file is loaded."""
+    def __init__(self, file_path):
+        """ Load the pickle file at file_path (including the extension)."""
+        with open(file_path, "rb") as file_:
+            full_data = pickle.load(file_)
+        self._meta_data = full_data["meta"]
+        self._data = full_data["data"]
+    def close(self):
+        pass
+    def get_meta_data(self):
+        return self._meta_data
+    def get_channels(self):
+        return sorted([channel for channel in self._data.keys() if len(self._data[channel]) > 0])
+    def get_n_events(self, channel=None):
+        return len(self._data[channel])
+    def get_data(self, channel, start=0, stop=None):
+        return numpy.array(self._data[channel][start:stop])
+
+def _scale(data, meta_data, channel):
+    """ Convert raw samples to volts with the channel's saved preamble scale factors."""
+    prefix = "ch%i" % channel
+    if not (prefix + "YMULT") in meta_data:
+        raise Exception("No scale factors saved for channel %i." % channel)
+    return waveforms.to_volts(data, meta_data[prefix + "YZERO"], meta_data[prefix + "YOFF"],
+                              meta_data[prefix + "YMULT"])
+
+def _timebase(meta_data, channel, options, n_samples):
+    """ Return the channel's saved timebase, or a unit timebase (times are sample numbers) if there isn't one."""
+    try:
+        return waveforms.Timebase.from_dict(meta_data, options["timebase_key"] % channel + "_")
+    except KeyError:
+        return waveforms.Timebase(0.0, 1.0, 0, 0, n_samples)
+
+def _convert(reader, meta_data, file_index, start, stop, options):
+    """ Write the shard's events (of the file_index file) to a part file, returns its path."""
+    part_path = os.path.join(options["part_directory"], "part_%i_%i" % (file_index, start))
+    part = utils.RecordFile(part_path, options["channels"])
+    part.add_meta_dict(_converted_meta_data(meta_data, options))
+    for batch_start, batch in reader.iterate(options["batch_size"], options["channels"], start, stop):
+        for event in range(len(batch[options["channels"][0]])):
+            for channel in options["channels"]:
+                data = batch[channel][event]
+                part.add_data(_scale(data, meta_data, channel) if options["scale"] else data, channel)
+    part.save()
+    return part_path + ".rec"
+
+def _converted_meta_data(meta_data, options):
+    """ Return the meta data for converted events, which are dense (so without the zero suppression settings)
+    and, if scaled, without the scale factors of the channels scaled so they can't be scaled again."""
+    dropped = ["ch%i%s" % (channel, key) for channel in options["channels"] for key in ["YZERO", "YOFF", "YMULT"]] \
+        if options["scale"] else []
+    return dict([(key, value) for key, value in meta_data.items() \
+                     if not key.startswith("zero_suppression_") and not key in dropped])
+
+def _merge(operation, merged, result):
+    """ Merge the shard result into those merged so far."""
+    if operation == "measure":
+        merged = merged or {}
+        for channel in result.keys():
+            for key, value in result[channel].items():
+                merged.setdefault(channel, {}).setdefault(key, []).append(value)
+    elif operation == "histogram":
+        if merged is None:
+            return result
+        for channel in result.keys():
+            merged[channel].merge(result[channel])
+    elif operation == "convert":
+        merged = (merged or []) + [result]
+    return merged
+
+def _join_parts(part_paths, output, options):
+    """ Join the part files in order into the output file (record or hdf5stream, by the output extension)."""
+    channels = options["channels"]
+    output_path, extension = os.path.splitext(output)
+    if extension == ".hdf5":
+        results = utils.HDF5StreamFile(output_path, channels, options["batch_size"])
+    else:
+        results = utils.RecordFile(output_path, channels)
+    for part_path in part_paths:
+        with utils.RecordReader(part_path) as part:
+            if part_path == part_paths[0]:
+                results.add_meta_dict(part.get_meta_data())
+            for batch_start, batch in part.iterate(options["batch_size"], channels):
+                for event in range(len(batch[channels[0]])):
+                    for channel in channels:
+                        results.add_data(batch[channel][event], channel)
+    results.save()
+
+def _bins(value):
+    """ Parse low,high,bins."""
+    if value is None:
+        return None
+    low, high, bins = value.split(",")
+    return (float(low), float(high), int(bins))
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage = "usage: %prog [options] scale|measure|histogram|convert output files",
+                                   version="%prog 1.0")
+    parser.add_option("-j", type="int", dest="processes", help="Worker processes (default cores)", default=None)
+    parser.add_option("-e", type="int", dest="events", help="Events per shard", default=10000)
+    parser.add_option("-n", type="int", dest="batch_size", help="Events read at a time", default=100)
+    parser.add_option("-c", type="string", dest="channels", help="Channels", default="1")
+    parser.add_option("-s", action="store_true", dest="scale", help="Scale raw samples to volts", default=False)
+    parser.add_option("-t", type="string", dest="timebase_key", help="Timebase meta data key",
+                      default="ch%i_timeform")
+    parser.add_option("-a", type="float", dest="gate_low", help="Gate low (s)", default=None)
+    parser.add_option("-b", type="float", dest="gate_high", help="Gate high (s)", default=None)
+    parser.add_option("-l", type="float", dest="baseline_low", help="Baseline gate low (s)", default=None)
+    parser.add_option("-u", type="float", dest="baseline_high", help="Baseline gate high (s)", default=None)
+    parser.add_option("-p", action="store_true", dest="positive", help="Positive pulses", default=False)
+    parser.add_option("-A", type="string", dest="amplitude_bins", help="Amplitude histogram low,high,bins",
+                      default=None)
+    parser.add_option("-R", type="string", dest="area_bins", help="Area histogram low,high,bins", default=None)
+    (options, args) = parser.parse_args()
+    if len(args) < 3 or not args[0] in ["scale", "measure", "histogram", "convert"]:
+        print "Incorrect arguments"
+        parser.print_help()
+        exit(0)
+    gate = (options.gate_low, options.gate_high) if options.gate_low is not None else None
+    baseline_gate = (options.baseline_low, options.baseline_high) if options.baseline_low is not None else None
+    operation = args[0]
+    if operation == "scale": # Scaling alone is a conversion
+        operation = "convert"
+        options.scale = True
+    n_shards = reprocess(operation, args[2:], args[1],
+                         { "channels" : [int(channel) for channel in options.channels.split(",")],
+                           "batch_size" : options.batch_size,
+                           "scale" : options.scale,
+                           "timebase_key" : options.timebase_key,
+                           "gate" : gate,
+                           "baseline_gate" : baseline_gate,
+                           "negative" : not options.positive,
+                           "amplitude_bins" : _bins(options.amplitude_bins),
+                           "area_bins" : _bins(options.area_bins) },
+                         options.processes, options.events)
+    print "Reprocessed", len(args) - 2, "files in", n_shards, "shards to", args[1]
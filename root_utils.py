@@ -6,15 +6,22 @@
 #
 # Author P G Jones - 04/06/2013 <p.g.jones@qmul.ac.uk> : First revision
 #################################################################################################### 
-import ROOT
+import numpy
+import backends
+ROOT = backends.LazyModule("ROOT") # Loaded when first used, as it is slow to import
 
 def waveform_to_hist(timeform, waveform, data_units, title="hist"):
     """ Pass a tuple of dataforms and data units.
     Loaded values are in divs, must use scalings to convert to correct units if desired."""
     histogram = ROOT.TH1D("data", title, len(timeform), timeform[0], timeform[-1])
     histogram.SetDirectory(0)
-    for index, data in enumerate(waveform):
-        histogram.SetBinContent(index + 1, data)
+    fill_hist(histogram, waveform)
     histogram.GetXaxis().SetTitle(data_units[0])
     histogram.GetYaxis().SetTitle(data_units[1])
     return histogram
+
+def fill_hist(histogram, waveform):
+    """ Set the histogram bin contents from the waveform in a single call, bin index + 1 is waveform[index]."""
+    contents = numpy.zeros(histogram.GetNbinsX() + 2) # Including the under and overflow bins
+    contents[1:len(waveform) + 1] = waveform
+    histogram.SetContent(contents)
@@ -9,19 +9,29 @@
 import logging
 logger = logging.getLogger(__name__)
 
-try:
-    from pyvisa.vpp43 import visa_library, visa_exceptions
-    visa_library.load_library("/Library/Frameworks/Visa.framework/VISA") # Mac specific??
-    import visa
-except ImportError:
-    print "No VISA/pyVISA software installed, cannot use VisaUSB"
+import backends
+visa = backends.LazyModule("visa") # Loaded when a VisaUSB is first used
+visa_exceptions = backends.LazyModule("visa_exceptions")
 
+import collections
+import contextlib
+import os
+import re
 import socket
+import time
 
 class TekConnection(object):
     """ Base class for Tektronix scope connections."""
+    _service_requests = False # Whether wait_for_service_request is supported
+    _header_aliases = [(re.compile(r"^(ch\d+):volts$"), r"\1:scale")] # (pattern, replacement) to normalise headers
     def __init__(self):
         print "\n-----------------------------------------------------------------------------------"
+        self._batch = None # Commands queued whilst batching
+        self._batch_depth = 0
+        self._batch_sync = False # A sync is due at the end of the batch
+        self._settings = collections.OrderedDict() # Last value configured for each setting, by lower case
+                                                   # command header, in the order first configured
+        self._metrics = None # metrics.ConnectionMetrics to record the exchanges in, if any
     def __del__(self):
         print "-----------------------------------------------------------------------------------\n"
     def sync(self):
@@ -32,36 +42,232 @@ class TekConnection(object):
         return self.ask("*idn?")
     def send_sync(self, command):
         """ Send a command and wait till the scope is ready."""
+        if self._batch is not None:
+            self.send(command)
+            self._batch_sync = True # Once, at the end of the batch
+            return
         self.send(command)
         self.sync()
     def send(self, command):
-        logging.debug("send: %s" % command)
-        self._send(command)
+        self._forget_settings(command)
+        if self._batch is not None:
+            self._batch.append(command)
+            return
+        self._timed_send(command)
     def ask(self, command):
-        logging.debug("ask: %s" % command)
-        response = self._ask(command)
-        logging.debug("response: %s" % response)
+        self._flush_batch() # Queued commands must precede the query
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("ask: %s", command)
+        if self._metrics is None:
+            response = self._ask(command)
+        else:
+            start = time.time()
+            try:
+                response = self._ask(command)
+            except Exception:
+                self._metrics.record(command, time.time() - start, len(command), error=True)
+                raise
+            self._metrics.record(command, time.time() - start, len(command),
+                                 len(response) if response is not None else 0, timeout=response is None)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("response: %s", response)
         return response
+    @contextlib.contextmanager
+    def batch(self):
+        """ Queue the commands sent within the context, then send them joined as a single command with at most
+        a single sync. Batches can be nested, the outermost sends the commands."""
+        if self._batch_depth == 0:
+            self._batch = []
+            self._batch_sync = False
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._flush_batch()
+    def configure(self, command):
+        """ Send a setting command (header and value) and sync, unless the value is unchanged since it was last
+        configured."""
+        header, value = self._split_setting(command)
+        if header in self._settings and self._settings[header] == value:
+            return
+        self.send_sync(command)
+        self._settings[header] = value
+    def get_settings(self):
+        """ Return the configured settings as an (ordered) dict of values by command header."""
+        return collections.OrderedDict(self._settings)
+    def clear_settings(self):
+        """ Forget the configured settings, e.g. if they may have been changed at the scope."""
+        self._settings = collections.OrderedDict()
+    def restore_settings(self, settings):
+        """ Send all the settings (as get_settings returns) in a single batch, e.g. to re-apply the last known
+        configuration after a reconnect."""
+        self.clear_settings()
+        with self.batch():
+            for header, value in settings.items():
+                self.configure(("%s %s" % (header, value)).strip())
+    def reconnect(self, retries=3, interval=0.1):
+        """ Close and reopen the connection, retrying up to retries times interval seconds apart. The timeout
+        is kept and anything still to be read is discarded."""
+        timeout = self.get_timeout()
+        for attempt in range(retries + 1):
+            try:
+                self._disconnect()
+            except Exception:
+                logging.debug("reconnect: disconnect failed", exc_info=True)
+            try:
+                self._connect()
+                break
+            except Exception:
+                logging.exception("reconnect: attempt %i failed" % (attempt + 1))
+                if attempt == retries:
+                    raise
+                time.sleep(interval)
+        if timeout is not None:
+            self.set_timeout(timeout)
+        self._batch = None
+        self._batch_depth = 0
+    def set_metrics(self, metrics):
+        """ Record the exchanges in metrics (a metrics.ConnectionMetrics), None to stop recording."""
+        self._metrics = metrics
+    def get_metrics(self):
+        """ Return the metrics the exchanges are recorded in, None if they aren't."""
+        return self._metrics
+    def set_timeout(self, timeout):
+        """ Set the longest wait (in seconds) for any reply."""
+        self._set_timeout(timeout)
+    def get_timeout(self):
+        """ Return the reply timeout in seconds, None if unknown."""
+        return self._get_timeout()
+    def supports_service_requests(self):
+        """ Return True if the connection can wait_for_service_request."""
+        return self._service_requests
+    def wait_for_service_request(self, timeout):
+        """ Wait for the scope to request service, returns False if it didn't within timeout seconds (None
+        waits forever)."""
+        return self._wait_for_service_request(timeout)
+    def clear(self):
+        """ Clear the connection, discarding any replies still to be read."""
+        self._clear()
+#### Internal ######################################################################################
+    def _flush_batch(self):
+        """ Send the queued commands as one, with a single sync if any were due."""
+        if self._batch is None:
+            return
+        commands, self._batch = self._batch, None
+        if self._batch_sync:
+            commands.append("*wai")
+        if len(commands) == 0:
+            return
+        # Each command starts from the root, common (*) commands must not be prefixed
+        command = ";".join([command if command.startswith("*") else ":" + command.lstrip(":") \
+                                for command in commands])
+        self._timed_send(command)
+        if self._batch_depth > 0: # Flushed early for a query, carry on batching
+            self._batch = []
+            self._batch_sync = False
+    def _timed_send(self, command):
+        """ Send the command, recording it in the metrics if there are any."""
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("send: %s", command)
+        if self._metrics is None:
+            self._send(command)
+            return
+        start = time.time()
+        try:
+            self._send(command)
+        except Exception:
+            self._metrics.record(command, time.time() - start, len(command), error=True)
+            raise
+        self._metrics.record(command, time.time() - start, len(command))
+    def _split_setting(self, command):
+        """ Return the lower case header and the value of a setting command. Headers that are aliases of
+        another are returned as that header, so both are one setting."""
+        parts = command.strip().lstrip(":").split(None, 1)
+        header = parts[0].lower()
+        for alias, replacement in TekConnection._header_aliases:
+            header = alias.sub(replacement, header)
+        return header, parts[1].strip() if len(parts) > 1 else ""
+    def _forget_settings(self, command):
+        """ Forget configured settings that command may change, as it wasn't sent via configure."""
+        if len(self._settings) == 0:
+            return
+        for part in command.split(";"):
+            header = self._split_setting(part)[0] if part.strip() != "" else ""
+            if header.startswith("*rst"):
+                self._settings = collections.OrderedDict()
+            else:
+                self._settings.pop(header, None)
+    def _connect(self):
+        pass
+    def _disconnect(self):
+        pass
     def _send(self, command):
         pass
     def _ask(self, command):
         pass
+    def _set_timeout(self, timeout):
+        pass
+    def _get_timeout(self):
+        return None
+    def _wait_for_service_request(self, timeout):
+        return False
+    def _clear(self):
+        pass
 
 class VisaUSB(TekConnection):
     """ Connect via visa/usb."""
-    def __init__(self):
-        """ Try the default connection."""
+    _service_requests = True
+    def __init__(self, resource=None, cache_file=os.path.expanduser("~/.tek_visa_resource")):
+        """ Connect to the resource (e.g. USB0::0x0699::0x0374::C012345::INSTR), by default the resource last
+        connected to (saved in cache_file) or else the first USB instrument found."""
         super(VisaUSB, self).__init__()
+        self._cache_file = cache_file
         try:
-            for instrument in visa.get_instruments_list():
-                if instrument[0:3] == "USB":
-                    self._connection = visa.instrument(instrument, send_end=True)
-                    print "Connecting to", instrument
-                    print "Scope identity:", self.identity()
+            self._resource = resource if resource is not None else self._cached_resource()
+            if self._resource is not None:
+                try:
+                    self._connect()
+                except visa_exceptions.VisaIOError:
+                    if resource is not None:
+                        raise
+                    logging.info("Cached instrument %s not found." % self._resource)
+                    self._resource = None
+            if self._resource is None: # List the instruments, which is slow
+                for instrument in visa.get_instruments_list():
+                    if instrument[0:3] == "USB":
+                        self._resource = instrument
+                        self._connect()
+                        break
+                else:
+                    raise visa_exceptions.VisaIOError(-1073807343) # VI_ERROR_RSRC_NFOUND
+            print "Connecting to", self._resource
+            print "Scope identity:", self.identity()
         except visa_exceptions.VisaIOError:
             logging.exception("Cannot connect to any instrument.")
             print "Cannot connect to any instrument."
             raise
+        if self._cache_file is not None:
+            try:
+                if self._resource != self._cached_resource(): # Only write when it changes
+                    with open(self._cache_file, "w") as cache_file:
+                        cache_file.write(self._resource)
+            except (IOError, OSError):
+                logging.exception("Cannot save the resource in %s." % self._cache_file)
+    def _cached_resource(self):
+        """ Return the resource last connected to, None if there isn't one."""
+        if self._cache_file is None or not os.path.isfile(self._cache_file):
+            return None
+        with open(self._cache_file) as cache_file:
+            return cache_file.read().strip() or None
+    def _connect(self):
+        """ Open the resource."""
+        self._connection = visa.instrument(self._resource, send_end=True)
+    def _disconnect(self):
+        """ Close the resource."""
+        if hasattr(self, "_connection"):
+            self._connection.close()
     def _send(self, command):
         """ Send a command, doesn't expect a returned result."""
         try:
@@ -78,36 +284,202 @@ class VisaUSB(TekConnection):
             # No answer given
             print "VisaUSB::ask: Issues."
             return None
+    def _set_timeout(self, timeout):
+        """ Set the reply timeout in seconds, None for no timeout."""
+        if timeout is None:
+            del self._connection.timeout # pyvisa's infinite timeout
+        else:
+            self._connection.timeout = timeout
+    def _get_timeout(self):
+        """ Return the reply timeout in seconds, None if there is no timeout."""
+        try:
+            return self._connection.timeout
+        except NameError: # pyvisa raises rather than return an infinite timeout
+            return None
+    def _wait_for_service_request(self, timeout):
+        """ Wait for a service request, returns False on timeout."""
+        try:
+            self._connection.wait_for_srq(timeout)
+            return True
+        except visa_exceptions.VisaIOError:
+            return False
+    def _clear(self):
+        """ Send a device clear, the scope discards its output queue."""
+        self._connection.clear()
+
+class ReplyParser(object):
+    """ Splits the bytes received from a scope into line feed terminated replies. Definite length blocks
+    (#<n><len><data>) are taken whole as they may themselves contain line feeds, replies containing them are
+    returned as a bytearray. The connection feeds it what it receives and, whilst a block is incomplete, may
+    instead receive the rest of the block straight into block_view."""
+    def __init__(self):
+        self.clear()
+    def clear(self):
+        """ Discard anything received and any partial reply."""
+        self._buffer = bytearray() # Bytes received but not yet parsed
+        self._reply = bytearray()
+        self._binary = False
+        self._scanned = 0 # Buffer before this position contains neither a terminator nor a block
+        self._block_end = 0 # End of the block space in the reply, filled up to the end of the reply data
+        self._block_filled = 0
+    def feed(self, data):
+        """ Add received data."""
+        self._buffer += data
+    def parse(self):
+        """ Parse the data received, returns the reply once complete or None if more data is needed."""
+        while True:
+            if self.block_remaining() > 0:
+                filled = min(self.block_remaining(), len(self._buffer))
+                view = memoryview(self._reply)[self._block_filled:self._block_filled + filled]
+                view[:] = self._buffer[:filled]
+                del view # Release the reply so it can be extended again
+                del self._buffer[:filled]
+                self._block_filled += filled
+                if self.block_remaining() > 0:
+                    return None
+            newline = self._buffer.find(b"\n", self._scanned)
+            end = newline if newline != -1 else len(self._buffer)
+            block = self._buffer.find(b"#", self._scanned, end)
+            if block != -1:
+                self._reply += self._buffer[:block]
+                del self._buffer[:block]
+                self._scanned = 0
+                if not self._start_block():
+                    return None
+            elif newline != -1:
+                self._reply += self._buffer[:newline]
+                del self._buffer[:newline + 1]
+                reply = self._reply if self._binary else str(self._reply).rstrip()
+                self._reply = bytearray()
+                self._binary = False
+                self._scanned = 0
+                return reply
+            else:
+                self._scanned = len(self._buffer)
+                return None
+    def block_remaining(self):
+        """ Return the number of bytes of the current block still to be received."""
+        return self._block_end - self._block_filled
+    def block_view(self):
+        """ Return a memoryview of the space for the rest of the current block, it must be released (deleted)
+        before parsing again."""
+        return memoryview(self._reply)[self._block_filled:self._block_end]
+    def block_received(self, received):
+        """ Record that received bytes were put into the block_view."""
+        self._block_filled += received
+#### Internal ######################################################################################
+    def _start_block(self):
+        """ Start the block at the front of the buffer, space for its data is allocated in the reply. Returns
+        False if more data is needed to read its header."""
+        if len(self._buffer) < 2:
+            return False
+        if not chr(self._buffer[1]).isdigit() or self._buffer[1:2] == b"0":
+            # Not a block, or an indefinite length block which is terminated like any other reply
+            self._reply += self._buffer[:1]
+            del self._buffer[:1]
+            return True
+        header_length = 2 + int(chr(self._buffer[1]))
+        if len(self._buffer) < header_length:
+            return False
+        length = int(str(self._buffer[2:header_length]))
+        self._reply += self._buffer[:header_length]
+        del self._buffer[:header_length]
+        self._block_filled = len(self._reply)
+        self._reply += bytearray(length)
+        self._block_end = len(self._reply)
+        self._binary = True
+        return True
 
 class TCPIP(TekConnection):
     """ Connect via TCP/IP i.e. ethernet."""
-    def __init__(self, ip, port):
-        """ Connect with the ip and port address."""
-        super(VisaUSB, self).__init__()
-        self._connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._connection.connect((ip, port))
-        self._connection.setblocking(False)
+    _chunk_size = 65536 # Maximum bytes read from the socket into the buffer at a time
+    def __init__(self, ip, port, timeout=10.0):
+        """ Connect with the ip and port address, timeout (in seconds) is the longest wait for any reply."""
+        super(TCPIP, self).__init__()
+        self._address = (ip, port)
+        self._timeout = timeout
+        self._chunk = bytearray(TCPIP._chunk_size)
+        self._chunk_view = memoryview(self._chunk)
+        self._connect()
         print "Connecting to %s:%i" % (ip, port)
         print "Scope identity:", self.identity()
     def __del__(self):
         """ Close the connection."""
         self._connection.close()
+    def _connect(self):
+        """ Open the socket."""
+        self._connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._connection.settimeout(self._timeout)
+        self._connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # Don't delay short commands
+        self._connection.connect(self._address)
+        self._parser = ReplyParser()
+        self._late_replies = 0 # Replies to queries that timed out, still to arrive and be discarded
+    def _disconnect(self):
+        """ Close the socket."""
+        self._connection.close()
     def _send(self, command):
         """ Send a command, doesn't expect a returned result."""
-        self._connection.send(command)
-
+        if not command.endswith("\n"):
+            command += "\n" # Scope expects a line feed terminator
+        self._connection.sendall(command)
     def _ask(self, command):
-        """ Send a command and expect an answer."""
-        self._connection.send(command)
-        response = ''
+        """ Send a command and expect an answer, replies containing binary blocks are returned as a bytearray.
+        Late replies to earlier queries that timed out arrive first, and are discarded."""
+        self._send(command)
+        self._late_replies += 1 # Until read, this reply is owed
+        try:
+            while self._late_replies > 1:
+                self._read_reply()
+                self._late_replies -= 1
+            reply = self._read_reply()
+            self._late_replies -= 1
+            return reply
+        except socket.timeout:
+            # No answer given in time, anything partial is kept as the rest of the reply may still arrive
+            logging.exception("ask")
+            print "TCPIP::ask: Timed out."
+            return None
+    def _set_timeout(self, timeout):
+        """ Set the reply timeout in seconds."""
+        self._timeout = timeout
+        self._connection.settimeout(timeout)
+    def _get_timeout(self):
+        """ Return the reply timeout in seconds."""
+        return self._timeout
+    def _clear(self):
+        """ Discard anything received, including replies that arrive within a short grace period."""
+        timeout = self._connection.gettimeout()
+        self._connection.settimeout(0.1)
+        try:
+            while True:
+                self._receive()
+        except (socket.timeout, socket.error):
+            pass
+        finally:
+            self._connection.settimeout(timeout)
+        self._parser.clear()
+        self._late_replies = 0
+#### Internal ######################################################################################
+    def _receive(self):
+        """ Receive whatever is available (at least a byte) for the parser."""
+        received = self._connection.recv_into(self._chunk)
+        if received == 0:
+            raise socket.error("Connection closed by the scope.")
+        self._parser.feed(self._chunk_view[:received])
+    def _read_reply(self):
+        """ Read a reply (see ReplyParser), the rest of a block is read straight from the socket into the space
+        preallocated in the reply."""
         while True:
-            char = ""
-            try:
-                char = self._connection.recv(1)
-            except:
-                if response.rstrip() != "":
-                    break
-            if char:
-                response += char
-        return response.rstrip()
-    
+            reply = self._parser.parse()
+            if reply is not None:
+                return reply
+            remaining = self._parser.block_remaining()
+            if remaining > 0:
+                view = self._parser.block_view()
+                received = self._connection.recv_into(view, remaining)
+                del view # Release the reply so it can be extended again
+                if received == 0:
+                    raise socket.error("Connection closed by the scope.")
+                self._parser.block_received(received)
+            else:
+                self._receive()
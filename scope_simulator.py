@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+#
+# scope_simulator.py
+#
+# A simulated Tektronix scope, for testing and benchmarking without hardware. The scope can be used in process
+# via SimulatedConnection, or over TCP/IP with the TCPIP connection via SimulatedServer.
+#
+####################################################################################################
+import logging
+logger = logging.getLogger(__name__)
+
+import numpy
+import re
+import socket
+import SocketServer
+import threading
+import time
+import scope_connections
+
+class SimulatedScope(object):
+    """ Emulates the subset of the SCPI commands this project uses. Triggers arrive randomly at trigger_rate
+    (per second) and each waveform is noise plus a pulse at the trigger point. latency (seconds) is added to
+    each reply and bandwidth (bytes per second, None for unlimited) limits the rate replies are sent."""
+    _levels_per_div = { 1 : 25.0, 2 : 6400.0 } # Digitiser levels per vertical division by data width
+    _pool_size = 4 # Distinct waveforms generated per channel, events cycle through them
+    def __init__(self, record_length=100000, trigger_rate=1000.0, latency=0.0, bandwidth=None, channels=4,
+                 pulse_amplitude=-0.05, pulse_rise=1e-9, pulse_decay=5e-9, noise=0.002, seed=None):
+        """ Initialise the simulated scope, voltages are in volts and times in seconds."""
+        self.trigger_rate = trigger_rate
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._n_channels = channels
+        self._record_length = record_length
+        self._pulse = (pulse_amplitude, pulse_rise, pulse_decay)
+        self._noise = noise
+        self._random = numpy.random.RandomState(seed)
+        self._lock = threading.Lock()
+        self.reset()
+    def reset(self):
+        """ Reset the settings, as *rst."""
+        self._settings = {} # Last value of any setting command, by lower case header
+        self._header = True
+        self._selected = dict([(channel, channel == 1) for channel in range(1, self._n_channels + 1)])
+        self._scale = dict([(channel, 0.1) for channel in range(1, self._n_channels + 1)]) # Volts per division
+        self._horizontal_scale = 4e-6 # Seconds per division
+        self._source = [1]
+        self._data_start = 1
+        self._data_stop = self._record_length
+        self._width = 1
+        self._byte_order = "MSB"
+        self._acquiring = False
+        self._sequence = False # Stop after a single acquisition (sequence) rather than run continuously
+        self._triggered_mode = False
+        self._trigger_time = 0.0 # Time of the next (or last) trigger
+        self._event = 0 # Index of the current waveform in the pool
+        self._pool = {} # Waveforms in volts by channel
+        self._curves = {} # Encoded curve replies by (channel, event, start, stop, width, byte order)
+        self._status = 0 # Event status register
+    def handle(self, message):
+        """ Handle a message of ; separated commands, return the reply or None if there is nothing to reply."""
+        with self._lock:
+            replies = []
+            for command in self._split(message):
+                reply = self._handle_command(command)
+                if reply is not None:
+                    replies.append(reply)
+        if len(replies) == 0:
+            return None
+        reply = ";".join(replies)
+        delay = self.latency
+        if self.bandwidth is not None:
+            delay += len(reply) / float(self.bandwidth)
+        if delay > 0.0:
+            time.sleep(delay)
+        return reply
+    def get_preamble(self, channel):
+        """ Return the preamble fields (in reply order) for the channel."""
+        x_incr = self._horizontal_scale * 10.0 / self._record_length
+        return [ ("BYT_NR", "%i" % self._width),
+                 ("BIT_NR", "%i" % (8 * self._width)),
+                 ("ENCDG", "BIN"),
+                 ("BN_FMT", "RI"),
+                 ("BYT_OR", self._byte_order),
+                 ("WFID", '"Ch%i, DC coupling, %.3EV/div, %.3Es/div, %i points, Sample mode"' % \
+                      (channel, self._scale[channel], self._horizontal_scale, self._record_length)),
+                 ("NR_PT", "%i" % (self._data_stop - self._data_start + 1)),
+                 ("PT_FMT", "Y"),
+                 ("XUNIT", '"s"'),
+                 ("XINCR", "%.4E" % x_incr),
+                 ("XZERO", "%.4E" % (-x_incr * (self._record_length // 2))), # Trigger in the centre
+                 ("PT_OFF", "0"),
+                 ("YUNIT", '"V"'),
+                 ("YMULT", "%.4E" % self._y_mult(channel)),
+                 ("YOFF", "0.0E+0"),
+                 ("YZERO", "0.0E+0") ]
+#### Internal ######################################################################################
+    def _split(self, message):
+        """ Split the message into commands, ignoring ; within quotes."""
+        commands = re.findall(r"""(?:[^;"']|"[^"]*"|'[^']*')+""", message.strip())
+        return [command.strip().lstrip(":").replace("::", ":") for command in commands if command.strip() != ""]
+    def _handle_command(self, command):
+        """ Handle a single command, return the reply or None."""
+        parts = command.split(None, 1)
+        header = parts[0].lower()
+        argument = parts[1].strip() if len(parts) > 1 else ""
+        if header.endswith("?"):
+            return self._query(header[:-1], argument)
+        self._set(header, argument)
+        return None
+    def _reply(self, header, value):
+        """ Format a reply, with the header if headers are on."""
+        if self._header:
+            return ":%s %s" % (header.upper(), value)
+        return value
+    def _query(self, header, argument):
+        """ Reply to a query."""
+        if header == "*idn":
+            return "TEKTRONIX,SIM2000,SIMULATED,CF:91.1CT FV:v1.0"
+        elif header == "*opc":
+            if self._acquiring and self._sequence: # Operation completes with the acquisition
+                self._wait_for_trigger()
+                self._acquiring = False
+            return "1"
+        elif header == "*esr":
+            status, self._status = self._status, 0
+            return "%i" % status
+        elif header == "select":
+            if self._header:
+                return ":SELECT:" + ";".join(["CH%i %i" % (channel, self._selected[channel]) \
+                                                  for channel in sorted(self._selected)])
+            return ";".join(["%i" % self._selected[channel] for channel in sorted(self._selected)])
+        elif header.startswith("select:ch"):
+            return self._reply(header, "%i" % self._selected[int(header[9:])])
+        elif header == "wfmoutpre":
+            fields = self.get_preamble(self._source[0])
+            if self._header:
+                return ":WFMOUTPRE:" + ";".join(["%s %s" % field for field in fields])
+            return ";".join([value for key, value in fields])
+        elif header.startswith("wfmoutpre:"):
+            fields = dict(self.get_preamble(self._source[0]))
+            return self._reply(header, fields[header[len("wfmoutpre:"):].upper()])
+        elif header == "curve":
+            return self._curve()
+        elif header == "acquire:state":
+            if self._acquiring and self._sequence and time.time() >= self._trigger_time:
+                self._acquiring = False # Sequence complete
+            return self._reply(header, "%i" % self._acquiring)
+        elif header == "trigger:state":
+            if not self._acquiring:
+                return self._reply(header, "SAVE")
+            elif time.time() < self._trigger_time:
+                return self._reply(header, "READY")
+            return self._reply(header, "TRIGGER")
+        elif header == "trigger:frequency":
+            return self._reply(header, "%.4E" % self.trigger_rate)
+        elif header in ["horizontal:acqlength", "horizontal:recordlength"]:
+            return self._reply(header, "%i" % self._record_length)
+        elif header == "acquire:mode":
+            return self._reply(header, self._settings.get(header, "SAMPLE").upper())
+        elif header == "measurement:immed:value":
+            return self._reply(header, "%.4E" % self._measure())
+        return self._reply(header, self._settings.get(header, "0"))
+    def _set(self, header, argument):
+        """ Apply a setting or action command."""
+        self._settings[header] = argument
+        on = argument.lower() in ["on", "1", "run"]
+        if header == "*rst":
+            self.reset()
+        elif header == "*cls":
+            self._status = 0
+        elif header == "*opc":
+            if self._acquiring and self._sequence:
+                self._wait_for_trigger()
+                self._acquiring = False
+            self._status |= 1 # Operation complete
+        elif header == "header":
+            self._header = on
+        elif header.startswith("select:ch"):
+            self._selected[int(header[9:])] = on
+        elif re.match(r"ch\d:(scale|volts)$", header):
+            self._scale[int(header[2])] = float(argument)
+            self._curves = {}
+        elif header == "horizontal:scale":
+            self._horizontal_scale = float(argument)
+            self._pool = {}
+            self._curves = {}
+        elif header == "horizontal:recordlength":
+            self._record_length = int(argument)
+            self._data_stop = min(self._data_stop, self._record_length)
+            self._pool = {}
+            self._curves = {}
+        elif header == "data:source":
+            self._source = [int(source.strip()[2:]) for source in argument.split(",")]
+        elif header == "data:start":
+            self._data_start = max(1, int(argument))
+        elif header == "data:stop":
+            self._data_stop = min(self._record_length, int(argument))
+        elif header == "data:width":
+            self._width = int(argument)
+        elif header == "data:encdg":
+            self._byte_order = "LSB" if argument.lower().startswith("sri") else "MSB"
+        elif header == "acquire:stopafter":
+            self._sequence = argument.lower().startswith("seq")
+        elif header == "trigger:a:mode":
+            self._triggered_mode = argument.lower().startswith("norm")
+        elif header == "acquire:state":
+            if on:
+                self._arm()
+            else:
+                self._acquiring = False
+    def _arm(self):
+        """ Start an acquisition, the trigger arrives after a random delay."""
+        self._acquiring = True
+        self._event = (self._event + 1) % SimulatedScope._pool_size
+        self._trigger_time = time.time()
+        if self._triggered_mode and self.trigger_rate > 0.0:
+            self._trigger_time += self._random.exponential(1.0 / self.trigger_rate)
+    def _wait_for_trigger(self):
+        """ Block until the trigger time."""
+        delay = self._trigger_time - time.time()
+        if delay > 0.0:
+            time.sleep(delay)
+    def _y_mult(self, channel):
+        """ Volts per digitiser level."""
+        return self._scale[channel] / SimulatedScope._levels_per_div[self._width]
+    def _waveform(self, channel, event):
+        """ Return the full record waveform in volts for the channel and event."""
+        if not channel in self._pool:
+            x_incr = self._horizontal_scale * 10.0 / self._record_length
+            times = (numpy.arange(self._record_length) - self._record_length // 2) * x_incr
+            amplitude, rise, decay = self._pulse
+            after = numpy.clip(times, 0.0, None) # Pulse starts at the trigger
+            pulse = (1.0 - numpy.exp(-after / rise)) * numpy.exp(-after / decay)
+            pool = []
+            for index in range(SimulatedScope._pool_size):
+                waveform = self._random.normal(0.0, self._noise, self._record_length)
+                waveform += amplitude * self._random.uniform(0.5, 1.5) * pulse
+                pool.append(waveform.astype(numpy.float32))
+            self._pool[channel] = pool
+        return self._pool[channel][event]
+    def _curve(self):
+        """ Return the curve reply, a definite length block for each data source."""
+        blocks = []
+        for channel in self._source:
+            key = (channel, self._event, self._data_start, self._data_stop, self._width, self._byte_order)
+            if not key in self._curves:
+                if len(self._curves) > 64:
+                    self._curves = {}
+                waveform = self._waveform(channel, self._event)[self._data_start - 1:self._data_stop]
+                limit = 2 ** (8 * self._width - 1)
+                samples = numpy.clip(numpy.round(waveform / self._y_mult(channel)), -limit, limit - 1)
+                data = samples.astype("%si%i" % (">" if self._byte_order == "MSB" else "<", self._width)).tostring()
+                length = "%i" % len(data)
+                self._curves[key] = "#%i%s%s" % (len(length), length, data)
+            blocks.append(self._curves[key])
+        return self._reply("curve", ";".join(blocks)) if self._header else ";".join(blocks)
+    def _measure(self):
+        """ Return the area of the measurement source waveform between the cursors."""
+        channel = int(self._settings.get("measurement:immed:source1", "ch1").strip()[2:])
+        x_incr = self._horizontal_scale * 10.0 / self._record_length
+        low = float(self._settings.get("cursor:vbars:position1", "-1"))
+        high = float(self._settings.get("cursor:vbars:position2", "1"))
+        first = max(0, int(low / x_incr) + self._record_length // 2)
+        last = min(self._record_length, int(high / x_incr) + self._record_length // 2 + 1)
+        return float(numpy.sum(self._waveform(channel, self._event)[first:last], dtype=numpy.float64)) * x_incr
+
+class SimulatedConnection(scope_connections.TekConnection):
+    """ Connect to a simulated scope in process."""
+    def __init__(self, scope=None):
+        """ Connect to the scope, a default SimulatedScope if None."""
+        super(SimulatedConnection, self).__init__()
+        if scope is None:
+            scope = SimulatedScope()
+        self._scope = scope
+        print "Connecting to simulated scope"
+        print "Scope identity:", self.identity()
+    def _send(self, command):
+        """ Send a command, doesn't expect a returned result."""
+        self._scope.handle(command)
+    def _ask(self, command):
+        """ Send a command and expect an answer."""
+        return self._scope.handle(command)
+
+class _SimulatedHandler(SocketServer.StreamRequestHandler):
+    """ Serves a connection, each line received is a message to the scope."""
+    def handle(self):
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            reply = self.server.scope.handle(line)
+            if reply is not None:
+                self.wfile.write(reply + "\n")
+                self.wfile.flush()
+
+class SimulatedServer(SocketServer.ThreadingTCPServer):
+    """ Serve a simulated scope over TCP/IP, connect with scope_connections.TCPIP(*server.address)."""
+    allow_reuse_address = True
+    daemon_threads = True
+    def __init__(self, scope=None, address=("127.0.0.1", 0)):
+        """ Listen on address, the default chooses a free local port."""
+        SocketServer.ThreadingTCPServer.__init__(self, address, _SimulatedHandler)
+        if scope is None:
+            scope = SimulatedScope()
+        self.scope = scope
+        self.address = self.server_address
+        self._thread = None
+    def start(self):
+        """ Serve in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+    def stop(self):
+        """ Stop serving and close the socket."""
+        self.shutdown()
+        self.server_close()
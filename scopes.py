@@ -7,9 +7,20 @@
 #
 # Author P G Jones - 28/05/2013 <p.g.jones@qmul.ac.uk> : First revision
 #################################################################################################### 
+import logging
 import re
 import numpy
 import time
+import waveforms
+
+class AcquisitionTimeout(Exception):
+    """ No acquisition was made within the wait timeout."""
+    @classmethod
+    def after(cls, timeout):
+        """ Return the exception for no acquisition within timeout seconds (None if the scope never replied)."""
+        if timeout is None:
+            return cls("No acquisition, the scope did not reply.")
+        return cls("No acquisition within %s seconds." % timeout)
 
 class Tektronix(object):
     """ Base class for tektronix scopes."""
@@ -29,19 +40,26 @@ class Tektronix(object):
                         'YOFF'   : float, # Y offset
                         'YZERO'  : float, # Y zero value
                         'RECORDLENGTH' : int } # Number of data points
-    def __init__(self, connection):
-        """ Initialise the scope with a connection to the scope."""
+    def __init__(self, connection, reset=True):
+        """ Initialise the scope with a connection to the scope, if reset is False the scope keeps its current
+        settings (e.g. to attach to a scope that is already set up)."""
         # Initiliase setttings to nothing
         self._preamble = {}
         self._channels = {} 
         self._connection = connection
-        self._connection.send_sync("*rst") # Reset the scope
-        self._connection.send_sync("lock none") # Unlock the front panel
-        self._connection.send_sync("*cls") # Clear the scope
-        self._connection.send_sync("verbose 1") # If the headers are on ensure they are verbose
+        with self._connection.batch():
+            if reset:
+                self._connection.send_sync("*rst") # Reset the scope
+            self._connection.send_sync("lock none") # Unlock the front panel
+            self._connection.send_sync("*cls") # Clear the scope
+            self._connection.send_sync("verbose 1") # If the headers are on ensure they are verbose
         self._locked = False # Local locking of scope settings
         self._data_start = 1
         self._triggered = False
+        self._wait_strategy = "poll"
+        self._wait_timeout = None # Seconds, None waits forever
+        self._poll_intervals = (1e-4, 1e-2) # Minimum and maximum seconds between polls
+        self._preamble_cache = {} # Preambles by channel and the configured settings
     def __del__(self):
         """ Free up the scope."""
         self.unlock()
@@ -67,111 +85,203 @@ class Tektronix(object):
         return self._channels
     def lock(self):
         """ Get the current settings and allow no more changes."""
-        self._connection.send_sync("lock all") # Prevent people channing the settings via the front panel
-        self._connection.send_sync("header off") # Turn all headers off
+        with self._connection.batch():
+            self._connection.send_sync("lock all") # Prevent people channing the settings via the front panel
+            self._connection.send_sync("header off") # Turn all headers off
         self._locked = True
-    def begin(self):
-        """ Start taking data."""
+    def begin(self, timeout=10.0):
+        """ Start taking data, once the scope has applied the settings (waiting at most timeout seconds)."""
         if self._locked is False:
             print "Not locked"
             raise
-        time.sleep(10) # Prudent to wait for the scope to recover from the settings...
+        self.wait_ready(timeout)
         self._find_active_channels()
+        settings = tuple(sorted(self._connection.get_settings().items())) # Settings that produce the preamble
         for channel in self._channels.keys():
             if self._channels[channel]:
-                self._get_preamble(channel)
-        self._connection.send_sync("message:show 'Taking Data, scope is locked.'")
-        self._connection.send_sync("message:state on")
+                if not (channel, settings) in self._preamble_cache:
+                    self._get_preamble(channel)
+                    self._preamble_cache[(channel, settings)] = self._preamble[channel]
+                self._preamble[channel] = self._preamble_cache[(channel, settings)]
+        with self._connection.batch():
+            self._connection.send_sync("message:show 'Taking Data, scope is locked.'")
+            self._connection.send_sync("message:state on")
     def unlock(self):
         """ Unlock and allow changes."""
         self._locked = False
-        self._connection.send_sync("message:state off")
-        self._connection.send_sync("lock none") # Allow the front panel to be used
+        with self._connection.batch():
+            self._connection.send_sync("message:state off")
+            self._connection.send_sync("lock none") # Allow the front panel to be used
+        self._connection.clear_settings() # Settings may now be changed at the scope
+        self._preamble_cache = {}
+    def wait_ready(self, timeout=10.0):
+        """ Wait until the scope has completed all pending operations, at most timeout seconds. Returns the
+        (cleared) event status register, logging a warning if it shows errors."""
+        previous_timeout = self._connection.get_timeout()
+        self._connection.set_timeout(timeout)
+        try:
+            reply = self._connection.ask("*opc?;*esr?")
+        finally:
+            if previous_timeout is not None:
+                self._connection.set_timeout(previous_timeout)
+        if reply is None:
+            raise Exception("Scope not ready after %s seconds." % timeout)
+        status = int(reply.split(";")[-1])
+        if status & 0x3c: # Query, device, execution or command error bits
+            logging.warning("Scope reported errors, event status register %i." % status)
+        return status
+    def recover(self, timeout=10.0, retries=3):
+        """ Recover from a lost connection: reconnect (at most retries times), re-apply the configured settings
+        and, if the scope was taking data, lock and begin again (without re-reading the preambles if the
+        settings are unchanged)."""
+        settings = self._connection.get_settings()
+        locked = self._locked
+        self._connection.reconnect(retries)
+        self._connection.clear()
+        self._connection.send("header off") # Replies are parsed without headers
+        self.wait_ready(timeout)
+        self._connection.restore_settings(settings)
+        if locked:
+            self.lock()
+            self.begin(timeout)
     def get_preamble(self, channel):
         return self._preamble[channel]
 #### General Settings ###############################################################################
     def set_display_x(self, scale, pos=0):
         """ The scope x display settings, these do not affect the waveform.
         scale in seconds per div and pos in percentage of screen."""
-        self._connection.send_sync("horizontal:scale %e" % scale)
-        self._connection.send_sync("horizontal:position %i" % pos)
+        with self._connection.batch():
+            self._connection.configure("horizontal:scale %e" % scale)
+            self._connection.configure("horizontal:position %i" % pos)
     def set_display_y(self, channel, mult, pos=0.0, offset=0.0):
         """ The channel y display settings, these do not affect the waveform.
         mult or volts per div, yoffset (in volts) and position in divs."""
-        self._connection.send_sync("ch%i:volts %e" %(channel, mult))
-        self._connection.send_sync("ch%i:position %e" %(channel, pos))
-        self._connection.send_sync("ch%i:offset %e" %(channel, offset))
+        with self._connection.batch():
+            self._connection.configure("ch%i:volts %e" %(channel, mult))
+            self._connection.configure("ch%i:position %e" %(channel, pos))
+            self._connection.configure("ch%i:offset %e" %(channel, offset))
 #### Waveform Settings ##############################################################################
-    def set_data_mode(self, data_start=1, data_stop=None):
-        """ Set the settings for the data returned by the scope."""
-        self._connection.send_sync("wfmoutpre:pt_fmt y") # Single point format
-        self._connection.send_sync("data:encdg ribinary") # Signed int binary mode
-        self._connection.send_sync("data:start %i" % data_start) # Start point
-        self._data_start = data_start
-        if data_stop is None:
-            data_stop = int(self._connection.ask("horizontal:acqlength?"))
-        self._connection.send_sync("data:stop %i" % data_stop) # 100000 is full 
+    def set_data_mode(self, data_start=1, data_stop=None, width=None, window=None):
+        """ Set the settings for the data returned by the scope, the points data_start to data_stop (from 1, the
+        default stop is the whole record). Alternatively window is the (low, high) times in seconds relative
+        to the trigger, and the fewest points covering it are returned. width is the bytes per point (1 or 2),
+        auto for the fewest that keep the resolution of the acquisition mode or None to leave unchanged."""
+        if window is not None:
+            data_start, data_stop = self._window_points(window)
+        with self._connection.batch():
+            self._connection.configure("wfmoutpre:pt_fmt y") # Single point format
+            self._connection.configure("data:encdg ribinary") # Signed int binary mode
+            if width == "auto":
+                width = self._auto_data_width()
+            if width is not None:
+                self._connection.configure("data:width %i" % width) # Bytes per point
+            self._connection.configure("data:start %i" % data_start) # Start point
+            self._data_start = data_start
+            if data_stop is None:
+                data_stop = int(self._connection.ask("horizontal:acqlength?"))
+            self._connection.configure("data:stop %i" % data_stop) # 100000 is full 
 #### Cursor Settings ################################################################################
     def set_cursors(self, low, high):
-        self._connection.send_sync("cursor:function waveform")
-        self._connection.send_sync("cursor:vbars:position1 %e" % low)
-        self._connection.send_sync("cursor:vbars:position2 %e" % high)
+        with self._connection.batch():
+            self._connection.configure("cursor:function waveform")
+            self._connection.configure("cursor:vbars:position1 %e" % low)
+            self._connection.configure("cursor:vbars:position2 %e" % high)
 #### Horizontal Settings ############################################################################
     def set_horizontal_scale(self, scale):
-        self._connection.send_sync("horizontal:scale %e" % scale)
+        self._connection.configure("horizontal:scale %e" % scale)
 #### Channel Settings ###############################################################################
     def set_channel_y(self, channel, scale):
-        self._connection.send_sync("ch%i:scale %e" % (channel, scale))
+        self._connection.configure("ch%i:scale %e" % (channel, scale))
     def set_active_channel(self, channel, active=True):
         if active:
-            self._connection.send_sync("select:ch%i on" % channel)
+            self._connection.configure("select:ch%i on" % channel)
         else:
-            self._connection.send_sync("select:ch%i off" % channel)
+            self._connection.configure("select:ch%i off" % channel)
     def set_invert_channel(self, channel, invert=True):
         """ Invert the channel."""
         if invert:
-            self._connection.send_sync("ch%i:invert on" % channel)
+            self._connection.configure("ch%i:invert on" % channel)
         else:
-            self._connection.send_sync("ch%i:invert off" % channel)
+            self._connection.configure("ch%i:invert off" % channel)
     def set_channel_coupling(self, channel, coupling="ac"):
-        self._connection.send_sync("ch%i:coupling %s" % (channel, coupling))
+        self._connection.configure("ch%i:coupling %s" % (channel, coupling))
     def set_probe_gain(self, channel, gain):
-        self._connection.send_sync("ch%i:probe:gain %f" % (channel, gain))
+        self._connection.configure("ch%i:probe:gain %f" % (channel, gain))
 #### Acquisition Type ###############################################################################
     def set_single_acquisition(self):
         """ Set the scope in single acquisition mode."""
-        self._connection.send_sync("acquire:mode sample") # Single acquisition mode, not average
+        self._connection.configure("acquire:mode sample") # Single acquisition mode, not average
     def set_average_acquisition(self, averages):
         """ Set the scope in average acquisition mode."""
-        self._connection.send_sync("acquire:mode average")
-        self._connection.send_sync("acquire::numavg %i" % averages)
+        with self._connection.batch():
+            self._connection.configure("acquire:mode average")
+            self._connection.configure("acquire::numavg %i" % averages)
 #### Measurement Type ###############################################################################
     def set_measurement(self, type):
         """ Set the scope to do a measurement of the waveform."""
         if not type in ["area"]:
             print "Unknown measurement."
             return
-        self._connection.send_sync("measurement:immed:type %s" % type)
-        self._connection.send_sync("measurement:gating cursor")
+        with self._connection.batch():
+            self._connection.configure("measurement:immed:type %s" % type)
+            self._connection.configure("measurement:gating cursor")
         #self._connection.send_sync("measurement:immed:state on" % measurement)
 #### Trigger Settings ###############################################################################
     def set_untriggered(self):
         """ Set the scope to untriggered mode."""
         self._triggered = False
-        self._connection.send_sync("trigger:a:mode auto")
+        self._connection.configure("trigger:a:mode auto")
     def set_edge_trigger(self, trigger_level, channel, falling=False):
         """ Set an edge trigger with the settings."""
         self._triggered = True
-        self._connection.send_sync("trigger:a:type edge") # Chose the edge trigger
-        self._connection.send_sync("trigger:a:mode normal") # Normal mode (waits for a trigger)
-        self._connection.send_sync("trigger:a:edge:source ch%i" % channel)
-        self._connection.send_sync("trigger:a:edge:coupling dc") # DC coupling
-        if falling:
-            self._connection.send_sync("trigger:a:edge:slope fall") # Falling or ...
+        with self._connection.batch():
+            self._connection.configure("trigger:a:type edge") # Chose the edge trigger
+            self._connection.configure("trigger:a:mode normal") # Normal mode (waits for a trigger)
+            self._connection.configure("trigger:a:edge:source ch%i" % channel)
+            self._connection.configure("trigger:a:edge:coupling dc") # DC coupling
+            if falling:
+                self._connection.configure("trigger:a:edge:slope fall") # Falling or ...
+            else:
+                self._connection.configure("trigger:a:edge:slope rise") # ... rising slope
+            self._connection.configure("trigger:a:level %e" % trigger_level) # Sets the trigger level in Volts
+            self._connection.configure("trigger:a:level:ch%i %e" % (channel, trigger_level)) # Sets the trigger level in Volts
+    def set_wait_strategy(self, strategy="poll", timeout=None, min_interval=1e-4, max_interval=1e-2):
+        """ Choose how acquire waits for an acquisition, timeout is in seconds (None to wait forever).
+        poll: query the acquisition and trigger state, backing off from min_interval to max_interval seconds
+              between queries.
+        opc:  the scope acquires a single sequence and the *opc? reply is the completion, no polling.
+        srq:  as opc, but completion is signalled by a service request (not supported by all connections)."""
+        if not strategy in ["poll", "opc", "srq"]:
+            raise Exception("Unknown wait strategy %s." % strategy)
+        if strategy == "srq" and not self._connection.supports_service_requests():
+            raise Exception("Service requests are not supported by this connection.")
+        self._wait_strategy = strategy
+        self._wait_timeout = timeout
+        self._poll_intervals = (min_interval, max_interval)
+        if strategy == "poll":
+            self._connection.configure("acquire:stopafter runstop")
         else:
-            self._connection.send_sync("trigger:a:edge:slope rise") # ... rising slope
-        self._connection.send_sync("trigger:a:level %e" % trigger_level) # Sets the trigger level in Volts
-        self._connection.send_sync("trigger:a:level:ch%i %e" % (channel, trigger_level)) # Sets the trigger level in Volts
+            self._connection.configure("acquire:stopafter sequence") # Acquisition completes after a trigger
+        if strategy == "srq":
+            with self._connection.batch():
+                self._connection.configure("*ese 1") # Operation complete sets the event status register...
+                self._connection.configure("*sre 32") # ... which then requests service
+    def get_wait_strategy(self):
+        """ Return the (strategy, timeout, min_interval, max_interval) set by set_wait_strategy."""
+        return (self._wait_strategy, self._wait_timeout) + self._poll_intervals
+    def poll_query(self):
+        """ Return the query that polls for an acquisition, see is_acquired."""
+        if self._triggered:
+            return "acquire:state?;:trigger:state?"
+        return "acquire:state?"
+    def is_acquired(self, reply):
+        """ Return True if the poll_query reply shows an acquisition (and a trigger, if triggering)."""
+        if reply is None:
+            return False
+        states = reply.split(";")
+        if int(states[0]) == 0:
+            return False
+        return not self._triggered or states[1].strip() != "READY"
 #### Data acquistion ################################################################################
     def get_trigger_frequency(self):
         trigger_frequency = self._connection.ask("trigger:frequency?")
@@ -180,69 +290,156 @@ class Tektronix(object):
         elif trigger_frequency is not None:
             return float(trigger_frequency)
     def acquire(self):
-        """ Wait until scope has an acquisition."""
-        self._connection.send("acquire:state run") # Equivalent to on
-        # Wait until acquiring and there is a trigger
-        while True:
-            acquisition_state = self._connection.ask("acquire:state?")
-            if acquisition_state is not None and int(acquisition_state) != 0: # acquired a trigger
-                if self._triggered and self._connection.ask("trigger:state?") != "READY": # Triggered as well 
-                    break
-                elif not self._triggered:
-                    break
-                # Otherwise carry on
+        """ Wait until scope has an acquisition, raises AcquisitionTimeout if there isn't one in time."""
+        if self._wait_strategy == "poll":
+            self._connection.send("acquire:state run") # Equivalent to on
+            self._poll_acquisition()
+        elif self._wait_strategy == "opc":
+            timeout = self._connection.get_timeout() # The wait timeout applies to this reply only
+            self._connection.set_timeout(self._wait_timeout)
+            try:
+                reply = self._connection.ask("acquire:state run;*opc?") # Reply only when acquired
+            finally:
+                self._connection.set_timeout(timeout)
+            if reply is None:
+                self._abort_acquisition()
+        else:
+            self._connection.send("acquire:state run;*opc")
+            if not self._connection.wait_for_service_request(self._wait_timeout):
+                self._abort_acquisition()
+            self._connection.ask("*esr?") # Clears the event status
     def get_waveform(self, channel):
-        """ Acquire a waveform from channel=channel."""
-        if self._locked == False or self._channels[channel] == False:
-            raise Exception("Not locked or channel not active.")
-        self._connection.send("data:source ch%i" % channel) # Set the data source to the channel
-        data = self._connection.ask("curve?") # Ask for the data
+        """ Acquire a waveform from channel=channel, in volts."""
+        return self.get_raw_waveform(channel).volts()
+    def get_raw_waveform(self, channel):
+        """ Acquire a waveform from channel=channel, as raw samples with the scale factors to convert to volts."""
+        return self._decode_curve(channel, self.read_curves([channel]))[0]
+    def get_waveforms(self, channels):
+        """ Acquire waveforms from all the channels in a single exchange, in volts as a channels x samples array."""
+        return self.get_raw_waveforms(channels).volts()
+    def get_raw_waveforms(self, channels):
+        """ Acquire waveforms from all the channels in a single exchange, as raw samples (channels x samples)
+        with per channel scale factors."""
+        return self.decode_curves(channels, self.read_curves(channels))
+    def read_curves(self, channels):
+        """ Read the curve data for all the channels in a single exchange, returns the undecoded reply."""
+        data = self._connection.ask(self.curves_query(channels))
         if data is None:
             self._connection.ask("*opc?") # Wait until scope is ready
             raise Exception("Scope has errored.")
-        header_len = 2 + int(data[1])
-        waveform = numpy.fromstring(data[header_len:], self._get_data_type(channel))
-        # Now convert the waveform into voltage units
-        waveform = self._preamble[channel]['YZERO'] + (waveform - self._preamble[channel]['YOFF']) * self._preamble[channel]['YMULT']
-        return waveform
+        return data
+    def curves_query(self, channels):
+        """ Return the query for the curves of all the channels, raises an Exception if the scope is not locked
+        or a channel is not active."""
+        for channel in channels:
+            if self._locked == False or self._channels[channel] == False:
+                raise Exception("Not locked or channel not active.")
+        # The queries are concatenated, so the scope replies with each curve in turn separated by ;
+        return ";:".join(["data:source ch%i;:curve?" % channel for channel in channels])
+    def decode_curves(self, channels, data):
+        """ Decode a read_curves reply into raw samples (channels x samples) with per channel scale factors."""
+        samples = None
+        position = 0
+        for index, channel in enumerate(channels):
+            waveform, position = self._decode_curve(channel, data, position)
+            if samples is None:
+                samples = numpy.empty((len(channels), len(waveform)), waveform.samples.dtype.newbyteorder("="))
+            samples[index] = waveform.samples
+        scale_factors = {}
+        for key in ['YZERO', 'YOFF', 'YMULT']: # As columns to broadcast along each channel's samples
+            scale_factors[key] = numpy.array([[self._preamble[channel][key]] for channel in channels])
+        return waveforms.RawWaveform(samples, scale_factors['YZERO'], scale_factors['YOFF'], scale_factors['YMULT'])
     def get_timeform(self, channel):
-        """ Return the timebase for the waveform."""
-        # Now build the relevant timing array correcting for data portion acquired
-        timeform = self._preamble[channel]['XZERO'] + self._data_start * self._preamble[channel]['XINCR'] + \
-            (numpy.arange(self._preamble[channel]['NR_PT']) - self._preamble[channel]['PT_OFF']) * self._preamble[channel]['XINCR']
-        return timeform
+        """ Return the timebase for the waveform (see waveforms.Timebase)."""
+        return waveforms.Timebase.from_preamble(self._preamble[channel], self._data_start)
     def get_measurement(self, channel):
         """ Return the measurement value."""
-        self._connection.send_sync("measurement:immed:source1 ch%i" % channel)
+        self._connection.configure("measurement:immed:source1 ch%i" % channel)
         value = self._connection.ask("measurement:immed:value?")
         if value == "2.8740E-06":
             return None
         elif value is not None:
             return float(value)
 #### Internal ###################################################################################### 
+    def _poll_acquisition(self):
+        """ Poll until acquiring and there is a trigger, the interval between polls doubles up to the maximum."""
+        interval, max_interval = self._poll_intervals
+        start = time.time()
+        while True:
+            if self.is_acquired(self._connection.ask(self.poll_query())):
+                return
+            if self._wait_timeout is not None and time.time() - start > self._wait_timeout:
+                self._abort_acquisition()
+            time.sleep(interval)
+            interval = min(interval * 2, max_interval)
+    def _abort_acquisition(self):
+        """ Stop the pending acquisition and raise AcquisitionTimeout."""
+        self._connection.send("acquire:state stop")
+        self._connection.clear() # Drop the late reply to any pending query
+        raise AcquisitionTimeout.after(self._wait_timeout)
     def _find_active_channels(self):
         """ Finds out how many channels are active."""
-        self._connection.send("header on")
-        for select in self._connection.ask("select?").strip()[8:].split(';'):
-            channel_info = re.match("CH(\d) (\d)", select)
-            if channel_info is not None:
-                channel = int(channel_info.groups()[0])
-                state = channel_info.groups()[1]  == '1'
-                self._channels[channel] = state
-        self._connection.send("header off")
+        for channel, state in re.findall("CH(\d+) (\d)", self._ask_with_header("select?")):
+            self._channels[int(channel)] = state == '1'
     def _get_preamble(self, channel):
         """ Retrieve the preamble from the scope."""
-        self._connection.send_sync("data:source ch%i" % channel) # Set the data source to the channel
-        self._connection.send_sync("header on") # Turn headers on
+        self._connection.send("data:source ch%i" % channel) # Set the data source to the channel
         preamble = {}
-        for preamble_setting in self._connection.ask("wfmoutpre?").strip()[len("wfmoutpre:") + 1:].split(';'): # Ask for waveform information
+        # Remove the (optional) leading :WFMOUTPRE: as the first field is then like the others
+        reply = re.sub("(?i)^:?WFMOUTPRE:", "", self._ask_with_header("wfmoutpre?").strip())
+        for preamble_setting in reply.split(';'): # Ask for waveform information
             key, value = preamble_setting.split(' ',1)
             if key in Tektronix._preamble_fields.keys():
                 preamble[key] = Tektronix._preamble_fields[key](value) # Conver the value to the correct field type 
             else:
                 print "Preamble key", key, "is ignored."
         self._preamble[channel] = preamble
-        self._connection.send_sync("header off") # Turn the headers offf
+    def _auto_data_width(self):
+        """ Return the fewest bytes per point that keep the resolution. Sample and peak detect points are the
+        8 bit digitiser levels, average and high resolution points have more bits (the preamble BIT_NR is that of
+        the current data width, so cannot tell)."""
+        mode = self._connection.get_settings().get("acquire:mode")
+        if mode is None:
+            mode = self._connection.ask("acquire:mode?")
+        if mode is not None and mode.strip().lower()[:3] in ["ave", "hir"]:
+            return 2
+        return 1
+    def _window_points(self, window):
+        """ Return the first and last points (from 1) covering the (low, high) times window, found from the
+        full record preamble of the first active channel."""
+        record_length = int(self._connection.ask("horizontal:acqlength?"))
+        with self._connection.batch():
+            self._connection.configure("data:start 1")
+            self._connection.configure("data:stop %i" % record_length)
+        self._find_active_channels()
+        active = [channel for channel in sorted(self._channels.keys()) if self._channels[channel]]
+        if len(active) == 0:
+            raise Exception("No active channel to find the window from.")
+        self._get_preamble(active[0])
+        timebase = waveforms.Timebase.from_preamble(self._preamble[active[0]], 0) # Indices are then points
+        low, high = timebase.index(window[0]), timebase.index(window[1])
+        if timebase.time(low) > window[0]: # Nearest point is inside the window, take the one before
+            low -= 1
+        if timebase.time(high) < window[1]:
+            high += 1
+        if high < 1 or low > record_length:
+            raise Exception("Window %s is outside the record." % (window,))
+        return max(1, int(low)), min(record_length, int(high))
+    def _ask_with_header(self, query):
+        """ Ask the query with headers on, in a single exchange and whatever the header state. Headers are
+        off afterwards."""
+        return self._connection.ask("header on;:%s;:header off" % query)
+    def _decode_curve(self, channel, data, start=0):
+        """ Decode the curve block at or after start in data. Returns the waveform, whose samples share memory
+        with data, and the position after the block."""
+        block = data.find("#", start)
+        if block == -1:
+            raise Exception("No curve data in reply.")
+        header_len = 2 + int(str(data[block + 1:block + 2]))
+        length = int(str(data[block + 2:block + header_len]))
+        data_type = numpy.dtype(self._get_data_type(channel))
+        samples = numpy.frombuffer(data, data_type, length // data_type.itemsize, block + header_len)
+        return waveforms.RawWaveform.from_preamble(samples, self._preamble[channel]), block + header_len + length
     def _get_data_type(self, channel):
         """ Return the data type for the given channel."""
         data_type = ""
@@ -268,9 +465,9 @@ class Tektronix2000(Tektronix):
                                          'HDELAY' : float,
                                          'COMPOSITION': str,
                                          'FILTERFREQ' : int } )
-    def __init__(self, connection):
+    def __init__(self, connection, reset=True):
         """ Intialise the scope with a connection."""
-        super(Tektronix2000, self).__init__(connection)
+        super(Tektronix2000, self).__init__(connection, reset)
 
 class Tektronix3000(Tektronix):
     """ Specific commands for the DPO/MSO 2000 series scopes."""
@@ -280,6 +477,6 @@ class Tektronix3000(Tektronix):
                                          'REFLEVEL'        : float,
                                          'SPAN'            : float,
                                          'WFMTYPE'         : str } )
-    def __init__(self, connection):
+    def __init__(self, connection, reset=True):
         """ Intialise the scope with a connection."""
-        super(Tektronix3000, self).__init__(connection)
+        super(Tektronix3000, self).__init__(connection, reset)
@@ -12,12 +12,13 @@ import optparse
 import scopes
 import scope_connections
 import utils
+import pipeline
 import datetime
 import time
-from pyvisa.vpp43 import visa_exceptions
 
-def single_acquisition_example(name, n_events, trigger, trigger_channel):
-    """ Acquire a set of triggerred single acquisitions for two channels."""
+def single_acquisition_example(name, n_events, trigger, trigger_channel, window, raw=False):
+    """ Acquire a set of triggerred single acquisitions for two channels, reading the (low, high) seconds
+    window around the trigger."""
     tek_scope = scopes.Tektronix2000(scope_connections.VisaUSB())
     # First setup the scope, lock the front panel
     tek_scope.lock()
@@ -25,7 +26,7 @@ def single_acquisition_example(name, n_events, trigger, trigger_channel):
     tek_scope.set_active_channel(2)
     tek_scope.set_single_acquisition() # Single signal acquisition mode
     tek_scope.set_edge_trigger(trigger, trigger_channel, True) # Falling edge trigger
-    tek_scope.set_data_mode(49500, 50500)
+    tek_scope.set_data_mode(window=window, width="auto")
     tek_scope.begin()
     # Now create a HDF5 file and save the meta information
     file_name = name + "_" + str(datetime.date.today())
@@ -37,22 +38,13 @@ def single_acquisition_example(name, n_events, trigger, trigger_channel):
     results.add_meta_dict(tek_scope.get_preamble(1), "ch1")
     results.add_meta_dict(tek_scope.get_preamble(2), "ch2")
 
-    last_save_time = datetime.datetime.now()
-    print "Starting data taking at time", last_save_time.strftime("%Y-%m-%d %H:%M:%S")
-    for event in range(0, n_events):
-        tek_scope.acquire()
-        try:
-            results.add_data(tek_scope.get_waveform(1), 1)
-            results.add_data(tek_scope.get_waveform(2), 2)
-        except visa_exceptions.VisaIOError, e:
-            print "Serious death", e
-            time.sleep(10)
-        except Exception, e:
-            print "Scope died, acquisition lost.", e
-            time.sleep(10)
-        if datetime.datetime.now() - last_save_time > datetime.timedelta(seconds=60):
-            results.autosave()
-            last_save_time = datetime.datetime.now()
+    if raw: # Raw samples, convert to volts using the chN YZERO, YOFF and YMULT meta data
+        acquisition = pipeline.AcquisitionPipeline(tek_scope, [1, 2], results, pipeline.raw_samples)
+    else:
+        acquisition = pipeline.AcquisitionPipeline(tek_scope, [1, 2], results)
+    print "Starting data taking at time", datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    acquisition.run(n_events)
+    print "Acquisition statistics", acquisition.get_stats()
     results.save()
     print "Finished at", time.strftime("%Y-%m-%d %H:%M:%S")
 
@@ -60,9 +52,13 @@ if __name__ == "__main__":
     parser = optparse.OptionParser(usage = "usage: %prog name n_events", version="%prog 1.0")
     parser.add_option("-c", type="int", dest="channel", help="Trigger channel", default=2)
     parser.add_option("-t", type="float", dest="trigger", help="Trigger level", default=-0.004)
+    parser.add_option("-a", type="float", dest="window_low", help="Window start (s from trigger)", default=-100e-9)
+    parser.add_option("-b", type="float", dest="window_high", help="Window end (s from trigger)", default=100e-9)
+    parser.add_option("-r", action="store_true", dest="raw", help="Save raw samples not volts", default=False)
     (options, args) = parser.parse_args()
     if len(args) != 2:
         print "Incorrect number of arguments"
         parser.print_help()
         exit(0)
-    single_acquisition_example(args[0], int(args[1]), options.trigger, options.channel)
+    single_acquisition_example(args[0], int(args[1]), options.trigger, options.channel,
+                               (options.window_low, options.window_high), options.raw)
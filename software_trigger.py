@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#
+# software_trigger.py
+#
+# Host side trigger, to split a long waveform (e.g. the whole record from get_waveform) into many fixed length
+# events. Triggers are where the waveform (or its slope) crosses a threshold in the pulse direction, at least a
+# hold off apart. Times are in seconds as for measurements, using the waveforms.Timebase of the waveform.
+#
+####################################################################################################
+import numpy
+import waveforms
+
+def find_triggers(waveform, timebase, threshold, negative=True, derivative=False, hold_off=0.0, baseline=0.0):
+    """ Return the indices of the samples where the waveform (volts) crosses the threshold (volts from the
+    baseline, positive for either polarity). If derivative is True the threshold is on the slope (volts per
+    second) instead. Triggers within hold_off seconds of the previous trigger are ignored."""
+    signal = numpy.asarray(waveform, numpy.float64)
+    if derivative:
+        signal = numpy.diff(signal) / timebase.x_incr
+        baseline = 0.0
+    if negative:
+        above = signal < baseline - threshold
+    else:
+        above = signal > baseline + threshold
+    indices = numpy.flatnonzero(above[1:] & ~above[:-1]) + 1 # Rising edges of above
+    if derivative:
+        indices += 1 # Slope sample i is between samples i and i + 1
+    hold_off_samples = int(numpy.ceil(hold_off / timebase.x_incr))
+    if hold_off_samples <= 0 or len(indices) < 2:
+        return indices
+    if numpy.all(numpy.diff(indices) >= hold_off_samples): # Nothing to hold off
+        return indices
+    kept = [indices[0]] # Each hold off depends on the last kept trigger, so keep them in turn
+    for index in indices[1:]:
+        if index - kept[-1] >= hold_off_samples:
+            kept.append(index)
+    return numpy.array(kept, indices.dtype)
+
+def extract_events(data, timebase, indices, window):
+    """ Return the fixed length events around each trigger index as an (events x samples) array, or (events x
+    channels x samples) if data is (channels x samples), and the trigger indices kept. The window is the
+    (low, high) seconds about the trigger, triggers too near the ends of the waveform for a whole window are
+    dropped."""
+    data = numpy.asarray(data)
+    start, length = _window_samples(timebase, window)
+    n_samples = data.shape[-1]
+    indices = numpy.asarray(indices, int)
+    indices = indices[(indices + start >= 0) & (indices + start + length <= n_samples)]
+    samples = (indices + start)[:, numpy.newaxis] + numpy.arange(length)
+    if data.ndim == 1:
+        return data[samples], indices
+    return data[:, samples].transpose(1, 0, 2), indices
+
+def event_timebase(timebase, window):
+    """ Return the timebase of the extracted events, times are relative to their trigger."""
+    start, length = _window_samples(timebase, window)
+    return waveforms.Timebase(start * timebase.x_incr, timebase.x_incr, 0, 0, length)
+
+def split_events(waveform, timebase, threshold, window, negative=True, derivative=False, hold_off=None,
+                 baseline=0.0, channels=None):
+    """ Find the triggers in the waveform and return the events (as extract_events, from channels instead
+    if given, e.g. the waveforms of all the channels read with this one), their trigger times (from the
+    timebase) and the timebase of the events. The default hold off is the window length, so events don't
+    overlap."""
+    if hold_off is None:
+        hold_off = window[1] - window[0]
+    indices = find_triggers(waveform, timebase, threshold, negative, derivative, hold_off, baseline)
+    events, indices = extract_events(waveform if channels is None else channels, timebase, indices, window)
+    return events, timebase.time(indices), event_timebase(timebase, window)
+#### Internal ######################################################################################
+def _window_samples(timebase, window):
+    """ Return the first sample (relative to the trigger) and number of samples of the window."""
+    start = int(numpy.floor(window[0] / timebase.x_incr + 0.5))
+    stop = int(numpy.floor(window[1] / timebase.x_incr + 0.5))
+    return start, stop - start + 1
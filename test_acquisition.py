@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+#
+# test_acquisition.py
+#
+# Checks of the acquisition path against the simulated scope, in process and over TCP/IP, and of saving to and
+# reading back from each file format. Run with python -m unittest test_acquisition, checks of formats whose
+# libraries are not installed are skipped.
+#
+####################################################################################################
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy
+import backends
+import multi_scope
+import pipeline
+import reprocess
+import scopes
+import scope_connections
+import scope_simulator
+import utils
+
+def simulated_scope(connection, channels=(1, 2), record_length=1000, width=1):
+    """ Return a locked and begun Tektronix on the connection to a simulated scope, reading the channels."""
+    tek_scope = scopes.Tektronix(connection)
+    tek_scope.lock()
+    for channel in channels:
+        tek_scope.set_active_channel(channel)
+    tek_scope.set_single_acquisition()
+    tek_scope.set_edge_trigger(-0.004, channels[0], True)
+    tek_scope.set_data_mode(1, record_length, width)
+    tek_scope.begin()
+    return tek_scope
+
+class TestAcquisition(unittest.TestCase):
+    """ Acquire and read waveforms from a simulated scope in process."""
+    def setUp(self):
+        self.scope = scope_simulator.SimulatedScope(record_length=1000, trigger_rate=1e4, seed=1)
+        self.tek_scope = simulated_scope(scope_simulator.SimulatedConnection(self.scope))
+    def test_get_waveforms(self):
+        """ The waveforms of several channels in one exchange match those read one at a time."""
+        self.tek_scope.acquire()
+        waveforms = self.tek_scope.get_waveforms([1, 2])
+        self.assertEqual(waveforms.shape, (2, 1000))
+        self.assertTrue(numpy.array_equal(waveforms[0], self.tek_scope.get_waveform(1)))
+        self.assertTrue(numpy.array_equal(waveforms[1], self.tek_scope.get_waveform(2)))
+    def test_volts(self):
+        """ Waveforms in volts agree with the simulated waveform to within a digitiser level."""
+        self.tek_scope.acquire()
+        expected = self.scope._waveform(1, self.scope._event)
+        self.assertTrue(numpy.allclose(self.tek_scope.get_waveform(1), expected, atol=self.scope._y_mult(1)))
+    def test_width(self):
+        """ Two byte points decode as well as one byte points."""
+        self.tek_scope.set_data_mode(1, 1000, 2)
+        self.tek_scope.begin()
+        self.tek_scope.acquire()
+        raw = self.tek_scope.get_raw_waveforms([1])
+        self.assertEqual(raw.samples.dtype.itemsize, 2)
+        expected = self.scope._waveform(1, self.scope._event)
+        self.assertTrue(numpy.allclose(raw.volts()[0], expected, atol=self.scope._y_mult(1)))
+    def test_window(self):
+        """ A window returns the fewest points covering it, two byte points in average mode and one otherwise."""
+        full = self.tek_scope.get_timeform(1)
+        window = (full[200] + 0.3 * full.x_incr, full[600] - 0.3 * full.x_incr)
+        for averages, width in [(None, 1), (4, 2)]:
+            if averages is not None:
+                self.tek_scope.set_average_acquisition(averages)
+            self.tek_scope.set_data_mode(window=window, width="auto")
+            self.tek_scope.begin()
+            self.tek_scope.acquire()
+            raw = self.tek_scope.get_raw_waveforms([1])
+            timebase = self.tek_scope.get_timeform(1)
+            self.assertEqual(raw.samples.shape, (1, 401))
+            self.assertEqual(raw.samples.dtype.itemsize, width)
+            self.assertEqual(len(timebase), 401)
+            self.assertTrue(timebase[0] <= window[0] < timebase[1])
+            self.assertTrue(timebase[-2] < window[1] <= timebase[-1])
+            self.assertAlmostEqual(timebase[0], full[200], delta=1e-3 * full.x_incr)
+    def test_wait_strategies(self):
+        """ Acquire with each wait strategy the connection supports."""
+        for strategy in ["poll", "opc"]:
+            self.tek_scope.set_wait_strategy(strategy, timeout=5.0)
+            self.tek_scope.acquire()
+            self.assertEqual(self.tek_scope.get_waveforms([1, 2]).shape, (2, 1000))
+    def test_timeout(self):
+        """ Without a trigger acquire times out."""
+        self.scope.trigger_rate = 1e-6
+        self.tek_scope.set_wait_strategy("poll", timeout=0.05)
+        self.assertRaises(scopes.AcquisitionTimeout, self.tek_scope.acquire)
+    def test_setting_aliases(self):
+        """ ch<N>:volts and ch<N>:scale are one setting, so setting either after the other is sent."""
+        self.tek_scope.set_channel_y(1, 0.2)
+        self.tek_scope.set_display_y(1, 0.5)
+        self.tek_scope.set_channel_y(1, 0.2)
+        self.assertEqual(self.scope._scale[1], 0.2)
+        self.assertEqual(len([header for header in self.tek_scope._connection.get_settings() \
+                                  if header.startswith("ch1:") and header[4:] in ["scale", "volts"]]), 1)
+    def test_service_requests(self):
+        """ The srq wait strategy is refused by connections without service requests."""
+        self.assertRaises(Exception, self.tek_scope.set_wait_strategy, "srq")
+        self.tek_scope.acquire()
+
+class TestAcquisitionTCPIP(unittest.TestCase):
+    """ Acquire and read waveforms from a simulated scope over TCP/IP."""
+    def setUp(self):
+        self.server = scope_simulator.SimulatedServer(scope_simulator.SimulatedScope(record_length=1000,
+                                                                                     trigger_rate=1e4, seed=1))
+        self.server.start()
+        self.connection = scope_connections.TCPIP(*self.server.address)
+        self.tek_scope = simulated_scope(self.connection)
+    def tearDown(self):
+        del self.tek_scope # Unlocks the scope, then the connection closes
+        del self.connection
+        self.server.stop()
+    def test_get_waveforms(self):
+        """ The waveforms of several channels in one exchange match those read one at a time."""
+        for strategy in ["poll", "opc"]:
+            self.tek_scope.set_wait_strategy(strategy, timeout=5.0)
+            self.tek_scope.acquire()
+            waveforms = self.tek_scope.get_waveforms([1, 2])
+            self.assertEqual(waveforms.shape, (2, 1000))
+            self.assertTrue(numpy.array_equal(waveforms[0], self.tek_scope.get_waveform(1)))
+            self.assertTrue(numpy.array_equal(waveforms[1], self.tek_scope.get_waveform(2)))
+    def test_opc_timeout(self):
+        """ The opc wait timeout applies to the acquisition only, without one acquire waits beyond the reply
+        timeout."""
+        self.connection.set_timeout(0.2)
+        self.tek_scope.set_wait_strategy("opc", timeout=None)
+        self.server.scope.latency = 0.3
+        try:
+            self.tek_scope.acquire()
+        finally:
+            self.server.scope.latency = 0.0
+        self.assertEqual(self.connection.get_timeout(), 0.2)
+        self.tek_scope.set_wait_strategy("opc", timeout=5.0)
+        self.tek_scope.acquire()
+        self.assertEqual(self.connection.get_timeout(), 0.2)
+    def test_late_reply(self):
+        """ The late reply to a query that timed out is not returned for the next query."""
+        self.connection.set_timeout(0.2)
+        self.server.scope.latency = 0.3
+        try:
+            self.assertEqual(self.connection.ask("*idn?"), None)
+        finally:
+            self.server.scope.latency = 0.0
+        self.assertEqual(self.connection.ask("acquire:mode?"), "SAMPLE")
+        self.assertEqual(self.connection.ask("*opc?"), "1")
+    def test_async(self):
+        """ The asynchronous scope reads the same waveforms over the socket it takes over."""
+        try:
+            import async_scopes
+        except ImportError:
+            self.skipTest("trollius is not installed")
+        loop = async_scopes.asyncio.new_event_loop()
+        @async_scopes.asyncio.coroutine
+        def acquire():
+            connection = yield async_scopes.From(async_scopes.AsyncTCPIP.from_connection(self.connection, loop))
+            try:
+                async_scope = async_scopes.AsyncTektronix(self.tek_scope, connection)
+                yield async_scopes.From(async_scope.acquire())
+                waveforms = yield async_scopes.From(async_scope.get_waveforms([1, 2]))
+            finally:
+                connection.close() # Closes the duplicate of the socket, the TCPIP can be used again
+            raise async_scopes.Return(waveforms)
+        try:
+            for strategy in ["poll", "opc"]:
+                self.tek_scope.set_wait_strategy(strategy, timeout=5.0)
+                waveforms = loop.run_until_complete(acquire())
+                self.assertEqual(waveforms.shape, (2, 1000))
+                expected = self.server.scope._waveform(1, self.server.scope._event)
+                self.assertTrue(numpy.allclose(waveforms[0], expected, atol=self.server.scope._y_mult(1)))
+        finally:
+            loop.close()
+
+class TestReplyParser(unittest.TestCase):
+    """ Split replies however the data arrives."""
+    def test_parse(self):
+        """ Text replies and replies with blocks (containing line feeds) are split fed a byte at a time."""
+        block = b"#19" + b"\n;#12\n\n#3"
+        data = b"1;READY\n" + block + b";" + block + b"\n#0abc\n"
+        parser = scope_connections.ReplyParser()
+        replies = []
+        for byte in range(len(data)):
+            parser.feed(data[byte:byte + 1])
+            reply = parser.parse()
+            while reply is not None:
+                replies.append(reply)
+                reply = parser.parse()
+        self.assertEqual(replies, ["1;READY", bytearray(block + b";" + block), "#0abc"])
+    def test_block_view(self):
+        """ The rest of a block can be put straight into the reply."""
+        parser = scope_connections.ReplyParser()
+        parser.feed(b"#15ab")
+        self.assertEqual(parser.parse(), None)
+        self.assertEqual(parser.block_remaining(), 3)
+        view = parser.block_view()
+        view[:2] = b"cd"
+        del view
+        parser.block_received(2)
+        parser.feed(b"e\n")
+        self.assertEqual(parser.parse(), bytearray(b"#15abcde"))
+
+class TestPipeline(unittest.TestCase):
+    """ Threaded acquisition from a simulated scope."""
+    def setUp(self):
+        self.tek_scope = simulated_scope(scope_simulator.SimulatedConnection(
+                scope_simulator.SimulatedScope(record_length=1000, trigger_rate=1e4, seed=1)))
+    def test_run(self):
+        """ All the events are written, in order."""
+        results = utils.File("pipeline", 2, "")
+        acquisition = pipeline.AcquisitionPipeline(self.tek_scope, [1, 2], results, pipeline.raw_samples,
+                                                   decoders=2)
+        acquisition.run(20)
+        stats = acquisition.get_stats()
+        self.assertEqual((stats["acquired"], stats["written"], stats["errors"]), (20, 20, 0))
+        for channel in [1, 2]:
+            self.assertEqual(len(results.get_data(channel)), 20)
+            self.assertEqual(results.get_data(channel)[0].shape, (1000,))
+    def test_write_errors(self):
+        """ Errors adding to the results are counted and the acquisition finishes."""
+        results = _FailingFile(2)
+        acquisition = pipeline.AcquisitionPipeline(self.tek_scope, [1, 2], results, queue_size=2,
+                                                   autosave_interval=0.0)
+        acquisition.start(20)
+        self.assertFinishes(acquisition)
+        stats = acquisition.get_stats()
+        self.assertEqual((stats["acquired"], stats["written"], stats["errors"]), (20, 10, 10))
+        self.assertEqual(len(results.get_data(2)), 10)
+    def test_multi_scope(self):
+        """ Events from two scopes are aligned into one file, errors adding to the results are counted and the
+        acquisition finishes."""
+        tek_scopes = { "a" : self.tek_scope,
+                       "b" : simulated_scope(scope_simulator.SimulatedConnection(
+                    scope_simulator.SimulatedScope(record_length=1000, trigger_rate=1e4, seed=2))) }
+        for results in [utils.File("multi_scope", 4, ""), _FailingFile(4)]:
+            acquisition = multi_scope.MultiScopeAcquisition(tek_scopes, { "a" : [1, 2], "b" : [1, 2] }, results,
+                                                            queue_size=2, autosave_interval=0.0)
+            acquisition.start(20)
+            self.assertFinishes(acquisition)
+            stats = acquisition.get_stats()
+            self.assertEqual(stats["acquired"], { "a" : 20, "b" : 20 })
+            self.assertTrue(stats["written"] > 0)
+            self.assertEqual(len(results.get_data(4)), stats["written"])
+            self.assertEqual(2 * (stats["written"] + stats["errors"]) + stats["unmatched"], 40)
+    def assertFinishes(self, acquisition, timeout=30.0):
+        """ Assert the acquisition finishes within timeout seconds."""
+        joiner = threading.Thread(target=acquisition.join)
+        joiner.daemon = True
+        joiner.start()
+        joiner.join(timeout)
+        self.assertFalse(joiner.is_alive(), "Acquisition did not finish.")
+
+class _FailingFile(utils.File):
+    """ A File that fails to add every other event and to autosave."""
+    def __init__(self, channels):
+        super(_FailingFile, self).__init__("failing", channels, "")
+        self._events = 0
+    def add_data(self, data, channel):
+        if channel == 1:
+            self._events += 1
+            if self._events % 2 == 0:
+                raise IOError("No space left on device")
+        super(_FailingFile, self).add_data(data, channel)
+    def autosave(self):
+        raise IOError("No space left on device")
+
+class TestFiles(unittest.TestCase):
+    """ Save events to each file format and read them back."""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        random = numpy.random.RandomState(1)
+        self.events = [dict([(channel, random.randint(-128, 128, 100).astype(numpy.int8)) for channel in [1, 2]]) \
+                           for event in range(5)]
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    def write(self, name, channels=2, **kwargs):
+        """ Save the events to a file of the format name, returns its path (without the extension)."""
+        file_path = os.path.join(self.directory, name)
+        results = backends.get_file_format(name)(file_path, channels, **kwargs)
+        results.add_meta_data("trigger", -0.004)
+        for event in self.events:
+            for channel in [1, 2]:
+                results.add_data(event[channel], channel)
+        results.save()
+        return file_path
+    def check_loaded(self, name, extension):
+        """ Save the events and load them back into a File."""
+        if not backends.is_available(name):
+            self.skipTest("%s is not installed" % name)
+        file_path = self.write(name)
+        loaded = backends.get_file_format(name)(file_path, 2)
+        loaded.load()
+        self.assertEqual(loaded.get_meta_data("trigger"), -0.004)
+        for channel in [1, 2]:
+            data = loaded.get_data(channel)
+            self.assertEqual(len(data), len(self.events))
+            for waveform, event in zip(data, self.events):
+                self.assertTrue(numpy.array_equal(waveform, event[channel]))
+        return file_path + extension
+    def check_read(self, reader):
+        """ The reader returns the events, whole and in batches."""
+        self.assertEqual(reader.get_channels(), [1, 2])
+        self.assertEqual(reader.get_meta_data()["trigger"], -0.004)
+        for channel in [1, 2]:
+            self.assertEqual(reader.get_n_events(channel), len(self.events))
+            expected = numpy.array([event[channel] for event in self.events])
+            self.assertTrue(numpy.array_equal(reader.get_data(channel), expected))
+            self.assertTrue(numpy.array_equal(reader.get_data(channel, 1, 3), expected[1:3]))
+        batches = list(reader.iterate(2))
+        self.assertEqual([batch_start for batch_start, batch in batches], [0, 2, 4])
+        self.assertTrue(numpy.array_equal(batches[1][1][2], numpy.array([event[2] for event in self.events[2:4]])))
+    def test_pickle(self):
+        self.check_loaded("pickle", ".pkl")
+    def test_record(self):
+        file_path = self.check_loaded("record", ".rec")
+        with utils.RecordReader(file_path) as reader:
+            self.check_read(reader)
+    def test_record_events(self):
+        """ Data for an undeclared channel, or for a channel twice in one event, is refused and an incomplete
+        event fails the save."""
+        results = utils.RecordFile(os.path.join(self.directory, "events"), 2)
+        self.assertEqual(results.get_data(1), [])
+        self.assertRaises(Exception, results.add_data, self.events[0][1], 3)
+        results.add_data(self.events[0][1], 1)
+        self.assertRaises(Exception, results.add_data, self.events[0][1], 1)
+        results.add_data(self.events[0][2], 2)
+        results.add_data(self.events[1][1], 1)
+        self.assertRaises(Exception, results.save)
+        with utils.RecordReader(os.path.join(self.directory, "events.rec")) as reader:
+            self.assertEqual(reader.get_n_events(), 1)
+    def test_record_meta_data(self):
+        """ Meta data changed after the first event is saved on autosave, without rewriting the header."""
+        file_path = os.path.join(self.directory, "meta")
+        results = utils.RecordFile(file_path, 2)
+        results.add_meta_data("trigger", -0.004)
+        for channel in [1, 2]:
+            results.add_data(self.events[0][channel], channel)
+        with open(file_path + ".rec", "rb") as file_:
+            header = file_.read(64)
+        results.add_meta_data("events", 1)
+        results.autosave()
+        with utils.RecordReader(file_path + ".rec") as reader:
+            self.assertEqual(reader.get_meta_data(), { "trigger" : -0.004, "events" : 1 })
+            self.assertEqual(reader.get_n_events(), 1)
+        with open(file_path + ".rec", "rb") as file_:
+            self.assertEqual(file_.read(64), header)
+        results.save()
+    def test_hdf5(self):
+        file_path = self.check_loaded("hdf5", ".hdf5")
+        with utils.HDF5Reader(file_path) as reader:
+            self.check_read(reader)
+    def test_hdf5stream(self):
+        file_path = self.check_loaded("hdf5stream", ".hdf5")
+        with utils.HDF5Reader(file_path) as reader:
+            self.check_read(reader)
+    def test_zero_suppressed(self):
+        """ Zero suppressed events of different sparse lengths are rebuilt when read back."""
+        if not backends.is_available("hdf5"):
+            self.skipTest("hdf5 is not installed")
+        file_path = os.path.join(self.directory, "sparse")
+        results = utils.ZeroSuppressedFile(utils.HDF5File(file_path, 2), 50)
+        waveforms = []
+        for event in range(4):
+            waveform = numpy.zeros(100, numpy.int8)
+            waveform[10:10 + 5 * event] = 100 # A pulse of a different length in each event
+            waveforms.append(waveform)
+            for channel in [1, 2]:
+                results.add_data(waveform, channel)
+        results.save()
+        with utils.ZeroSuppressedReader(utils.HDF5Reader(file_path + ".hdf5")) as reader:
+            self.assertEqual(len(set([len(sparse) for sparse in reader.get_sparse_data(1)])), 4)
+            self.assertTrue(numpy.array_equal(reader.get_data(1), numpy.array(waveforms)))
+            for batch_start, batch in reader.iterate(3):
+                self.assertTrue(numpy.array_equal(batch[2], numpy.array(waveforms[batch_start:batch_start + 3])))
+    def test_convert(self):
+        """ Runs are converted in order, to a file of only the channels asked for."""
+        file_paths = []
+        for run in range(2):
+            file_path = os.path.join(self.directory, "run%i" % run)
+            results = utils.RecordFile(file_path, 2)
+            for event in self.events[run:]:
+                for channel in [1, 2]:
+                    results.add_data(event[channel], channel)
+            results.save()
+            file_paths.append(file_path + ".rec")
+        expected = numpy.array([event[2] for event in self.events + self.events[1:]])
+        for output, channels in [("all.rec", [1, 2]), ("ch2.rec", [2]), ("ch2.hdf5", [2])]:
+            if output.endswith(".hdf5") and not backends.is_available("hdf5"):
+                continue
+            options = { "channels" : channels, "batch_size" : 2, "scale" : False }
+            reprocess.reprocess("convert", file_paths, os.path.join(self.directory, output), options, 2, 2)
+            with reprocess.open_reader(os.path.join(self.directory, output)) as reader:
+                self.assertEqual(reader.get_channels(), channels)
+                self.assertTrue(numpy.array_equal(reader.get_data(2), expected))
+    def test_convert_zero_suppressed(self):
+        """ Zero suppressed runs convert to dense files that reopen as such, scaled files can't be scaled again."""
+        if not backends.is_available("hdf5"):
+            self.skipTest("hdf5 is not installed")
+        file_path = os.path.join(self.directory, "sparse")
+        results = utils.ZeroSuppressedFile(utils.HDF5File(file_path, 2), 50)
+        for channel in [1, 2]:
+            results.add_meta_dict({ "YZERO" : 0.0, "YOFF" : 0.0, "YMULT" : 0.01 }, "ch%i" % channel)
+        waveforms = []
+        for event in range(4):
+            waveform = numpy.zeros(100, numpy.int8)
+            waveform[10:10 + 5 * event] = 100
+            waveforms.append(waveform)
+            for channel in [1, 2]:
+                results.add_data(waveform, channel)
+        results.save()
+        dense_path, volts_path = os.path.join(self.directory, "dense.rec"), os.path.join(self.directory, "volts.rec")
+        options = { "channels" : [1, 2], "batch_size" : 3, "scale" : False }
+        reprocess.reprocess("convert", [file_path + ".hdf5"], dense_path, options, 2, 2)
+        with reprocess.open_reader(dense_path) as reader:
+            self.assertFalse(isinstance(reader, utils.ZeroSuppressedReader))
+            self.assertFalse("zero_suppression_threshold" in reader.get_meta_data())
+            self.assertEqual(reader.get_meta_data()["ch1YMULT"], 0.01)
+            self.assertTrue(numpy.array_equal(reader.get_data(1), numpy.array(waveforms)))
+        reprocess.reprocess("convert", [dense_path], volts_path, dict(options, scale=True), 2, 2)
+        with reprocess.open_reader(volts_path) as reader:
+            self.assertFalse("ch1YMULT" in reader.get_meta_data())
+            self.assertTrue(numpy.allclose(reader.get_data(2), 0.01 * numpy.array(waveforms)))
+        self.assertRaises(Exception, reprocess.reprocess, "convert", [volts_path],
+                          os.path.join(self.directory, "twice.rec"), dict(options, scale=True), 2, 2)
+    def test_root(self):
+        self.check_loaded("root", ".root")
+        results = utils.RootFile(os.path.join(self.directory, "batches"), 2, batch_size=2)
+        for event in self.events:
+            for channel in [1, 2]:
+                results.add_data(event[channel], channel)
+        self.assertEqual(len(results.get_data(1)), len(self.events)) # Filled and still to be filled
+        self.assertTrue(numpy.array_equal(results.get_data(1)[0], self.events[0][1]))
+        results.save()
+
+if __name__ == "__main__":
+    unittest.main()
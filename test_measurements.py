@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+#
+# test_measurements.py
+#
+# Checks of the host side pulse measurements against waveforms of known pulses. Run with
+# python -m unittest test_measurements.
+#
+####################################################################################################
+import unittest
+import numpy
+import measurements
+import waveforms
+
+class TestMeasurements(unittest.TestCase):
+    """ Measure triangular pulses of known shape on a constant baseline."""
+    def setUp(self):
+        # 1ns samples from -100ns, a negative pulse of 0.5V starting at 20ns that rises (in magnitude) for 10ns
+        # and falls for 20ns, on a baseline of 0.01V
+        self.timebase = waveforms.Timebase(-100e-9, 1e-9, 0, 0, 200)
+        self.waveforms = numpy.empty((2, 200))
+        self.waveforms.fill(0.01)
+        ramp = numpy.concatenate((numpy.linspace(0.0, 0.5, 11), numpy.linspace(0.5, 0.0, 21)[1:]))
+        self.waveforms[0, 120:151] -= ramp
+        self.waveforms[1, 130:161] -= 0.5 * ramp # Half the size and 10ns later
+        self.gate = (0.0, 80e-9)
+    def test_area(self):
+        """ The area is of the raw samples without a baseline gate, relative to the baseline with one."""
+        area = measurements.area(self.waveforms, self.timebase, self.gate)
+        self.assertClose(area, [0.81e-9 - 7.5e-9, 0.81e-9 - 3.75e-9])
+        area = measurements.area(self.waveforms, self.timebase, self.gate, (-100e-9, -50e-9))
+        self.assertClose(area, [-7.5e-9, -3.75e-9])
+    def test_peak(self):
+        amplitude, time = measurements.peak(self.waveforms, self.timebase, self.gate)
+        self.assertClose(amplitude, [0.5, 0.25])
+        self.assertClose(time, [30e-9, 40e-9])
+        amplitude, time = measurements.peak(-self.waveforms, self.timebase, self.gate, negative=False)
+        self.assertClose(amplitude, [0.5, 0.25])
+    def test_rise_fall(self):
+        """ 10% to 90% of a linear ramp is 80% of its length."""
+        self.assertClose(measurements.rise_time(self.waveforms, self.timebase, self.gate), 8e-9)
+        self.assertClose(measurements.fall_time(self.waveforms, self.timebase, self.gate), 16e-9)
+    def test_time_over_threshold(self):
+        """ The first pulse is beyond 0.25V for half its rise and fall, the second only at its peak."""
+        time = measurements.time_over_threshold(self.waveforms, self.timebase, 0.2499, self.gate)
+        self.assertClose(time, [16e-9, 1e-9])
+    def test_measure(self):
+        """ measure agrees with the separate measurements, with and without a baseline gate."""
+        for baseline_gate in [None, (-100e-9, -50e-9)]:
+            results = measurements.measure(self.waveforms, self.timebase, self.gate, baseline_gate, threshold=0.2499)
+            expected = { "area" : measurements.area(self.waveforms, self.timebase, self.gate, baseline_gate),
+                         "amplitude" : measurements.peak(self.waveforms, self.timebase, self.gate, baseline_gate)[0],
+                         "peak_time" : measurements.peak(self.waveforms, self.timebase, self.gate, baseline_gate)[1],
+                         "rise_time" : measurements.rise_time(self.waveforms, self.timebase, self.gate,
+                                                              baseline_gate),
+                         "fall_time" : measurements.fall_time(self.waveforms, self.timebase, self.gate,
+                                                              baseline_gate),
+                         "time_over_threshold" : measurements.time_over_threshold(self.waveforms, self.timebase,
+                                                                                  0.2499, self.gate, baseline_gate) }
+            for key, value in expected.items():
+                self.assertClose(results[key], value, key)
+    def assertClose(self, values, expected, message=None):
+        """ Assert the values are the expected to a relative precision, as times and areas are tiny."""
+        self.assertTrue(numpy.allclose(values, expected, rtol=1e-6, atol=0.0), message)
+
+if __name__ == "__main__":
+    unittest.main()
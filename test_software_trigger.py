@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+# test_software_trigger.py
+#
+# Checks of the host side trigger against waveforms with pulses at known samples. Run with
+# python -m unittest test_software_trigger.
+#
+####################################################################################################
+import unittest
+import numpy
+import software_trigger
+import waveforms
+
+class TestSoftwareTrigger(unittest.TestCase):
+    """ Trigger on square negative pulses of 0.5V, 5 samples long, in a 1000 sample waveform."""
+    def setUp(self):
+        # 1ns samples from -100ns, pulses near the start (10), 30 samples apart (200 and 230), alone (500) and
+        # near the end (995)
+        self.timebase = waveforms.Timebase(-100e-9, 1e-9, 0, 0, 1000)
+        self.waveform = numpy.zeros(1000)
+        self.pulses = [10, 200, 230, 500, 995]
+        for index in self.pulses:
+            self.waveform[index:index + 5] = -0.5
+    def test_polarity(self):
+        """ The threshold is positive for either polarity, so a negative trigger finds nothing in the inverted
+        waveform and a positive one finds the same pulses."""
+        indices = software_trigger.find_triggers(self.waveform, self.timebase, 0.1)
+        self.assertEqual(list(indices), self.pulses)
+        indices = software_trigger.find_triggers(-self.waveform, self.timebase, 0.1)
+        self.assertEqual(list(indices), [])
+        indices = software_trigger.find_triggers(-self.waveform, self.timebase, 0.1, negative=False)
+        self.assertEqual(list(indices), self.pulses)
+        indices = software_trigger.find_triggers(self.waveform, self.timebase, 0.1, negative=False)
+        self.assertEqual(list(indices), [])
+    def test_baseline(self):
+        indices = software_trigger.find_triggers(self.waveform + 1.0, self.timebase, 0.1, baseline=1.0)
+        self.assertEqual(list(indices), self.pulses)
+    def test_derivative(self):
+        """ A ramp down of 0.1V per sample from sample 300 has a slope of -1e8V/s between samples 300 and 301,
+        so the slope trigger is at sample 301, before the level trigger at 0.15V (sample 302)."""
+        waveform = numpy.zeros(1000)
+        waveform[300:306] = -0.1 * numpy.arange(6)
+        waveform[306:] = -0.5
+        indices = software_trigger.find_triggers(waveform, self.timebase, 5e7, derivative=True)
+        self.assertEqual(list(indices), [301])
+        indices = software_trigger.find_triggers(-waveform, self.timebase, 5e7, negative=False, derivative=True)
+        self.assertEqual(list(indices), [301])
+        indices = software_trigger.find_triggers(waveform, self.timebase, 0.15)
+        self.assertEqual(list(indices), [302])
+    def test_hold_off(self):
+        """ The pulse 30ns after another is held off by 50ns but not by 30ns, each hold off is from the last
+        trigger kept."""
+        indices = software_trigger.find_triggers(self.waveform, self.timebase, 0.1, hold_off=50e-9)
+        self.assertEqual(list(indices), [10, 200, 500, 995])
+        indices = software_trigger.find_triggers(self.waveform, self.timebase, 0.1, hold_off=30e-9)
+        self.assertEqual(list(indices), self.pulses)
+        waveform = numpy.zeros(1000)
+        waveform[100:200:20] = -0.5 # Every 20ns, so a 30ns hold off keeps every other one
+        indices = software_trigger.find_triggers(waveform, self.timebase, 0.1, hold_off=30e-9)
+        self.assertEqual(list(indices), [100, 140, 180])
+    def test_extract_events(self):
+        """ The window from -20ns to 30ns is 51 samples, the pulses at 10 and 995 don't have a whole window."""
+        window = (-20e-9, 30e-9)
+        events, indices = software_trigger.extract_events(self.waveform, self.timebase, self.pulses, window)
+        self.assertEqual(list(indices), [200, 230, 500])
+        self.assertEqual(events.shape, (3, 51))
+        for event, index in zip(events, indices):
+            self.assertTrue(numpy.array_equal(event, self.waveform[index - 20:index + 31]))
+        channels = numpy.array([self.waveform, 2.0 * self.waveform])
+        events, indices = software_trigger.extract_events(channels, self.timebase, self.pulses, window)
+        self.assertEqual(events.shape, (3, 2, 51))
+        self.assertTrue(numpy.array_equal(events[:, 1], 2.0 * events[:, 0]))
+        self.assertTrue(numpy.array_equal(events[1, 0], self.waveform[210:261]))
+        events, indices = software_trigger.extract_events(self.waveform, self.timebase, [], window)
+        self.assertEqual(events.shape, (0, 51))
+    def test_split_events(self):
+        """ The default hold off is the window length, so the pulse at 230 is held off, and the trigger times
+        and event times are from the timebases."""
+        window = (-20e-9, 30e-9)
+        events, times, timebase = software_trigger.split_events(self.waveform, self.timebase, 0.1, window)
+        self.assertEqual(events.shape, (2, 51))
+        self.assertTrue(numpy.allclose(times, [100e-9, 400e-9], rtol=1e-9, atol=0))
+        self.assertEqual(timebase.n_points, 51)
+        self.assertTrue(numpy.allclose(timebase.time(numpy.array([0, 20, 50])), [-20e-9, 0.0, 30e-9],
+                                       rtol=1e-9, atol=1e-18))
+        self.assertTrue(numpy.all(events[:, 20:25] == -0.5))
+        self.assertTrue(numpy.all(events[:, :20] == 0.0))
+        channels = numpy.array([self.waveform, numpy.arange(1000.0)])
+        events, times, timebase = software_trigger.split_events(self.waveform, self.timebase, 0.1, window,
+                                                                channels=channels)
+        self.assertEqual(events.shape, (2, 2, 51))
+        self.assertTrue(numpy.array_equal(events[:, 1, 20], [200.0, 500.0]))
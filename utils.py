@@ -9,25 +9,35 @@
 import re
 import os
 import shutil
+import numpy
+import backends
+import waveforms
 
 class File(object):
     """ Generic file, no saving."""
     def __init__(self, file_path, channels, extension):
-        """ Intialise the data structure."""
+        """ Intialise the data structure, channels is the number of channels (1 to channels) or a list of the
+        channel numbers."""
         self._file_path = file_path
         print "Using file", file_path + extension
         self._extension = extension
         self._data = {} # Dict by channel or list of waveforms
-        for channel in range(1, channels + 1):
+        if isinstance(channels, int):
+            channels = range(1, channels + 1)
+        for channel in channels:
             self._data[channel] = []
         self._meta_data = {} # Meta data dict
+        self._event = {} # Data for the event being assembled, by channel (see _add_to_event)
     def add_meta_dict(self, dict, prefix=""):
         """ Set the meta data for a whole dict."""
         for key in dict.keys():
             self._meta_data[prefix + key] = dict[key]
     def add_meta_data(self, key, data):
-        """ Set the meta data for key."""
-        self._meta_data[key] = data
+        """ Set the meta data for key, timebases are set as their scalar values (keys prefixed by key_)."""
+        if isinstance(data, waveforms.Timebase):
+            self.add_meta_dict(data.to_dict(), key + "_")
+        else:
+            self._meta_data[key] = data
     def add_data(self, data, channel):
         """ Add data for the channel."""
         self._data[channel].append(data)
@@ -37,8 +47,11 @@ class File(object):
     def get_data(self, channel):
         """ Get the data for channel."""
         return self._data[channel]
+    def get_timebase(self, key):
+        """ Get the timebase set as meta data for key."""
+        return waveforms.Timebase.from_dict(self._meta_data, key + "_")
     def autosave(self):
-        """ Save the data into a backup."""
+        """ Save the data, keeping a backup of the previous save. Append only files override this to flush."""
         if os.path.isfile(self._file_path + self._extension):
             shutil.copyfile(self._file_path + self._extension, self._file_path + "_bk" + self._extension)
         self._save(self._file_path + self._extension)
@@ -48,6 +61,26 @@ class File(object):
             os.remove(self._file_path + "_bk" + self._extension)
     def load(self):
         self._load(self._file_path + self._extension)
+#### Internal ######################################################################################
+    def _add_to_event(self, data, channel):
+        """ Add data for the channel to the event being assembled, for files that store whole events. Returns
+        the event (dict of arrays by channel) once all channels have data, otherwise None. Raises an Exception if
+        the channel is not in the file or already has data for this event."""
+        if not channel in self._data:
+            raise Exception("Channel %i is not in the file." % channel)
+        if channel in self._event:
+            raise Exception("Channel %i already has data, the event is incomplete." % channel)
+        self._event[channel] = numpy.asarray(data)
+        if len(self._event) < len(self._data):
+            return None
+        event, self._event = self._event, {}
+        return event
+    def _discard_incomplete_event(self):
+        """ Raise an Exception if an event is being assembled, its data is discarded."""
+        if len(self._event) > 0:
+            channels = sorted(self._event.keys())
+            self._event = {}
+            raise Exception("Incomplete event with data for channels %s only, not saved." % channels)
 #--- To Override -----------------------------------------------------------------------------------
     def close(self):
         """ Close/finish."""
@@ -58,6 +91,39 @@ class File(object):
     def _load(self, file_path):
         """ Load the data from a file."""
 
+class Reader(object):
+    """ Generic reader of a saved file, the events of each channel are read as asked for."""
+    def __enter__(self):
+        return self
+    def __exit__(self, type, value, traceback):
+        self.close()
+    def iterate(self, batch_size, channels=None, start=0, stop=None):
+        """ Iterate over the events from start to stop (default the end of the shortest channel) in batches of
+        batch_size events, yields the first event index and a dict of (events x samples) arrays by channel."""
+        if channels is None:
+            channels = self.get_channels()
+        if stop is None:
+            stop = min([self.get_n_events(channel) for channel in channels] or [0])
+        for batch_start in range(start, stop, batch_size):
+            batch_stop = min(batch_start + batch_size, stop)
+            yield batch_start, dict([(channel, self.get_data(channel, batch_start, batch_stop)) for channel in channels])
+#--- To Override -----------------------------------------------------------------------------------
+    def close(self):
+        """ Close the file."""
+        pass
+    def get_meta_data(self):
+        """ Return the meta data dict."""
+        return {}
+    def get_channels(self):
+        """ Return the channels with data."""
+        return []
+    def get_n_events(self, channel):
+        """ Return the number of events for the channel."""
+        return 0
+    def get_data(self, channel, start=0, stop=None):
+        """ Return the events from start to stop for the channel, as an (events x samples) array."""
+        pass
+
 #### Pickle ######################################################################################## 
 import pickle
 
@@ -79,11 +145,259 @@ class PickleFile(File):
         self._meta_data = full_data["meta"]
         self._data = full_data["data"]
 
+#### Record ####################################################################################### 
+import struct
+import time
+
+class RecordFile(File):
+    """ An append only binary file of fixed size event records. The file starts with a header (magic and the
+    pickled record dtype) that is written once, followed by a record per event of the timestamp and the data for
+    each channel. Each record is a single write, so a crash can at most lose the last partial record (which
+    readers ignore). The meta data is kept in a separate .meta file, replaced atomically when it changes."""
+    _magic = b"ATEKREC2"
+    _header_format = "<8sI" # Magic and pickled dtype length
+    def __init__(self, file_path, channels):
+        """ Initialise a record file."""
+        super(RecordFile, self).__init__(file_path, channels, ".rec")
+        self._file = None
+        self._dtype = None
+        self._meta_header = None # Last meta data written
+    def add_data(self, data, channel):
+        """ Add data for the channel, the event is written once all channels have data. Raises an Exception if
+        the channel is not in the file or already has data for this event."""
+        event = self._add_to_event(data, channel)
+        if event is not None:
+            self._write_event(event)
+    def get_data(self, channel):
+        """ Get the data for channel, read back from the file (the loaded data if no event has been written)."""
+        if self._dtype is None:
+            return list(self._data[channel])
+        self.autosave()
+        return list(RecordReader(self._file_path + self._extension).get_data(channel))
+    def autosave(self):
+        """ Flush the records to disk and write the meta data if it has changed."""
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._write_meta_data()
+    def save(self):
+        """ Flush the records to disk and close the file. Raises an Exception, after closing, if an event is
+        incomplete (its data is not saved)."""
+        if self._file is None:
+            self._open()
+        self.autosave()
+        self.close()
+        self._discard_incomplete_event()
+    def close(self):
+        """ Close the file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    def _load(self, file_path):
+        """ Load the data from a record file."""
+        reader = RecordReader(file_path)
+        self._meta_data = reader.get_meta_data()
+        for channel in reader.get_channels():
+            self._data[channel] = list(reader.get_data(channel))
+    def _open(self):
+        """ Create the file and write the header and the meta data."""
+        self._file = open(self._file_path + self._extension, "wb", 0) # Unbuffered, a write per record
+        header = pickle.dumps(self._dtype.descr if self._dtype is not None else None, 2)
+        self._file.write(struct.pack(RecordFile._header_format, RecordFile._magic, len(header)) + header)
+        self._write_meta_data()
+    def _write_meta_data(self):
+        """ Replace the meta data file, if the meta data has changed. The new file is written and synced before
+        it is renamed over the old one, so a crash leaves one or the other."""
+        meta_header = pickle.dumps(self._meta_data, 2)
+        if meta_header == self._meta_header:
+            return
+        meta_path = self._file_path + self._extension + ".meta"
+        with open(meta_path + ".tmp", "wb") as file_:
+            file_.write(meta_header)
+            file_.flush()
+            os.fsync(file_.fileno())
+        os.rename(meta_path + ".tmp", meta_path)
+        self._meta_header = meta_header
+    def _write_event(self, event):
+        """ Write the complete event as a record."""
+        if self._dtype is None: # First event defines the record layout
+            fields = [("timestamp", "<f8")]
+            for channel in sorted(event.keys()):
+                fields.append(("ch%i" % channel, event[channel].dtype, event[channel].shape))
+            self._dtype = numpy.dtype(fields)
+            self._open()
+        record = numpy.zeros(1, self._dtype)
+        record["timestamp"] = time.time()
+        for channel in event.keys():
+            record["ch%i" % channel] = event[channel]
+        self._file.write(record.tostring())
+
+class RecordReader(Reader):
+    """ Reader for record files, the records are memory mapped as a numpy structured array with fields
+    timestamp and chN."""
+    def __init__(self, file_path):
+        """ Open the record file at file_path (including the extension)."""
+        with open(file_path, "rb") as file_:
+            magic, length = struct.unpack(RecordFile._header_format,
+                                          file_.read(struct.calcsize(RecordFile._header_format)))
+            if magic != RecordFile._magic:
+                raise Exception("%s is not a record file." % file_path)
+            descr = pickle.loads(file_.read(length))
+        header_size = struct.calcsize(RecordFile._header_format) + length
+        self._meta_data = {}
+        if os.path.isfile(file_path + ".meta"):
+            with open(file_path + ".meta", "rb") as file_:
+                self._meta_data = pickle.load(file_)
+        self._records = None
+        if descr is not None:
+            dtype = numpy.dtype(descr)
+            events = (os.path.getsize(file_path) - header_size) // dtype.itemsize # Ignore any partial record
+            if events > 0:
+                self._records = numpy.memmap(file_path, dtype, "r", header_size, (events,))
+            else:
+                self._records = numpy.zeros(0, dtype)
+    def close(self):
+        """ Release the memory map."""
+        self._records = None
+    def get_records(self):
+        """ Return the structured array of records."""
+        return self._records
+    def get_meta_data(self):
+        """ Return the meta data dict."""
+        return self._meta_data
+    def get_channels(self):
+        """ Return the channels with data."""
+        if self._records is None:
+            return []
+        return sorted([int(name[2:]) for name in self._records.dtype.names if name.startswith("ch")])
+    def get_n_events(self, channel=None):
+        """ Return the number of events."""
+        if self._records is None:
+            return 0
+        return len(self._records)
+    def get_timestamps(self, start=0, stop=None):
+        """ Return the event timestamps from start to stop."""
+        return self._records["timestamp"][start:stop]
+    def get_data(self, channel, start=0, stop=None):
+        """ Return the events from start to stop for the channel, as an (events x samples) array."""
+        return self._records["ch%i" % channel][start:stop]
+
+#### Zero suppression ##############################################################################
+def zero_suppress(waveform, threshold, pre=0, post=0, baseline_samples=None, capacity=None):
+    """ Return the samples of the waveform further than threshold from its baseline (the mean of the first
+    baseline_samples, default a tenth), with pre samples before and post samples after, as a sparse structured
+    array of (index, value). The first entry is a sentinel, index the number of samples and value the baseline
+    that fills the suppressed samples. If capacity is given the array is that long (more samples are dropped,
+    fewer padded with copies of the sentinel), so every event has the same size."""
+    waveform = numpy.asarray(waveform)
+    n_samples = len(waveform)
+    if baseline_samples is None:
+        baseline_samples = max(1, n_samples // 10)
+    baseline = waveform[:baseline_samples].mean()
+    if waveform.dtype.kind in "iu":
+        baseline = numpy.rint(baseline)
+    over = numpy.abs(waveform - baseline) > threshold
+    # Keep samples with an over threshold sample within post before or pre after, from the cumulative counts
+    counts = numpy.concatenate(([0], numpy.cumsum(over)))
+    positions = numpy.arange(n_samples)
+    keep = counts[numpy.minimum(positions + pre + 1, n_samples)] - counts[numpy.maximum(positions - post, 0)] > 0
+    indices = numpy.flatnonzero(keep)
+    size = len(indices) + 1 if capacity is None else capacity
+    sparse = numpy.empty(size, _sparse_dtype(n_samples, waveform.dtype))
+    sparse["index"] = n_samples # Sentinel, and padding
+    sparse["value"] = baseline
+    indices = indices[:size - 1]
+    sparse["index"][1:len(indices) + 1] = indices
+    sparse["value"][1:len(indices) + 1] = waveform[indices]
+    return sparse
+
+def rebuild(sparse):
+    """ Return the dense waveform of a zero_suppress array, or the (events x samples) waveforms of an array,
+    object array or list of them (events of different lengths)."""
+    if not isinstance(sparse, numpy.ndarray) or sparse.dtype.names is None: # Events one by one
+        return numpy.array([rebuild(event) for event in sparse])
+    if sparse.ndim == 1:
+        waveform = numpy.empty(sparse["index"][0], sparse["value"].dtype)
+        waveform.fill(sparse["value"][0])
+        indices = sparse["index"][1:]
+        kept = indices < len(waveform)
+        waveform[indices[kept]] = sparse["value"][1:][kept]
+        return waveform
+    # Fixed capacity events at once
+    dense = numpy.repeat(sparse["value"][:, :1], sparse["index"][:, 0].max(), axis=1)
+    kept = sparse["index"] < sparse["index"][:, :1]
+    kept[:, 0] = False
+    events = numpy.nonzero(kept)[0]
+    dense[events, sparse["index"][kept]] = sparse["value"][kept]
+    return dense
+
+class ZeroSuppressedFile(object):
+    """ Zero suppression in front of a File, data added is stored as zero_suppress arrays and rebuilt when
+    got. Backends with fixed size events (RecordFile, HDF5StreamFile) need a capacity."""
+    def __init__(self, file_, threshold, pre=0, post=0, baseline_samples=None, capacity=None):
+        """ Store in the File file_, see zero_suppress for the other arguments (threshold is in the units of
+        the data added)."""
+        self._file = file_
+        self._arguments = (threshold, pre, post, baseline_samples, capacity)
+        self._file.add_meta_dict({ "threshold" : threshold, "pre" : pre, "post" : post,
+                                   "capacity" : capacity if capacity is not None else 0 }, "zero_suppression_")
+    def add_meta_dict(self, dict, prefix=""):
+        """ Set the meta data for a whole dict."""
+        self._file.add_meta_dict(dict, prefix)
+    def add_meta_data(self, key, data):
+        """ Set the meta data for key."""
+        self._file.add_meta_data(key, data)
+    def add_data(self, data, channel):
+        """ Add data for the channel, zero suppressed."""
+        self._file.add_data(zero_suppress(data, *self._arguments), channel)
+    def get_meta_data(self, key):
+        """ Get the meta data for key."""
+        return self._file.get_meta_data(key)
+    def get_data(self, channel):
+        """ Get the (rebuilt) data for channel."""
+        return [rebuild(sparse) for sparse in self._file.get_data(channel)]
+    def get_timebase(self, key):
+        """ Get the timebase set as meta data for key."""
+        return self._file.get_timebase(key)
+    def autosave(self):
+        self._file.autosave()
+    def save(self):
+        self._file.save()
+    def load(self):
+        self._file.load()
+    def close(self):
+        self._file.close()
+
+class ZeroSuppressedReader(Reader):
+    """ Reader for files saved via a ZeroSuppressedFile, wrapping a RecordReader or HDF5Reader and rebuilding
+    the dense waveforms as they are read."""
+    def __init__(self, reader):
+        """ Wrap the open reader."""
+        self._reader = reader
+    def close(self):
+        self._reader.close()
+    def get_meta_data(self):
+        """ Return the meta data dict."""
+        return self._reader.get_meta_data()
+    def get_channels(self):
+        """ Return the channels with data."""
+        return self._reader.get_channels()
+    def get_n_events(self, channel=None):
+        """ Return the number of events (for the channel)."""
+        return self._reader.get_n_events(channel)
+    def get_sparse_data(self, channel, start=0, stop=None):
+        """ Return the zero suppressed events from start to stop for the channel, as stored."""
+        return self._reader.get_data(channel, start, stop)
+    def get_data(self, channel, start=0, stop=None):
+        """ Return the rebuilt events from start to stop for the channel, as an (events x samples) array."""
+        return rebuild(self._reader.get_data(channel, start, stop))
+#### Internal ######################################################################################
+def _sparse_dtype(n_samples, value_dtype):
+    """ Return the sparse entry dtype, with the smallest index type holding the sentinel n_samples."""
+    return numpy.dtype([("index", "<u2" if n_samples < 2**16 else "<u4"), ("value", value_dtype)])
+
 #### h5py ########################################################################################## 
-try:
-    import h5py
-except ImportError:
-    pass # No hdf5 files for you!
+h5py = backends.LazyModule("h5py") # Loaded when a hdf5 file is first used
 
 class HDF5File(File):
     """ A hdf5 file."""
@@ -107,32 +421,248 @@ class HDF5File(File):
         with h5py.File(file_path, "r") as file_:
             for key in file_.attrs:
                 self._meta_data[key] = file_.attrs[key]
+            waveforms = []
             for dataset in file_:
-                channel_info = re.match("ch(\d)_(\d)", dataset)
-                channel = int(channel_info.groups()[0])
-                waveform = int(channel_info.groups()[1])
-                self._data[channel].append(file_[dataset].value)
+                channel_info = re.match("ch(\d+)_(\d+)$", dataset)
+                if channel_info is not None:
+                    waveforms.append((int(channel_info.groups()[1]), int(channel_info.groups()[0]), dataset))
+            for waveform, channel, dataset in sorted(waveforms): # File order is alphabetical not by waveform
+                self._data[channel].append(file_[dataset][()])
+
+class HDF5StreamFile(File):
+    """ A hdf5 file written as data is added. Each channel is a resizable, chunked (events x samples) dataset
+    chN, appended to in batches, so memory use and the cost of each autosave stay constant."""
+    def __init__(self, file_path, channels, batch_size=100, compression=None, compression_opts=None):
+        """ Initialise a streamed hdf5 file, data is written every batch_size events. compression is an optional
+        hdf5 filter e.g. gzip (with compression_opts the level) or lzf."""
+        super(HDF5StreamFile, self).__init__(file_path, channels, ".hdf5")
+        self._batch_size = batch_size
+        self._compression = compression
+        self._compression_opts = compression_opts
+        self._file = None
+    def add_data(self, data, channel):
+        """ Add data for the channel, writing the batch if complete."""
+        super(HDF5StreamFile, self).add_data(data, channel)
+        if len(self._data[channel]) >= self._batch_size:
+            self._flush()
+    def get_data(self, channel):
+        """ Get the data for channel, including that already written."""
+        written = []
+        if self._file is not None and ("ch%i" % channel) in self._file:
+            written = list(self._file["ch%i" % channel][()])
+        return written + self._data[channel]
+    def autosave(self):
+        """ Write any pending data and flush the file."""
+        self._flush()
+    def save(self):
+        """ Write any pending data and close the file."""
+        self._flush()
+        self.close()
+    def close(self):
+        """ Close the file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    def _load(self, file_path):
+        """ Load the data from a streamed hdf5 file."""
+        with h5py.File(file_path, "r") as file_:
+            for key in file_.attrs:
+                self._meta_data[key] = file_.attrs[key]
+            for channel in self._data.keys():
+                if ("ch%i" % channel) in file_:
+                    self._data[channel] = list(file_["ch%i" % channel][()])
+    def _flush(self):
+        """ Append the pending data to the channel datasets and flush the file."""
+        if self._file is None:
+            self._file = h5py.File(self._file_path + self._extension, "w")
+        for key in self._meta_data.keys():
+            self._file.attrs[key] = self._meta_data[key]
+        for channel in self._data.keys():
+            if len(self._data[channel]) == 0:
+                continue
+            batch = numpy.asarray(self._data[channel])
+            name = "ch%i" % channel
+            if name not in self._file:
+                # Chunks of whole events, limited to about 1MB
+                chunk_events = max(1, min(self._batch_size, 2**20 // max(1, batch[0].nbytes)))
+                self._file.create_dataset(name, shape=(0,) + batch.shape[1:], maxshape=(None,) + batch.shape[1:],
+                                          dtype=batch.dtype, chunks=(chunk_events,) + batch.shape[1:],
+                                          compression=self._compression, compression_opts=self._compression_opts)
+            dataset = self._file[name]
+            events = dataset.shape[0]
+            dataset.resize(events + len(batch), axis=0)
+            dataset[events:] = batch
+            self._data[channel] = []
+        self._file.flush()
+
+class HDF5Reader(Reader):
+    """ Lazy reader for saved hdf5 files (HDF5File or HDF5StreamFile), data is only read from the file when
+    asked for and then only the requested events."""
+    def __init__(self, file_path):
+        """ Open the hdf5 file at file_path (including the extension)."""
+        self._file = h5py.File(file_path, "r")
+        self._streamed = {} # Dataset by channel, for streamed files
+        self._waveforms = {} # List of per waveform datasets by channel, for HDF5File files
+        for dataset in self._file:
+            channel_info = re.match("ch(\d+)(?:_(\d+))?$", dataset)
+            if channel_info is None:
+                continue
+            channel = int(channel_info.groups()[0])
+            if channel_info.groups()[1] is None:
+                self._streamed[channel] = self._file[dataset]
+            else:
+                self._waveforms.setdefault(channel, []).append((int(channel_info.groups()[1]), dataset))
+        for channel in self._waveforms.keys():
+            self._waveforms[channel] = [self._file[dataset] for index, dataset in sorted(self._waveforms[channel])]
+    def close(self):
+        """ Close the file."""
+        self._file.close()
+    def get_meta_data(self):
+        """ Return the meta data dict, no waveform data is read."""
+        return dict(self._file.attrs)
+    def get_channels(self):
+        """ Return the channels with data."""
+        return sorted(self._streamed.keys() + self._waveforms.keys())
+    def get_n_events(self, channel):
+        """ Return the number of events for the channel."""
+        if channel in self._streamed:
+            return self._streamed[channel].shape[0]
+        return len(self._waveforms.get(channel, []))
+    def get_data(self, channel, start=0, stop=None):
+        """ Read the events from start to stop for the channel, as an (events x samples) array or, if the events
+        differ in length (e.g. zero suppressed), a 1-D object array of them."""
+        if channel in self._streamed:
+            return self._streamed[channel][start:stop]
+        data = [dataset[()] for dataset in self._waveforms[channel][start:stop]]
+        if len(set([event.shape for event in data])) <= 1:
+            return numpy.array(data)
+        events = numpy.empty(len(data), object)
+        for index, event in enumerate(data):
+            events[index] = event
+        return events
 
 #### root ########################################################################################## 
-try:
-    import ROOT
-except ImportError:
-    pass # No root files for you!
+ROOT = backends.LazyModule("ROOT") # Loaded when a root file is first used, as it is slow to import
 
 class RootFile(File):
-    """ A root file."""
-    def __init__(self, file_path, channels):
-        """ Initialise a root file."""
-        super(ROOTFile, self).__init__(file_path, channels, ".root")
-    def save(self, file_path):
-        """ Save of the data to a root file."""
-        self._file = ROOT.TFile(file_path, "RECREATE")
-        self._tree = ROOT.TTree("T", "Data tree")
-        self._branch_hists = {}
-        for channel in self._data.keys:
-            self._branch_hists[channel] = self._data[channel][0]
-            self._tree.Branch("channel_%i" % channel, "TH1D", self._hists[channel])
-        # Er??
-
-    def load(self):
+    """ A root file, events are filled into a tree (T) with a fixed size array branch per channel (chN) and a
+    timestamp branch. Meta data such as the scale factors is saved as a TParameter<double> (numbers) or TNamed
+    (anything else) per key."""
+    _leaf_types = { "i1" : "B", "u1" : "b", "i2" : "S", "u2" : "s", "i4" : "I", "u4" : "i", "i8" : "L",
+                    "u8" : "l", "f4" : "F", "f8" : "D" } # Root leaf type codes by numpy type
+    _numpy_types = { "Char_t" : "i1", "UChar_t" : "u1", "Short_t" : "i2", "UShort_t" : "u2", "Int_t" : "i4",
+                     "UInt_t" : "u4", "Long64_t" : "i8", "ULong64_t" : "u8", "Float_t" : "f4",
+                     "Double_t" : "f8" } # Numpy types by root leaf type name
+    def __init__(self, file_path, channels, batch_size=100):
+        """ Initialise a root file, events are filled into the tree batch_size at a time."""
+        super(RootFile, self).__init__(file_path, channels, ".root")
+        self._batch_size = batch_size
+        self._file = None
+        self._tree = None
+        self._buffers = {} # Branch buffers by branch name
+        self._events = [] # Complete events to be filled
+    def add_data(self, data, channel):
+        """ Add data for the channel, the event is complete once all channels have data. Raises an Exception if
+        the channel is not in the file or already has data for this event."""
+        event = self._add_to_event(data, channel)
+        if event is not None:
+            self._events.append((time.time(), event))
+            if len(self._events) >= self._batch_size:
+                self._fill()
+    def get_data(self, channel):
+        """ Get the data for channel, that filled into the tree (read back) and that still to be filled."""
+        filled = []
+        if self._tree is not None:
+            filled = self._read_tree(self._tree, { channel : self._buffers["ch%i" % channel] })[channel]
+        return filled + [event[channel] for timestamp, event in self._events]
+    def autosave(self):
+        """ Fill the pending events and save the tree header and the meta data."""
+        self._fill()
+        if self._file is not None:
+            self._write_meta_data()
+            self._tree.AutoSave("SaveSelf")
+    def save(self):
+        """ Fill the pending events, write the tree and close the file. Raises an Exception, after closing, if an
+        event is incomplete (its data is not saved)."""
+        self._fill()
+        if self._file is None:
+            self._open()
+        self._write_meta_data()
+        if self._tree is not None:
+            self._file.WriteTObject(self._tree, "T", "Overwrite")
+        self.close()
+        self._discard_incomplete_event()
+    def close(self):
+        """ Close the file."""
+        if self._file is not None:
+            self._file.Close()
+            self._file = None
+            self._tree = None
+    def _load(self, file_path):
         """ Load the data from a root file."""
+        file_ = ROOT.TFile(file_path, "READ")
+        for key in file_.GetListOfKeys():
+            if key.GetClassName().startswith("TParameter"):
+                self._meta_data[key.GetName()] = key.ReadObj().GetVal()
+            elif key.GetClassName() == "TNamed":
+                self._meta_data[key.GetName()] = key.ReadObj().GetTitle()
+        tree = file_.Get("T")
+        if tree:
+            buffers = {}
+            for channel in self._data.keys():
+                branch = tree.GetBranch("ch%i" % channel)
+                if not branch:
+                    continue
+                leaf = branch.GetLeaf("ch%i" % channel)
+                buffers[channel] = numpy.zeros(leaf.GetLenStatic(), RootFile._numpy_types[leaf.GetTypeName()])
+                tree.SetBranchAddress("ch%i" % channel, buffers[channel])
+            self._data.update(self._read_tree(tree, buffers))
+        file_.Close()
+    def _read_tree(self, tree, buffers):
+        """ Read every entry of the tree into the buffers (the branch addresses) by channel, returns the data
+        by channel. The buffers are read as numpy arrays, as PyROOT reads Char_t arrays as strings that end at
+        the first zero."""
+        data = dict([(channel, []) for channel in buffers.keys()])
+        scalar = dict([(channel, not "[" in tree.GetBranch("ch%i" % channel).GetTitle()) \
+                           for channel in buffers.keys()])
+        for entry in range(tree.GetEntries()):
+            tree.GetEntry(entry)
+            for channel, buffer_ in buffers.items():
+                data[channel].append(buffer_[0] if scalar[channel] else buffer_.copy())
+        return data
+    def _open(self):
+        """ Create the file, and the tree with branches laid out as the first event."""
+        self._file = ROOT.TFile(self._file_path + self._extension, "RECREATE")
+        if len(self._events) == 0:
+            return
+        self._tree = ROOT.TTree("T", "Data tree")
+        self._buffers["timestamp"] = numpy.zeros(1, numpy.float64)
+        self._tree.Branch("timestamp", self._buffers["timestamp"], "timestamp/D")
+        for channel, data in sorted(self._events[0][1].items()):
+            name = "ch%i" % channel
+            self._buffers[name] = numpy.zeros(max(1, data.size), data.dtype.newbyteorder("="))
+            leaf_type = RootFile._leaf_types[data.dtype.str[1:]]
+            if data.ndim == 0:
+                self._tree.Branch(name, self._buffers[name], "%s/%s" % (name, leaf_type))
+            else:
+                self._tree.Branch(name, self._buffers[name], "%s[%i]/%s" % (name, data.size, leaf_type))
+    def _fill(self):
+        """ Fill the tree with the complete events."""
+        if len(self._events) == 0:
+            return
+        if self._file is None:
+            self._open()
+        for timestamp, event in self._events:
+            self._buffers["timestamp"][0] = timestamp
+            for channel, data in event.items():
+                self._buffers["ch%i" % channel][:] = data.ravel()
+            self._tree.Fill()
+        self._events = []
+    def _write_meta_data(self):
+        """ Write (overwriting) the meta data."""
+        for key, value in self._meta_data.items():
+            if isinstance(value, (int, long, float, numpy.number)):
+                meta_data = ROOT.TParameter("double")(key, float(value))
+            else:
+                meta_data = ROOT.TNamed(key, str(value))
+            self._file.WriteTObject(meta_data, key, "Overwrite")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#
+# waveforms.py
+#
+# Containers for the waveform data returned by the scope.
+#
+####################################################################################################
+import numpy
+
+class RawWaveform(object):
+    """ Raw (integer) waveform samples, with the preamble scale factors to convert them to volts."""
+    def __init__(self, samples, y_zero, y_offset, y_mult):
+        """ Samples as sent by the scope, the scale factors are the preamble YZERO, YOFF and YMULT."""
+        self.samples = samples
+        self.y_zero = y_zero
+        self.y_offset = y_offset
+        self.y_mult = y_mult
+    @classmethod
+    def from_preamble(cls, samples, preamble):
+        """ Create from the samples and the channel preamble dict."""
+        return cls(samples, preamble['YZERO'], preamble['YOFF'], preamble['YMULT'])
+    def __len__(self):
+        return len(self.samples)
+    def get_scale_factors(self):
+        """ Return the scale factors as a dict keyed by preamble field name."""
+        return { 'YZERO' : self.y_zero, 'YOFF' : self.y_offset, 'YMULT' : self.y_mult }
+    def volts(self, out=None):
+        """ Return the waveform in volts. A single float array is allocated, or none if out (a float array
+        of the same shape) is given."""
+        if out is None:
+            out = self.samples.astype(numpy.float64)
+        else:
+            out[...] = self.samples
+        out -= self.y_offset
+        out *= self.y_mult
+        out += self.y_zero
+        return out
+
+def to_volts(samples, y_zero, y_offset, y_mult):
+    """ Convert raw samples (e.g. as saved to file) to volts using the preamble scale factors."""
+    return RawWaveform(samples, y_zero, y_offset, y_mult).volts()
+
+class Timebase(object):
+    """ The times of the waveform samples, evaluated only when asked for. Sample index i (from 0) is at
+    XZERO + (data_start + i - PT_OFF) * XINCR. Indexing and slicing return times, as for the array of all
+    the times which numpy.asarray(timebase) returns."""
+    def __init__(self, x_zero, x_incr, pt_off, data_start, n_points):
+        """ Initialise from the preamble XZERO, XINCR, PT_OFF and NR_PT values and the data start point."""
+        self.x_zero = x_zero
+        self.x_incr = x_incr
+        self.pt_off = pt_off
+        self.data_start = data_start
+        self.n_points = n_points
+    @classmethod
+    def from_preamble(cls, preamble, data_start):
+        """ Create from the channel preamble dict and the data start point."""
+        return cls(preamble['XZERO'], preamble['XINCR'], preamble['PT_OFF'], data_start, preamble['NR_PT'])
+    @classmethod
+    def from_dict(cls, values, prefix=""):
+        """ Create from a dict of the values (as to_dict), with keys prefixed by prefix."""
+        return cls(values[prefix + "XZERO"], values[prefix + "XINCR"], values[prefix + "PT_OFF"],
+                   values[prefix + "DATA_START"], values[prefix + "NR_PT"])
+    def to_dict(self):
+        """ Return the values as a dict of scalars."""
+        return { "XZERO" : self.x_zero, "XINCR" : self.x_incr, "PT_OFF" : self.pt_off,
+                 "DATA_START" : self.data_start, "NR_PT" : self.n_points }
+    def __len__(self):
+        return self.n_points
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.time(numpy.arange(*index.indices(self.n_points)))
+        if index < 0:
+            index += self.n_points
+        if index < 0 or index >= self.n_points:
+            raise IndexError("Timebase index out of range.")
+        return self.time(index)
+    def __array__(self, dtype=None):
+        times = self.time(numpy.arange(self.n_points))
+        return times if dtype is None else times.astype(dtype)
+    def time(self, index):
+        """ Return the time of the sample index (or array of indices)."""
+        return self.x_zero + (self.data_start + index - self.pt_off) * self.x_incr
+    def index(self, time):
+        """ Return the index of the sample nearest time (or array of times), this may be outside the waveform."""
+        return numpy.rint((time - self.x_zero) / self.x_incr + self.pt_off - self.data_start).astype(int)